@@ -0,0 +1,246 @@
+"""
+Async Healthcare Assistant
+asyncio variant of HealthcareAssistant for server processes: `await
+assistant.query(question)` returns the same result dict as the synchronous
+query(), without holding a thread or a database connection while the model
+generates. Bedrock calls (call_bedrock, with its retries, limiter and hedging)
+run on threads that only wait on the network, one per limiter slot; context
+builds run on psycopg2 on a small pool, each on connections borrowed for that
+build only; the audit trail is written with asyncpg when it is installed.
+concurrency_limits() reports how many of each can be in flight
+
+    assistant = await AsyncHealthcareAssistant.create(10000032)
+    result = await assistant.query("What medications is this patient on?")
+    await assistant.close()
+"""
+
+import asyncio
+import json
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from functools import partial
+from typing import Dict, Optional
+
+try:
+    import asyncpg
+except ImportError:  # Optional: without asyncpg the audit trail is written by psycopg2 on the DB threads
+    asyncpg = None
+
+from healthcare_assistant import (Config, ContextScope, HealthcareAssistant, PatientDataRetriever,
+                                  RETRIEVER_QUERIES, _positional_sql)
+
+logger = logging.getLogger(__name__)
+
+INSERT_KB_QUERY = _positional_sql(RETRIEVER_QUERIES['insert_kb_query'])
+INSERT_KB_CITATION = _positional_sql(RETRIEVER_QUERIES['insert_kb_citation'])
+
+_bedrock_executor = None
+_db_executor = None
+_executor_lock = threading.Lock()
+_audit_pool = None
+
+
+def available() -> bool:
+    """True when audit writes go through asyncpg"""
+    return asyncpg is not None
+
+
+def concurrency_limits() -> Dict[str, int]:
+    """
+    Ceilings of the async path: model calls in flight per model (or knowledge
+    base) are capped by the AIMD limiter and the Bedrock connection pool, the
+    threads waiting on them by ASYNC_BEDROCK_WORKERS, and context builds (each
+    on pooled psycopg2 connections) by ASYNC_DB_WORKERS and DB_POOL_MAX
+    """
+    return {
+        'bedrock_calls_per_model': Config.BEDROCK_CONCURRENCY_MAX,
+        'bedrock_threads': max(1, Config.ASYNC_BEDROCK_WORKERS),
+        'context_builds': max(1, min(Config.ASYNC_DB_WORKERS, Config.DB_POOL_MAX)),
+    }
+
+
+def get_bedrock_executor() -> ThreadPoolExecutor:
+    """Threads the Bedrock calls wait in (limiter slot, retries, model response)"""
+    global _bedrock_executor
+    with _executor_lock:
+        if _bedrock_executor is None:
+            _bedrock_executor = ThreadPoolExecutor(max_workers=concurrency_limits()['bedrock_threads'],
+                                                   thread_name_prefix='async-bedrock')
+        return _bedrock_executor
+
+
+def get_db_executor() -> ThreadPoolExecutor:
+    """Threads running context builds (and, without asyncpg, audit writes) on pooled psycopg2 connections"""
+    global _db_executor
+    with _executor_lock:
+        if _db_executor is None:
+            _db_executor = ThreadPoolExecutor(max_workers=concurrency_limits()['context_builds'],
+                                              thread_name_prefix='async-db')
+        return _db_executor
+
+
+async def get_audit_pool():
+    """Process-wide asyncpg pool for the audit trail (created on first use)"""
+    global _audit_pool
+    if _audit_pool is None:
+        pool = await asyncpg.create_pool(
+            host=Config.DB_HOST,
+            port=Config.DB_PORT,
+            database=Config.DB_NAME,
+            user=Config.DB_USER,
+            password=Config.DB_PASSWORD,
+            min_size=Config.DB_POOL_MIN,
+            max_size=Config.DB_POOL_MAX,
+        )
+        if _audit_pool is None:
+            _audit_pool = pool
+        else:  # another coroutine created one while this one was connecting
+            await pool.close()
+    return _audit_pool
+
+
+class _DeferredAuditAssistant(HealthcareAssistant):
+    """HealthcareAssistant whose audit records are queued for the async wrapper to write"""
+
+    def __init__(self, *args, **kwargs):
+        self.pending_audit = []
+        super().__init__(*args, **kwargs)
+
+    def _save_to_database(self, **record):
+        self.pending_audit.append(record)
+
+    def write_audit(self, record: Dict):
+        super()._save_to_database(**record)
+
+
+class AsyncHealthcareAssistant:
+    """HealthcareAssistant behind an asyncio query(); one question at a time per conversation"""
+
+    def __init__(self, assistant: _DeferredAuditAssistant):
+        self.assistant = assistant
+        self._stats = assistant.patient_retriever.stats
+        self._lock = asyncio.Lock()
+
+    @classmethod
+    async def create(cls, subject_id: int, session_id: Optional[str] = None,
+                     scope: Optional[ContextScope] = None, deadline: Optional[float] = None):
+        loop = asyncio.get_running_loop()
+        assistant = await loop.run_in_executor(
+            get_db_executor(), partial(_DeferredAuditAssistant, subject_id, session_id, scope, deadline)
+        )
+        assistant.patient_retriever.close()  # borrowed again by each context build
+        return cls(assistant)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    async def query(self, user_question: str) -> Dict:
+        """Route query to appropriate backend (direct or KB); same result as HealthcareAssistant.query()"""
+        async with self._lock:
+            a = self.assistant
+            start_time = datetime.now()
+            direct = a._route(user_question)
+            query_type = 'direct' if direct else 'kb'
+            session_id = 'direct-query' if direct else a.session_id
+            try:
+                passages = [] if direct else await self._run_bedrock(a._retrieve_passages, user_question)
+                if direct:
+                    prompt = await self._run_db(a._build_full_context_prompt, user_question)
+                else:
+                    prompt = await self._run_db(a._kb_prompt, user_question, passages)
+                cache_key = a._cache_key(user_question, query_type)
+                result = a._cached_result(user_question, cache_key, session_id, query_type, start_time)
+                if result is None:
+                    answer = await self._run_bedrock(a._generate, prompt)
+                    citations = [] if direct else a._kb_citations(passages)
+                    result = a._answer_result(user_question, answer, citations, session_id, query_type,
+                                              start_time, cache_key=cache_key)
+            except Exception as e:
+                result = a._exception_result(user_question, e, start_time)
+            await self._write_audit()
+            return result
+
+    def get_conversation_summary(self) -> str:
+        return self.assistant.get_conversation_summary()
+
+    async def close(self):
+        """Write any queued audit records (no connection is held between questions)"""
+        await self._write_audit()
+
+    async def _run_bedrock(self, fn, *args):
+        return await asyncio.get_running_loop().run_in_executor(get_bedrock_executor(), fn, *args)
+
+    async def _run_db(self, fn, *args):
+        return await asyncio.get_running_loop().run_in_executor(get_db_executor(), self._with_retriever, fn, args)
+
+    def _with_retriever(self, fn, args: tuple):
+        """fn(*args) with a fresh retriever whose connections go back to the pool afterwards"""
+        a = self.assistant
+        a.patient_retriever = PatientDataRetriever(stats=self._stats)
+        try:
+            return fn(*args)
+        finally:
+            a.patient_retriever.close()
+
+    async def _write_audit(self):
+        """Write the queued kb_queries / kb_citations records"""
+        a = self.assistant
+        records, a.pending_audit = a.pending_audit, []
+        if not records or not a.subject_id:
+            return
+        if asyncpg is None:
+            for record in records:
+                await self._run_db(a.write_audit, record)
+            return
+        try:
+            pool = await get_audit_pool()
+            for record in records:
+                await self._insert_query_records(pool, record)
+        except Exception as e:
+            logger.warning(f"Failed to save query to database: {e}")
+
+    async def _insert_query_records(self, pool, record: Dict):
+        """asyncpg version of HealthcareAssistant._insert_query_records"""
+        a = self.assistant
+        citations = record['citations'] or []
+        async with pool.acquire() as conn:
+            async with conn.transaction():
+                query_id = await conn.fetchval(
+                    INSERT_KB_QUERY,
+                    a.subject_id,
+                    record['question'],
+                    record['answer'],
+                    a.session_id,
+                    record['response_time_ms'],
+                    len(citations),
+                    record['success'],
+                    record['error_message'],
+                    Config.MODEL_ARN,
+                    record.get('cache_hit', False),
+                    datetime.now()
+                )
+                if not record['success']:
+                    return
+                rows = []
+                for citation in citations:
+                    for ref in citation.get('retrievedReferences', []):
+                        source_uri = ref.get('location', {}).get('s3Location', {}).get('uri', '')
+                        excerpt = ref.get('content', {}).get('text', '')
+                        metadata = {
+                            's3_uri': source_uri,
+                            'reference_type': ref.get('location', {}).get('type', 'S3')
+                        }
+                        rows.append((
+                            query_id,
+                            source_uri.split('/')[-1] if source_uri else 'Unknown',
+                            excerpt[:1000] if excerpt else None,
+                            json.dumps(metadata),
+                            datetime.now()
+                        ))
+                if rows:
+                    await conn.executemany(INSERT_KB_CITATION, rows)
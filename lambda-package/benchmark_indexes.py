@@ -0,0 +1,161 @@
+"""
+Retriever Index Benchmark
+Reports the query plan and latency of every PatientDataRetriever section query
+
+Typical before/after run:
+    python benchmark_indexes.py --output before.json
+    python benchmark_indexes.py --apply ../psql/migrations/001_composite_time_indexes.sql --output after.json --compare before.json
+"""
+
+import argparse
+import csv
+import json
+import statistics
+import time
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from healthcare_assistant import PatientDataRetriever, statement_sql
+
+DEMO_SUBJECTS_CSV = Path(__file__).resolve().parent.parent / 'demo_subject_id.csv'
+
+# (method, limit) exactly as build_patient_context calls them
+RETRIEVER_METHODS = [
+    ('get_patient_profile', None),
+    ('get_recent_admissions', 3),
+    ('get_diagnoses', 8),
+    ('get_procedures', 5),
+    ('get_recent_labs', 12),
+    ('get_medications', 10),
+    ('get_medication_administrations', 8),
+    ('get_provider_orders', 5),
+    ('get_icu_stays', None),
+    ('get_icu_vitals', 15),
+    ('get_icu_inputs', 8),
+]
+
+
+def load_subject_ids(count: Optional[int] = None) -> List[int]:
+    """Read the first `count` subject IDs (all when None) from demo_subject_id.csv"""
+    with open(DEMO_SUBJECTS_CSV, newline='') as f:
+        return [int(row['subject_id']) for row in csv.DictReader(f)][:count]
+
+
+def call_method(retriever: PatientDataRetriever, method: str, limit, subject_id: int):
+    fn = getattr(retriever, method)
+    return fn(subject_id) if limit is None else fn(subject_id, limit)
+
+
+def summarize_plan(plan: Dict) -> Dict:
+    """Collect node types and index names from an EXPLAIN (FORMAT JSON) plan tree"""
+    nodes, indexes = [], []
+
+    def walk(node):
+        nodes.append(node['Node Type'])
+        if 'Index Name' in node:
+            indexes.append(node['Index Name'])
+        for child in node.get('Plans', []):
+            walk(child)
+
+    root = plan['Plan']
+    walk(root)
+    return {
+        'nodes': nodes,
+        'indexes': sorted(set(indexes)),
+        'has_sort': 'Sort' in nodes or 'Incremental Sort' in nodes,
+        'planning_ms': plan.get('Planning Time'),
+        'execution_ms': plan.get('Execution Time'),
+        'shared_hit_blocks': root.get('Shared Hit Blocks', 0),
+        'shared_read_blocks': root.get('Shared Read Blocks', 0),
+    }
+
+
+def explain_last_query(retriever: PatientDataRetriever) -> Dict:
+    """EXPLAIN (ANALYZE, BUFFERS) the section statement the retriever just executed"""
+    sql = statement_sql(retriever.last_query)
+    retriever.read_cursor.execute("EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) " + sql)
+    return summarize_plan(retriever.read_cursor.fetchone()['QUERY PLAN'][0])
+
+
+def benchmark(retriever: PatientDataRetriever, subject_ids: List[int], runs: int) -> Dict:
+    results = {}
+    for method, limit in RETRIEVER_METHODS:
+        timings, plans, rows = [], [], 0
+        for subject_id in subject_ids:
+            call_method(retriever, method, limit, subject_id)  # warm cache
+            for _ in range(runs):
+                start = time.perf_counter()
+                result = call_method(retriever, method, limit, subject_id)
+                timings.append((time.perf_counter() - start) * 1000)
+            rows += len(result) if isinstance(result, list) else int(result is not None)
+            plans.append(explain_last_query(retriever))
+        retriever.read_conn.rollback()
+
+        timings.sort()
+        results[method] = {
+            'p50_ms': round(statistics.median(timings), 3),
+            'p95_ms': round(timings[round(0.95 * (len(timings) - 1))], 3),
+            'mean_rows': round(rows / len(subject_ids), 1),
+            'indexes': sorted({name for p in plans for name in p['indexes']}),
+            'sorts': sum(1 for p in plans if p['has_sort']),
+            'plan': plans[-1]['nodes'],
+            'shared_read_blocks': sum(p['shared_read_blocks'] for p in plans),
+        }
+    return results
+
+
+def print_report(results: Dict, baseline: Dict = None):
+    print("\n" + "="*100)
+    print(" RETRIEVER QUERY BENCHMARK")
+    print("="*100)
+    header = f"{'method':34} {'p50 ms':>9} {'p95 ms':>9} {'rows':>6} {'sorts':>6}"
+    if baseline:
+        header += f" {'before p50':>11} {'speedup':>8}"
+    print(header)
+    print("-"*100)
+    for method, r in results.items():
+        line = f"{method:34} {r['p50_ms']:>9.2f} {r['p95_ms']:>9.2f} {r['mean_rows']:>6} {r['sorts']:>6}"
+        if baseline and method in baseline:
+            before = baseline[method]['p50_ms']
+            speedup = before / r['p50_ms'] if r['p50_ms'] else float('inf')
+            line += f" {before:>11.2f} {speedup:>7.1f}x"
+        print(line)
+        print(f"   plan: {' > '.join(r['plan'])}")
+        print(f"   indexes: {', '.join(r['indexes']) or 'none (sequential scan)'}")
+    print("="*100 + "\n")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark retriever query plans and latency")
+    parser.add_argument('--subject-id', type=int, action='append', dest='subject_ids',
+                        help="Subject ID to benchmark (repeatable, default: first --subjects from demo_subject_id.csv)")
+    parser.add_argument('--subjects', type=int, default=10, help="Number of demo subjects to use")
+    parser.add_argument('--runs', type=int, default=5, help="Timed runs per method and subject")
+    parser.add_argument('--apply', metavar='SQL_FILE', help="Execute a migration (e.g. new indexes) before benchmarking")
+    parser.add_argument('--output', metavar='JSON_FILE', help="Write results to a JSON file")
+    parser.add_argument('--compare', metavar='JSON_FILE', help="Compare against a previous --output file")
+    args = parser.parse_args()
+
+    subject_ids = args.subject_ids or load_subject_ids(args.subjects)
+    retriever = PatientDataRetriever()
+
+    try:
+        if args.apply:
+            print(f" Applying {args.apply}...")
+            retriever.cursor.execute(Path(args.apply).read_text())
+            retriever.conn.commit()
+
+        results = benchmark(retriever, subject_ids, args.runs)
+    finally:
+        retriever.close()
+
+    baseline = json.loads(Path(args.compare).read_text()) if args.compare else None
+    print_report(results, baseline)
+
+    if args.output:
+        Path(args.output).write_text(json.dumps(results, indent=2))
+        print(f" Results saved to: {args.output}\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+"""
+Prepared Statement Micro-benchmark
+Measures the planning time saved per context build by PREPAREd retriever statements
+
+    python benchmark_prepared.py --subjects 10 --runs 20
+"""
+
+import argparse
+import statistics
+import time
+from typing import Dict, List
+
+import healthcare_assistant
+from healthcare_assistant import CONTEXT_SECTIONS, Config, PatientDataRetriever, RETRIEVER_QUERIES, TREND_SECTIONS
+from benchmark_indexes import load_subject_ids
+
+
+def planning_ms(retriever: PatientDataRetriever, sql: str, params: tuple) -> float:
+    retriever.cursor.execute("EXPLAIN (ANALYZE, SUMMARY, FORMAT JSON) " + sql, params)
+    return retriever.cursor.fetchone()['QUERY PLAN'][0]['Planning Time']
+
+
+def measure_planning(retriever: PatientDataRetriever, subject_ids: List[int], runs: int) -> Dict[str, Dict]:
+    """Planning time per section: plain SQL vs EXECUTE of the prepared statement"""
+    results = {}
+    for name, method, limit in CONTEXT_SECTIONS:
+        if name in TREND_SECTIONS:
+            limit = None  # applied to the summaries, not in SQL
+        plain, prepared = [], []
+        statement = f"hc_{method}"
+        for subject_id in subject_ids:
+            _, params = retriever.section_statement(method, subject_id, limit)
+            # Run past Postgres' five custom-plan executions so a generic plan can be cached
+            for _ in range(max(runs, 6)):
+                retriever.execute_named(method, params).fetchall()
+            placeholders = ', '.join(['%s'] * len(params))
+            plain.append(planning_ms(retriever, RETRIEVER_QUERIES[method], params))
+            prepared.append(planning_ms(retriever, f"EXECUTE {statement} ({placeholders})", params))
+        results[method] = {
+            'plain_ms': statistics.mean(plain),
+            'prepared_ms': statistics.mean(prepared),
+        }
+    retriever.conn.rollback()
+    return results
+
+
+def measure_builds(retriever: PatientDataRetriever, subject_ids: List[int], runs: int, prepared: bool) -> float:
+    """Mean wall time of build_patient_context with prepared statements on or off"""
+    Config.DB_PREPARED_STATEMENTS = prepared
+    timings = []
+    for subject_id in subject_ids:
+        retriever.build_patient_context(subject_id, concurrent=False)  # warm up / PREPARE
+        for _ in range(runs):
+            start = time.perf_counter()
+            retriever.build_patient_context(subject_id, concurrent=False)
+            timings.append((time.perf_counter() - start) * 1000)
+        retriever.conn.rollback()
+    return statistics.mean(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark prepared retriever statements")
+    parser.add_argument('--subject-id', type=int, action='append', dest='subject_ids')
+    parser.add_argument('--subjects', type=int, default=10, help="Number of demo subjects to use")
+    parser.add_argument('--runs', type=int, default=20, help="Timed context builds per subject and mode")
+    args = parser.parse_args()
+
+    subject_ids = args.subject_ids or load_subject_ids(args.subjects)
+    retriever = PatientDataRetriever()
+
+    try:
+        Config.DB_PREPARED_STATEMENTS = True
+        planning = measure_planning(retriever, subject_ids, args.runs)
+        if not healthcare_assistant._prepared_statements_supported:
+            print("\n Prepared statements are unavailable on this connection (transaction-mode pooler?)\n")
+            return
+        plain_build = measure_builds(retriever, subject_ids, args.runs, prepared=False)
+        prepared_build = measure_builds(retriever, subject_ids, args.runs, prepared=True)
+    finally:
+        retriever.close()
+
+    print("\n" + "="*80)
+    print(" PLANNING TIME PER STATEMENT (mean ms)")
+    print("="*80)
+    print(f"{'statement':34} {'plain':>10} {'prepared':>10} {'saved':>10}")
+    print("-"*80)
+    for method, r in planning.items():
+        print(f"{method:34} {r['plain_ms']:>10.3f} {r['prepared_ms']:>10.3f} {r['plain_ms'] - r['prepared_ms']:>10.3f}")
+    saved = sum(r['plain_ms'] - r['prepared_ms'] for r in planning.values())
+    print("-"*80)
+    print(f"{'planning saved per context build':34} {saved:>32.3f}")
+    print("\n" + "="*80)
+    print(" CONTEXT BUILD WALL TIME (mean ms)")
+    print("="*80)
+    print(f"Plain SQL:            {plain_build:.2f}")
+    print(f"Prepared statements:  {prepared_build:.2f}")
+    print(f"Saved per build:      {plain_build - prepared_build:.2f}")
+    print("="*80 + "\n")
+
+
+if __name__ == "__main__":
+    main()
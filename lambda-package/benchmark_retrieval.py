@@ -0,0 +1,126 @@
+"""
+Local Retrieval Benchmark
+Compares BM25 (kb_index.py) with the dense vector index (vector_index.py) in
+exact, IVF and IVF-PQ modes over the knowledge base documents. Each chunk's
+own heading is used as a query for it, which gives hit rate / MRR without
+labelled data. --scale N repeats the corpus N times (with jittered vectors) to
+measure how the dense modes hold up on larger collections; there the copies
+crowd each other out of the top k, so compare the approximate modes by their
+recall of the exact results rather than by hit rate
+
+    python benchmark_retrieval.py
+    python benchmark_retrieval.py --scale 200 -k 5
+"""
+
+import argparse
+import statistics
+import time
+from typing import Callable, Dict, List
+
+import numpy as np
+
+import kb_index
+import vector_index
+from healthcare_assistant import Config
+
+
+def evaluation_queries(chunks: List[tuple]) -> List[tuple]:
+    """(query, relevant (source, heading) key) from each chunk's innermost heading"""
+    seen, queries = set(), []
+    for source, heading, _ in chunks:
+        key = (source, heading)
+        leaf = heading.split(' > ')[-1]
+        if key not in seen and len(kb_index.tokenize(leaf)) >= 2:
+            seen.add(key)
+            queries.append((leaf, key))
+    return queries
+
+
+def passage_key(passage: Dict) -> tuple:
+    return passage['location']['s3Location']['uri'].split('/')[-1], passage['metadata']['heading']
+
+
+def evaluate(search: Callable[[str, int], List[Dict]], queries: List[tuple], k: int,
+             reference: List[set] = None) -> Dict:
+    """Hit rate / MRR of the relevant chunk, latency, and overlap with reference (exact) results"""
+    timings, hits, reciprocal_ranks, results = [], 0, [], []
+    for query, key in queries:
+        start = time.perf_counter()
+        passages = search(query, k)
+        timings.append((time.perf_counter() - start) * 1000)
+        ranks = [i for i, p in enumerate(passages, 1) if passage_key(p) == key]
+        hits += bool(ranks)
+        reciprocal_ranks.append(1 / ranks[0] if ranks else 0.0)
+        # Jittered copies differ in score, so (key, score) tells them apart
+        results.append({passage_key(p) + (p['score'],) for p in passages})
+    timings.sort()
+    return {
+        'hit_rate': hits / len(queries),
+        'mrr': statistics.mean(reciprocal_ranks),
+        'p50_ms': statistics.median(timings),
+        'p95_ms': timings[round(0.95 * (len(timings) - 1))],
+        'vs_exact': statistics.mean(len(r & e) / max(len(e), 1) for r, e in zip(results, reference))
+                    if reference else None,
+        'results': results,
+    }
+
+
+def scaled_index(base: vector_index.VectorIndex, scale: int, mode: str, seed: int = 0) -> vector_index.VectorIndex:
+    """The base corpus repeated `scale` times, copies jittered so clusters and codes have real work to do"""
+    rng = np.random.default_rng(seed)
+    vectors = np.tile(np.asarray(base.vectors), (scale, 1))
+    vectors[len(base.vectors):] += rng.normal(0, 0.02, vectors[len(base.vectors):].shape).astype(np.float32)
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    index = vector_index.VectorIndex(vectors, base.chunks * scale, base.embedder, base.uri_prefix, mode)
+    if mode != 'exact':
+        index.train_ivf(int(np.sqrt(len(vectors))))
+    if mode == 'ivfpq':
+        index.train_pq(vectors.shape[1] // 8)
+    return index
+
+
+def print_report(results: Dict[str, Dict], chunks: int, queries: int, k: int):
+    print("\n" + "="*80)
+    print(f" LOCAL RETRIEVAL BENCHMARK ({chunks} chunks, {queries} heading queries, top {k})")
+    print("="*80)
+    print(f"{'engine':22} {'hit rate':>9} {'MRR':>7} {'p50 ms':>9} {'p95 ms':>9} {'recall vs exact':>16}")
+    print("-"*80)
+    for name, r in results.items():
+        recall = f"{r['vs_exact']:.1%}" if r['vs_exact'] is not None else '-'
+        print(f"{name:22} {r['hit_rate']:>9.1%} {r['mrr']:>7.3f} {r['p50_ms']:>9.3f} {r['p95_ms']:>9.3f} {recall:>16}")
+    print("="*80 + "\n")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark BM25 and dense retrieval over the KB documents")
+    parser.add_argument('-k', type=int, default=Config.KB_NUMBER_OF_RESULTS)
+    parser.add_argument('--docs', default=Config.LOCAL_KB_DIR, help="Directory of the markdown documents")
+    parser.add_argument('--scale', type=int, default=1, help="Repeat the corpus this many times for the dense modes")
+    parser.add_argument('--nprobe', type=int, default=8, help="IVF clusters scanned per query")
+    args = parser.parse_args()
+
+    chunks = kb_index.load_chunks(args.docs)
+    queries = evaluation_queries(chunks)
+    results = {}
+
+    bm25 = kb_index.BM25Index(chunks, Config.LOCAL_KB_URI_PREFIX)
+    results['bm25'] = evaluate(bm25.search, queries, args.k)
+
+    start = time.perf_counter()
+    base = vector_index.VectorIndex.build(chunks, uri_prefix=Config.LOCAL_KB_URI_PREFIX)
+    print(f" Embedded {len(chunks)} chunks in {(time.perf_counter() - start) * 1000:.0f}ms")
+
+    for mode in vector_index.MODES:
+        start = time.perf_counter()
+        index = scaled_index(base, args.scale, mode) if args.scale > 1 else \
+            vector_index.VectorIndex.build(chunks, base.embedder, Config.LOCAL_KB_URI_PREFIX, mode)
+        index.nprobe = args.nprobe
+        print(f" Built {mode} index over {len(index.vectors)} vectors in {(time.perf_counter() - start) * 1000:.0f}ms")
+        exact = results.get('dense exact')
+        results[f"dense {mode}"] = evaluate(index.search, queries, args.k, exact and exact['results'])
+
+    print_report(results, len(chunks) * args.scale, len(queries), args.k)
+
+
+if __name__ == "__main__":
+    main()
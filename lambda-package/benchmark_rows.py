@@ -0,0 +1,117 @@
+"""
+Row Representation Benchmark
+Compares RealDictCursor dict rows with the tuple cursor + SectionRow classes
+PatientDataRetriever uses: fetch time, client CPU time and memory held by the
+rows of each cohort section query
+
+    python benchmark_rows.py --subjects 100 --runs 5
+"""
+
+import argparse
+import statistics
+import time
+import tracemalloc
+from typing import Callable, Dict, List
+
+from psycopg2.extensions import cursor as PgCursor
+from psycopg2.extras import RealDictCursor
+
+from healthcare_assistant import CONTEXT_SECTIONS, DICTIONARY_COLUMNS, TREND_SECTIONS, PatientDataRetriever, section_rows
+from benchmark_indexes import load_subject_ids
+
+
+def fetch_dicts(retriever: PatientDataRetriever, name: str, params: tuple) -> list:
+    with retriever.read_conn.cursor(cursor_factory=RealDictCursor) as cursor:
+        retriever.execute_named(name, params, cursor=cursor)
+        return cursor.fetchall()
+
+
+def fetch_section_rows(retriever: PatientDataRetriever, name: str, params: tuple, extra_columns: tuple) -> list:
+    with retriever.read_conn.cursor(cursor_factory=PgCursor) as cursor:
+        retriever.execute_named(name, params, cursor=cursor)
+        return section_rows(cursor, cursor.fetchall(), extra_columns)
+
+
+def measure(fetch: Callable[[], list], runs: int) -> Dict:
+    """Median wall / CPU time of fetch() and the memory its rows hold (tracemalloc, separate run)"""
+    fetch()  # warm up: plan cache, generated row class
+    timings, cpu = [], []
+    for _ in range(runs):
+        start, start_cpu = time.perf_counter(), time.process_time()
+        rows = fetch()
+        timings.append((time.perf_counter() - start) * 1000)
+        cpu.append((time.process_time() - start_cpu) * 1000)
+        del rows
+
+    tracemalloc.start()
+    rows = fetch()
+    retained, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {
+        'rows': len(rows),
+        'ms': statistics.median(timings),
+        'cpu_ms': statistics.median(cpu),
+        'retained_kib': retained / 1024,
+        'peak_kib': peak / 1024,
+    }
+
+
+def benchmark(retriever: PatientDataRetriever, subject_ids: List[int], runs: int) -> Dict[str, Dict]:
+    results = {}
+    for name, method, limit in CONTEXT_SECTIONS:
+        if name in TREND_SECTIONS:
+            continue  # already fetched as plain tuples
+        _, params = retriever.section_statement(method, subject_ids, limit)
+        statement = f"cohort_{method}"
+        extra_columns = DICTIONARY_COLUMNS.get(method, ())
+        results[name] = {
+            'dict': measure(lambda: fetch_dicts(retriever, statement, params), runs),
+            'slots': measure(lambda: fetch_section_rows(retriever, statement, params, extra_columns), runs),
+        }
+    retriever.read_conn.rollback()
+    return results
+
+
+def print_report(results: Dict[str, Dict], subjects: int):
+    print("\n" + "="*100)
+    print(f" ROW REPRESENTATION BENCHMARK ({subjects} subjects, cohort statements)")
+    print("="*100)
+    print(f"{'section':14} {'rows':>7} {'dict ms':>9} {'slots ms':>9} {'dict cpu':>9} {'slots cpu':>10}"
+          f" {'dict KiB':>10} {'slots KiB':>10} {'memory':>7}")
+    print("-"*100)
+    totals = {'dict': [0.0, 0.0, 0.0], 'slots': [0.0, 0.0, 0.0]}
+    for name, r in results.items():
+        d, s = r['dict'], r['slots']
+        ratio = s['retained_kib'] / d['retained_kib'] if d['retained_kib'] else 0
+        print(f"{name:14} {d['rows']:>7} {d['ms']:>9.2f} {s['ms']:>9.2f} {d['cpu_ms']:>9.2f} {s['cpu_ms']:>10.2f}"
+              f" {d['retained_kib']:>10.1f} {s['retained_kib']:>10.1f} {ratio:>6.0%}")
+        for kind in totals:
+            totals[kind][0] += r[kind]['ms']
+            totals[kind][1] += r[kind]['cpu_ms']
+            totals[kind][2] += r[kind]['retained_kib']
+    print("-"*100)
+    d, s = totals['dict'], totals['slots']
+    print(f"{'total':14} {'':>7} {d[0]:>9.2f} {s[0]:>9.2f} {d[1]:>9.2f} {s[1]:>10.2f}"
+          f" {d[2]:>10.1f} {s[2]:>10.1f} {s[2] / d[2] if d[2] else 0:>6.0%}")
+    print("="*100 + "\n")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark dict rows against SectionRow classes")
+    parser.add_argument('--subject-id', type=int, action='append', dest='subject_ids')
+    parser.add_argument('--subjects', type=int, default=100, help="Number of demo subjects to use")
+    parser.add_argument('--runs', type=int, default=5, help="Timed fetches per section and representation")
+    args = parser.parse_args()
+
+    subject_ids = sorted(set(args.subject_ids or load_subject_ids(args.subjects)))
+    retriever = PatientDataRetriever()
+    try:
+        results = benchmark(retriever, subject_ids, args.runs)
+    finally:
+        retriever.close()
+
+    print_report(results, len(subject_ids))
+
+
+if __name__ == "__main__":
+    main()
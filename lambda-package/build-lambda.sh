@@ -7,6 +7,10 @@ echo "🏗️  Building Lambda deployment package for Linux (Python 3.12)..."
 rm -rf lambda-deployment
 mkdir lambda-deployment
 
+# Knowledge base documents for local BM25 retrieval (KB_RETRIEVAL=local)
+mkdir lambda-deployment/knowledge_base
+cp "../s3 bucket files/"*.md lambda-deployment/knowledge_base/
+
 echo "📦 Installing ALL dependencies in Docker (Linux environment)..."
 # Use --entrypoint to override the default Lambda entrypoint
 docker run --rm \
@@ -20,6 +24,7 @@ docker run --rm \
       boto3 \
       botocore \
       python-dotenv \
+      numpy \
       -t /packages && \
     echo '✅ All dependencies installed' && \
     echo '' && \
@@ -28,6 +33,16 @@ docker run --rm \
     echo '✅ Copied healthcare_assistant.py' && \
     cp /src/lambda_handler.py /packages/ && \
     echo '✅ Copied lambda_handler.py' && \
+    cp /src/trend_summary.py /packages/ && \
+    echo '✅ Copied trend_summary.py' && \
+    cp /src/clinical_dictionaries.py /packages/ && \
+    echo '✅ Copied clinical_dictionaries.py' && \
+    cp /src/cache_files.py /packages/ && \
+    echo '✅ Copied cache_files.py' && \
+    cp /src/kb_index.py /packages/ && \
+    echo '✅ Copied kb_index.py' && \
+    cp /src/vector_index.py /packages/ && \
+    echo '✅ Copied vector_index.py' && \
     echo '' && \
     echo '📂 Package contents:' && \
     ls -la /packages/ | head -20
@@ -0,0 +1,70 @@
+"""
+Cache Files
+On-disk caches that are reused across cold starts (dictionaries, KB indexes).
+They are pickles, and loading a pickle can run code, so a cache is only read
+from a file the current user owns, that nobody else can write, in a directory
+nobody else can write to. Caches are written atomically with 0600 permissions,
+by default under a per-user 0700 directory in the system temp dir
+"""
+
+import getpass
+import os
+import pickle
+import stat
+import tempfile
+
+
+def private_cache_dir(name: str = 'healthcare-rag') -> str:
+    """Per-user cache directory under the system temp dir (created 0700 on first write)"""
+    user = os.getuid() if hasattr(os, 'getuid') else getpass.getuser()
+    return os.path.join(tempfile.gettempdir(), f"{name}-{user}")
+
+
+def _owned(st: os.stat_result) -> bool:
+    return not hasattr(os, 'getuid') or st.st_uid == os.getuid()
+
+
+def trusted_dir(path: str) -> bool:
+    """Owned by the current user (or root) and writable only by its owner, unless sticky like /tmp"""
+    st = os.stat(path)
+    if not (_owned(st) or st.st_uid == 0):
+        return False
+    return not st.st_mode & (stat.S_IWGRP | stat.S_IWOTH) or bool(st.st_mode & stat.S_ISVTX)
+
+
+def trusted_file(path: str) -> bool:
+    """A regular file (not a symlink) the current user owns, writable by nobody else, in a trusted_dir"""
+    st = os.lstat(path)
+    return (stat.S_ISREG(st.st_mode) and _owned(st) and not st.st_mode & (stat.S_IWGRP | stat.S_IWOTH)
+            and trusted_dir(os.path.dirname(os.path.abspath(path))))
+
+
+def ensure_private_dir(path: str):
+    """Create path (0700) if missing; OSError when it exists but is not a trusted_dir"""
+    os.makedirs(path, mode=0o700, exist_ok=True)
+    if not trusted_dir(path):
+        raise OSError(f"{path} is writable by other users or owned by another user")
+
+
+def load_pickle(path: str):
+    """Unpickle path; OSError when it is not a trusted_file"""
+    if not trusted_file(path):
+        raise OSError(f"{path} is not a private cache file (owner or permissions)")
+    with open(path, 'rb') as f:
+        return pickle.load(f)
+
+
+def dump_pickle(obj, path: str):
+    """Pickle obj to path through a 0600 temporary file in its (private) directory"""
+    directory = os.path.dirname(os.path.abspath(path))
+    ensure_private_dir(directory)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC | getattr(os, 'O_NOFOLLOW', 0), 0o600)
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            pickle.dump(obj, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
@@ -0,0 +1,102 @@
+"""
+Clinical Dictionaries
+In-process copies of the static MIMIC-IV lookup tables (d_labitems, d_items,
+d_icd_diagnoses, d_icd_procedures), so retriever queries read only the fact
+tables and labels are attached in Python
+"""
+
+import logging
+import os
+import pickle
+from typing import Callable, Dict, Iterable, List, Optional
+
+import cache_files
+
+logger = logging.getLogger(__name__)
+
+# Loaded through PatientDataRetriever.execute_read (plain tuple rows)
+DICTIONARY_QUERIES = {
+    'dictionary_fingerprint': """
+        SELECT concat_ws(':',
+            (SELECT COUNT(*) FROM d_labitems),
+            (SELECT COUNT(*) FROM d_items),
+            (SELECT COUNT(*) FROM d_icd_diagnoses),
+            (SELECT COUNT(*) FROM d_icd_procedures)
+        )
+    """,
+    'dictionary_lab_items': "SELECT itemid, label, fluid, category FROM d_labitems",
+    'dictionary_items': """
+        SELECT itemid, label, category, unitname, lownormalvalue, highnormalvalue FROM d_items
+    """,
+    'dictionary_icd_diagnoses': "SELECT icd_code, icd_version, long_title FROM d_icd_diagnoses",
+    'dictionary_icd_procedures': "SELECT icd_code, icd_version, long_title FROM d_icd_procedures",
+}
+
+# d_items categories charted as ICU vitals
+VITAL_CATEGORIES = ('Vital Signs', 'Labs', 'Respiratory')
+
+NO_LAB_ITEM = (None, None, None)
+NO_ITEM = (None, None, None, None, None)
+
+
+class ClinicalDictionaries:
+    """Lookup tables keyed by itemid / (icd_code, icd_version), values as tuples"""
+
+    def __init__(self, lab_items: Dict[int, tuple], items: Dict[int, tuple],
+                 icd_diagnoses: Dict[tuple, str], icd_procedures: Dict[tuple, str]):
+        self.lab_items = lab_items  # itemid -> (label, fluid, category)
+        self.items = items  # itemid -> (label, category, unitname, lownormalvalue, highnormalvalue)
+        self.icd_diagnoses = icd_diagnoses  # (icd_code, icd_version) -> long_title
+        self.icd_procedures = icd_procedures
+        self.category_itemids = {}
+        for itemid, item in items.items():
+            self.category_itemids.setdefault(item[1], []).append(itemid)
+        for itemids in self.category_itemids.values():
+            itemids.sort()
+        self.vital_itemids = self.itemids_for(VITAL_CATEGORIES)
+
+    def itemids_for(self, categories: Iterable[str]) -> List[int]:
+        """Sorted d_items itemids in any of the categories"""
+        return sorted(i for category in categories for i in self.category_itemids.get(category, []))
+
+    def lab_item(self, itemid: int) -> tuple:
+        return self.lab_items.get(itemid, NO_LAB_ITEM)
+
+    def item(self, itemid: int) -> tuple:
+        return self.items.get(itemid, NO_ITEM)
+
+    def diagnosis_title(self, icd_code: str, icd_version: int) -> Optional[str]:
+        return self.icd_diagnoses.get((icd_code, icd_version))
+
+    def procedure_title(self, icd_code: str, icd_version: int) -> Optional[str]:
+        return self.icd_procedures.get((icd_code, icd_version))
+
+
+def load_dictionaries(fetch: Callable[[str], List[tuple]], cache_path: Optional[str] = None) -> ClinicalDictionaries:
+    """
+    Load the dictionaries with fetch(query_name) -> rows, reusing the pickle at
+    cache_path when it was written from tables with the same row counts (and
+    is a private file, see cache_files)
+    """
+    fingerprint = fetch('dictionary_fingerprint')[0][0]
+    if cache_path and os.path.exists(cache_path):
+        try:
+            cached = cache_files.load_pickle(cache_path)
+            if cached['fingerprint'] == fingerprint:
+                return cached['dictionaries']
+        except (OSError, pickle.UnpicklingError, EOFError, KeyError, AttributeError) as e:
+            logger.debug(f"Ignoring unreadable dictionary cache {cache_path}: {e}")
+
+    dictionaries = ClinicalDictionaries(
+        lab_items={row[0]: tuple(row[1:]) for row in fetch('dictionary_lab_items')},
+        items={row[0]: tuple(row[1:]) for row in fetch('dictionary_items')},
+        icd_diagnoses={(row[0], row[1]): row[2] for row in fetch('dictionary_icd_diagnoses')},
+        icd_procedures={(row[0], row[1]): row[2] for row in fetch('dictionary_icd_procedures')},
+    )
+
+    if cache_path:
+        try:
+            cache_files.dump_pickle({'fingerprint': fingerprint, 'dictionaries': dictionaries}, cache_path)
+        except OSError as e:
+            logger.debug(f"Could not write dictionary cache {cache_path}: {e}")
+    return dictionaries
@@ -0,0 +1,60 @@
+"""
+Export Patient Records
+Streams a patient's complete record, every event in time order, to NDJSON
+(one JSON object per line) for chart review or offline evaluation. Rows are
+read through server-side cursors, so memory use does not grow with the history.
+
+    python export_patient.py --subject-id 10000032
+    python export_patient.py --subject-id 10000032 --types lab chart --output labs_vitals.ndjson.gz
+"""
+
+import argparse
+import gzip
+import sys
+import time
+
+from healthcare_assistant import EXPORT_QUERIES, PatientDataRetriever
+
+
+def open_output(path: str):
+    if path == '-':
+        return sys.stdout
+    if path.endswith('.gz'):
+        return gzip.open(path, 'wt', encoding='utf-8')
+    return open(path, 'w', encoding='utf-8')
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export a patient's full event history as NDJSON")
+    parser.add_argument('--subject-id', type=int, required=True)
+    parser.add_argument('--types', nargs='+', choices=list(EXPORT_QUERIES), help="Event types (default: all)")
+    parser.add_argument('--output', help="Output file ('.gz' compresses, '-' for stdout; default: patient_<id>.ndjson)")
+    args = parser.parse_args()
+
+    path = args.output or f"patient_{args.subject_id}.ndjson"
+    # Progress goes to stderr when the events themselves go to stdout
+    log = sys.stderr if path == '-' else sys.stdout
+
+    print("\n" + "="*80, file=log)
+    print(f" EXPORTING SUBJECT {args.subject_id}", file=log)
+    print("="*80, file=log)
+    print(f"Event types: {', '.join(args.types or EXPORT_QUERIES)}", file=log)
+    print(f"Output: {path}", file=log)
+    print("="*80 + "\n", file=log)
+
+    retriever = PatientDataRetriever()
+    out = open_output(path)
+    start = time.perf_counter()
+    try:
+        count = retriever.export_events(args.subject_id, out, args.types)
+    finally:
+        if out is not sys.stdout:
+            out.close()
+        retriever.close()
+
+    elapsed = time.perf_counter() - start
+    print(f" Done: {count} events in {elapsed:.1f}s ({count / max(elapsed, 1e-9):.0f}/s)\n", file=log)
+
+
+if __name__ == "__main__":
+    main()
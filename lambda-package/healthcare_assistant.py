@@ -5,14 +5,38 @@ Designed for both CLI and Lambda deployment
 """
 
 import boto3
-from botocore.exceptions import ClientError
+from botocore.config import Config as BotoConfig
+from botocore.exceptions import (ClientError, ConnectionClosedError, ConnectTimeoutError, EndpointConnectionError,
+                                 ReadTimeoutError)
 import psycopg2
-from psycopg2.extras import RealDictCursor
+from psycopg2 import errors as pg_errors
+from psycopg2 import pool as pg_pool
+from psycopg2.extensions import connection as PgConnection
+from psycopg2.extensions import cursor as PgCursor
+from psycopg2.extras import RealDictCursor, execute_values
+import hashlib
+import heapq
 import json
+import logging
+import math
 import os
+import random
 import re
-from datetime import datetime
-from typing import Dict, List, Optional
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from datetime import date, datetime
+from decimal import Decimal
+from itertools import chain, groupby, starmap
+from operator import itemgetter
+from typing import Dict, Iterator, List, Optional, TextIO
+
+import cache_files
+import kb_index
+import trend_summary
+import vector_index
+from clinical_dictionaries import DICTIONARY_QUERIES, ClinicalDictionaries, load_dictionaries
 
 # Load environment variables from .env file (for local development)
 from dotenv import load_dotenv
@@ -24,64 +48,463 @@ class Config:
     AWS_REGION = os.getenv('AWS_REGION', 'us-east-1')
     KNOWLEDGE_BASE_ID = os.getenv('KNOWLEDGE_BASE_ID', '0U6HHF7FWC')
     MODEL_ARN = os.getenv('MODEL_ARN', 'arn:aws:bedrock:us-east-1:925445553569:inference-profile/us.deepseek.r1-v1:0')
+    # Diagnostics (cache hits, retries, hedges, dropped sections, ...) are logged at DEBUG level
+    LOG_LEVEL = os.getenv('LOG_LEVEL', 'WARNING').upper()
+    
+    # Shared Bedrock clients (get_bedrock_client): HTTPS connection pool and timeouts
+    BEDROCK_MAX_POOL_CONNECTIONS = int(os.getenv('BEDROCK_MAX_POOL_CONNECTIONS', '25'))
+    BEDROCK_CONNECT_TIMEOUT = float(os.getenv('BEDROCK_CONNECT_TIMEOUT', '5'))
+    BEDROCK_READ_TIMEOUT = float(os.getenv('BEDROCK_READ_TIMEOUT', '120'))
+    
+    # Bedrock calls (call_bedrock): attempts with decorrelated-jitter backoff between
+    # BEDROCK_RETRY_BASE_MS and BEDROCK_RETRY_MAX_MS, never past the request deadline,
+    # under a per-model AIMD concurrency limit learned from throttling
+    BEDROCK_MAX_ATTEMPTS = int(os.getenv('BEDROCK_MAX_ATTEMPTS', '4'))
+    BEDROCK_RETRY_BASE_MS = float(os.getenv('BEDROCK_RETRY_BASE_MS', '200'))
+    BEDROCK_RETRY_MAX_MS = float(os.getenv('BEDROCK_RETRY_MAX_MS', '5000'))
+    BEDROCK_CONCURRENCY_INITIAL = int(os.getenv('BEDROCK_CONCURRENCY_INITIAL', '8'))
+    BEDROCK_CONCURRENCY_MAX = int(os.getenv('BEDROCK_CONCURRENCY_MAX', os.getenv('BEDROCK_MAX_POOL_CONNECTIONS', '25')))
+    # Hedged requests (opt-in): when a model call has no response (or, streaming, no
+    # first event) after the model's recent BEDROCK_HEDGE_PERCENTILE latency, send an
+    # identical second request and take whichever succeeds first. Hedges are capped at
+    # BEDROCK_HEDGE_BUDGET of the model's calls and need a free limiter slot
+    BEDROCK_HEDGING = os.getenv('BEDROCK_HEDGING', 'false').lower() == 'true'
+    BEDROCK_HEDGE_PERCENTILE = float(os.getenv('BEDROCK_HEDGE_PERCENTILE', '95'))
+    BEDROCK_HEDGE_BUDGET = float(os.getenv('BEDROCK_HEDGE_BUDGET', '0.05'))
+    BEDROCK_HEDGE_MIN_SAMPLES = int(os.getenv('BEDROCK_HEDGE_MIN_SAMPLES', '20'))
+    BEDROCK_HEDGE_MIN_DELAY_MS = float(os.getenv('BEDROCK_HEDGE_MIN_DELAY_MS', '250'))
+    BEDROCK_LATENCY_WINDOW = int(os.getenv('BEDROCK_LATENCY_WINDOW', '200'))
+    # query_many(): retrievals / model calls of one batch run at once (still under the limiter)
+    QUERY_BATCH_CONCURRENCY = int(os.getenv('QUERY_BATCH_CONCURRENCY', '8'))
+    QUERY_BATCH_MAX_QUESTIONS = int(os.getenv('QUERY_BATCH_MAX_QUESTIONS', '10'))
+    # AsyncHealthcareAssistant (async_assistant.py): threads parked in Bedrock calls (waiting for
+    # the limiter or the model) and threads running the context builds off the event loop.
+    # Model calls in flight never exceed BEDROCK_CONCURRENCY_MAX per model (and knowledge base),
+    # so by default there is one Bedrock thread per limiter slot of the two; context builds
+    # hold pooled psycopg2 connections and are capped at DB_POOL_MAX
+    ASYNC_BEDROCK_WORKERS = int(os.getenv('ASYNC_BEDROCK_WORKERS', str(2 * BEDROCK_CONCURRENCY_MAX)))
+    ASYNC_DB_WORKERS = int(os.getenv('ASYNC_DB_WORKERS', '3'))
+    # Time kept back from the Lambda's remaining time to build and return the response
+    LAMBDA_DEADLINE_MARGIN_MS = int(os.getenv('LAMBDA_DEADLINE_MARGIN_MS', '1500'))
     
     DB_HOST = os.getenv('DB_HOST', 'localhost')
     DB_PORT = int(os.getenv('DB_PORT', '5432'))
     DB_NAME = os.getenv('DB_NAME', 'healthcare_rag')
     DB_USER = os.getenv('DB_USER', 'postgres')
     DB_PASSWORD = os.getenv('DB_PASSWORD', '')
-
-
-class PatientDataRetriever:
-    """Retrieve comprehensive patient data from PostgreSQL"""
+    DB_POOL_MIN = int(os.getenv('DB_POOL_MIN', '1'))
+    DB_POOL_MAX = int(os.getenv('DB_POOL_MAX', '12'))
     
-    def __init__(self):
-        self.conn = psycopg2.connect(
-            host=Config.DB_HOST,
-            port=Config.DB_PORT,
-            database=Config.DB_NAME,
-            user=Config.DB_USER,
-            password=Config.DB_PASSWORD,
-            cursor_factory=RealDictCursor
-        )
-        self.cursor = self.conn.cursor()
+    # Read-only replicas ("host" or "host:port", comma separated) for retrieval queries;
+    # audit and cache writes always go to DB_HOST
+    DB_READ_HOSTS = [h.strip() for h in os.getenv('DB_READ_HOSTS', '').split(',') if h.strip()]
+    DB_REPLICA_MAX_LAG_SECONDS = float(os.getenv('DB_REPLICA_MAX_LAG_SECONDS', '30'))
+    DB_REPLICA_LAG_CHECK_SECONDS = float(os.getenv('DB_REPLICA_LAG_CHECK_SECONDS', '10'))
+    DB_REPLICA_EJECT_SECONDS = float(os.getenv('DB_REPLICA_EJECT_SECONDS', '30'))
     
-    def validate_subject_id(self, subject_id: int) -> bool:
-        """Check if subject_id exists"""
-        self.cursor.execute(
-            "SELECT COUNT(*) as count FROM patients WHERE subject_id = %s",
-            (subject_id,)
-        )
-        result = self.cursor.fetchone()
-        return result['count'] > 0
+    # Issue the section queries of a context build in parallel on pooled connections
+    CONCURRENT_CONTEXT_FETCH = os.getenv('CONCURRENT_CONTEXT_FETCH', 'false').lower() == 'true'
     
-    def get_patient_profile(self, subject_id: int) -> Dict:
-        """Get patient demographics and summary statistics"""
-        self.cursor.execute("""
-            SELECT 
-                p.subject_id,
-                p.gender,
-                p.anchor_age,
-                p.anchor_year_group,
-                COUNT(DISTINCT a.hadm_id) as total_admissions,
-                COUNT(DISTINCT d.icd_code) as unique_diagnoses,
-                COUNT(DISTINCT i.stay_id) as icu_stays,
-                COUNT(DISTINCT pr.drug) as unique_medications,
-                MAX(a.admittime) as most_recent_admission,
-                CASE WHEN p.dod IS NOT NULL THEN 'Deceased' ELSE 'Living' END as status
-            FROM patients p
-            LEFT JOIN admissions a ON p.subject_id = a.subject_id
-            LEFT JOIN diagnoses_icd d ON p.subject_id = d.subject_id
-            LEFT JOIN icustays i ON p.subject_id = i.subject_id
-            LEFT JOIN prescriptions pr ON p.subject_id = pr.subject_id
-            WHERE p.subject_id = %s
-            GROUP BY p.subject_id, p.gender, p.anchor_age, p.anchor_year_group, p.dod
-        """, (subject_id,))
-        return self.cursor.fetchone()
-    
-    def get_recent_admissions(self, subject_id: int, limit: int = 3) -> List[Dict]:
-        """Get recent hospital admissions with detailed info"""
-        self.cursor.execute("""
+    # PREPARE retriever statements once per connection; falls back automatically
+    # behind transaction-mode poolers (set to false to skip the first failed attempt)
+    DB_PREPARED_STATEMENTS = os.getenv('DB_PREPARED_STATEMENTS', 'true').lower() == 'true'
+    
+    # Fetch and send only the context sections a question needs
+    LAZY_CONTEXT = os.getenv('LAZY_CONTEXT', 'true').lower() == 'true'
+    
+    # Read precomputed contexts from patient_context_cache before building live
+    CONTEXT_CACHE = os.getenv('CONTEXT_CACHE', 'true').lower() == 'true'
+    
+    # Per-item lab / vital trend summaries over the full history (needs NumPy)
+    TREND_SUMMARIES = os.getenv('TREND_SUMMARIES', 'true').lower() == 'true'
+    
+    # Upper bound on estimated prompt tokens; lower-priority sections are truncated to fit (0 = no limit)
+    PROMPT_TOKEN_BUDGET = int(os.getenv('PROMPT_TOKEN_BUDGET', '6000'))
+    CHARS_PER_TOKEN = float(os.getenv('CHARS_PER_TOKEN', '3.5'))
+    
+    # Per-user 0700 directory of the on-disk caches (see cache_files.py)
+    CACHE_DIR = os.getenv('CACHE_DIR', cache_files.private_cache_dir())
+    # On-disk copy of the d_* lookup tables, reused across cold starts (empty = don't persist)
+    DICTIONARY_CACHE_PATH = os.getenv('DICTIONARY_CACHE_PATH', os.path.join(CACHE_DIR, 'mimic_dictionaries.pickle'))
+    
+    # Per-method wall time / rows / bytes of the section queries, returned with each answer
+    RETRIEVER_STATS = os.getenv('RETRIEVER_STATS', 'false').lower() == 'true'
+    # Fraction of section queries slower than EXPLAIN_SLOW_MS re-run under
+    # EXPLAIN (ANALYZE, BUFFERS) into retriever_diagnostics (0 = never)
+    EXPLAIN_SAMPLE_RATE = float(os.getenv('EXPLAIN_SAMPLE_RATE', '0'))
+    EXPLAIN_SLOW_MS = float(os.getenv('EXPLAIN_SLOW_MS', '250'))
+    
+    # statement_timeout of each section query (0 = none). Optional sections (OPTIONAL_SECTIONS)
+    # get a shorter budget, capped by what is left of CONTEXT_BUDGET_MS for the whole build,
+    # and are left out of the context instead of failing the request when they run over
+    SECTION_TIMEOUT_MS = int(os.getenv('SECTION_TIMEOUT_MS', '5000'))
+    OPTIONAL_SECTION_TIMEOUT_MS = int(os.getenv('OPTIONAL_SECTION_TIMEOUT_MS', '1500'))
+    CONTEXT_BUDGET_MS = int(os.getenv('CONTEXT_BUDGET_MS', '4000'))
+    
+    # Rows per round trip of the server-side cursors behind PatientDataRetriever.iter_events
+    EXPORT_ITERSIZE = int(os.getenv('EXPORT_ITERSIZE', '5000'))
+    
+    # Passages retrieved from the knowledge base per general question (retrieval query = question only)
+    KB_NUMBER_OF_RESULTS = int(os.getenv('KB_NUMBER_OF_RESULTS', '5'))
+    KB_RETRIEVAL_CACHE_MAX_ENTRIES = int(os.getenv('KB_RETRIEVAL_CACHE_MAX_ENTRIES', '1024'))
+    KB_RETRIEVAL_CACHE_TTL_SECONDS = int(os.getenv('KB_RETRIEVAL_CACHE_TTL_SECONDS', '3600'))
+    # 'bedrock' (KB Retrieve API), 'local' (in-process BM25 over the KB documents, see kb_index.py)
+    # or 'dense' (in-process vector index, see vector_index.py; needs NumPy)
+    KB_RETRIEVAL = os.getenv('KB_RETRIEVAL', 'bedrock').lower()
+    LOCAL_KB_DIR = os.getenv('LOCAL_KB_DIR', kb_index.DEFAULT_DOCUMENT_DIR)
+    LOCAL_KB_INDEX_PATH = os.getenv('LOCAL_KB_INDEX_PATH', os.path.join(CACHE_DIR, 'kb_bm25_index.pickle'))
+    LOCAL_KB_URI_PREFIX = os.getenv('LOCAL_KB_URI_PREFIX', 's3://knowledge-base/')
+    LOCAL_KB_VECTOR_DIR = os.getenv('LOCAL_KB_VECTOR_DIR', os.path.join(CACHE_DIR, 'kb_vectors'))
+    VECTOR_INDEX_MODE = os.getenv('VECTOR_INDEX_MODE', 'exact')  # exact, ivf or ivfpq
+    
+    # Process-wide cache of answers keyed on question, patient context, model and conversation state
+    RESPONSE_CACHE = os.getenv('RESPONSE_CACHE', 'true').lower() == 'true'
+    RESPONSE_CACHE_MAX_ENTRIES = int(os.getenv('RESPONSE_CACHE_MAX_ENTRIES', '512'))
+    RESPONSE_CACHE_TTL_SECONDS = int(os.getenv('RESPONSE_CACHE_TTL_SECONDS', '900'))
+
+
+
+logger = logging.getLogger(__name__)
+# A stderr handler when the runtime has not configured logging (Lambda already has one)
+logging.basicConfig(format='[%(levelname)s] %(name)s: %(message)s')
+for _module in (__name__, 'clinical_dictionaries', 'kb_index', 'vector_index', 'async_assistant'):
+    logging.getLogger(_module).setLevel(Config.LOG_LEVEL)
+
+
+# Patient context sections: (name, retriever method, row limit) in render order
+CONTEXT_SECTIONS = [
+    ('profile', 'get_patient_profile', None),
+    ('admissions', 'get_recent_admissions', 3),
+    ('diagnoses', 'get_diagnoses', 8),
+    ('procedures', 'get_procedures', 5),
+    ('labs', 'get_recent_labs', 12),
+    ('lab_trends', 'get_lab_trends', 20),
+    ('medications', 'get_medications', 10),
+    ('med_admin', 'get_medication_administrations', 8),
+    ('orders', 'get_provider_orders', 5),
+    ('icu_stays', 'get_icu_stays', None),
+    ('vitals', 'get_icu_vitals', 15),
+    ('vital_trends', 'get_vital_trends', 12),
+    ('icu_inputs', 'get_icu_inputs', 8),
+]
+
+# Question keywords (regex, matched on word starts) that pull in each section
+SECTION_KEYWORDS = {
+    'admissions': r'admi(?:ssion|tted)|hospitali[sz]|hospital stay|discharg|drg|length of stay|insurance|visit',
+    'diagnoses': r'diagnos|condition|disease|illness|problem|icd|comorbid|history',
+    'procedures': r'procedure|surger|surgical|operation|operated',
+    'labs': r'labs?\b|laborator|tests?\b|result|blood|glucose|potassium|sodium|creatinine|hemoglobin|cbc|panel|level|abnormal',
+    'medications': r'medic|meds?\b|drugs?\b|prescri|dos(?:e|age)|taking|pills?\b|antibiotic',
+    'med_admin': r'administ|given|emar|dos(?:e|age)|medication',
+    'orders': r'orders?\b|ordered|poe\b|provider|physician|doctor|consult',
+    'icu_stays': r'icu\b|intensive care|critical care|careunit',
+    'vitals': r'vitals?\b|heart rate|blood pressure|bp\b|pulse|temperature|respirat|oxygen|spo2|o2\b',
+    'icu_inputs': r'fluids?\b|iv\b|infusion|drip|inputs?\b|saline',
+}
+TREND_KEYWORDS = r'trend|over time|chang|improv|wors|ris(?:e|ing)\b|fall|increas|decreas|stable|range'
+SECTION_KEYWORDS['lab_trends'] = SECTION_KEYWORDS['labs'] + '|' + TREND_KEYWORDS
+SECTION_KEYWORDS['vital_trends'] = SECTION_KEYWORDS['vitals'] + '|' + TREND_KEYWORDS
+SECTION_PATTERNS = {name: re.compile(r'\b(?:' + pattern + ')') for name, pattern in SECTION_KEYWORDS.items()}
+
+# Questions that ask about the whole record
+FULL_CONTEXT_PATTERN = re.compile(r'\b(?:summar|overview|everything|all (?:of )?my|full (?:record|history)|whole)')
+
+# Sections that must be fetched alongside another section to be rendered
+SECTION_DEPENDENCIES = {'vitals': ('icu_stays',), 'vital_trends': ('icu_stays',), 'icu_inputs': ('icu_stays',)}
+
+# Sections a context can do without, and the heading of the note left when one times out
+OPTIONAL_SECTIONS = {
+    'lab_trends': "LABORATORY TRENDS",
+    'orders': "PROVIDER ORDERS (POE)",
+    'vitals': "   Recent ICU Vital Signs",
+    'vital_trends': "   ICU Vital Sign Trends",
+    'icu_inputs': "   ICU Fluid/Medication Inputs",
+}
+SECTION_METHODS = {method: name for name, method, _ in CONTEXT_SECTIONS}
+
+# Row attributes PatientDataRetriever._decorate fills in from the clinical dictionaries
+DICTIONARY_COLUMNS = {
+    'get_diagnoses': ('long_title',),
+    'get_procedures': ('long_title',),
+    'get_recent_labs': ('label', 'fluid', 'category'),
+    'get_icu_vitals': ('label', 'category'),
+    'get_icu_inputs': ('label',),
+}
+
+# Retriever SQL by name; executed through PatientDataRetriever.execute_named
+RETRIEVER_QUERIES = {
+    'validate_subject_id': "SELECT COUNT(*) as count FROM patients WHERE subject_id = %s",
+    'get_patient_profile': """
+        SELECT 
+            p.subject_id,
+            p.gender,
+            p.anchor_age,
+            p.anchor_year_group,
+            COUNT(DISTINCT a.hadm_id) as total_admissions,
+            COUNT(DISTINCT d.icd_code) as unique_diagnoses,
+            COUNT(DISTINCT i.stay_id) as icu_stays,
+            COUNT(DISTINCT pr.drug) as unique_medications,
+            MAX(a.admittime) as most_recent_admission,
+            CASE WHEN p.dod IS NOT NULL THEN 'Deceased' ELSE 'Living' END as status
+        FROM patients p
+        LEFT JOIN admissions a ON p.subject_id = a.subject_id
+        LEFT JOIN diagnoses_icd d ON p.subject_id = d.subject_id
+        LEFT JOIN icustays i ON p.subject_id = i.subject_id
+        LEFT JOIN prescriptions pr ON p.subject_id = pr.subject_id
+        WHERE p.subject_id = %s
+        GROUP BY p.subject_id, p.gender, p.anchor_age, p.anchor_year_group, p.dod
+    """,
+    'get_recent_admissions': """
+        SELECT 
+            a.hadm_id,
+            a.admittime,
+            a.dischtime,
+            a.admission_type,
+            a.admission_location,
+            a.discharge_location,
+            a.insurance,
+            a.race,
+            EXTRACT(EPOCH FROM (a.dischtime - a.admittime))/86400 as los_days,
+            drg.drg_code,
+            drg.description as drg_description,
+            drg.drg_severity,
+            drg.drg_mortality
+        FROM admissions a
+        LEFT JOIN drgcodes drg ON a.hadm_id = drg.hadm_id
+        WHERE a.subject_id = %s
+        ORDER BY a.admittime DESC
+        LIMIT %s
+    """,
+    'get_diagnoses': """
+        SELECT 
+            d.icd_code,
+            d.icd_version,
+            d.seq_num,
+            COUNT(*) as occurrence_count,
+            MAX(a.admittime) as most_recent
+        FROM diagnoses_icd d
+        LEFT JOIN admissions a ON d.hadm_id = a.hadm_id
+        WHERE d.subject_id = %s
+        GROUP BY d.icd_code, d.icd_version, d.seq_num
+        ORDER BY occurrence_count DESC, d.seq_num ASC
+        LIMIT %s
+    """,
+    'get_procedures': """
+        SELECT 
+            p.icd_code,
+            p.icd_version,
+            p.chartdate,
+            COUNT(*) as occurrence_count
+        FROM procedures_icd p
+        WHERE p.subject_id = %s
+        GROUP BY p.icd_code, p.icd_version, p.chartdate
+        ORDER BY p.chartdate DESC
+        LIMIT %s
+    """,
+    'get_recent_labs': """
+        SELECT 
+            le.charttime,
+            le.itemid,
+            le.value,
+            le.valuenum,
+            le.valueuom,
+            le.flag,
+            le.ref_range_lower,
+            le.ref_range_upper
+        FROM labevents le
+        WHERE le.subject_id = %s
+        AND le.charttime IS NOT NULL
+        ORDER BY le.charttime DESC
+        LIMIT %s
+    """,
+    'get_medications': """
+        SELECT 
+            drug,
+            drug_type,
+            route,
+            starttime,
+            stoptime,
+            dose_val_rx,
+            dose_unit_rx,
+            form_rx,
+            gsn,
+            ndc
+        FROM prescriptions
+        WHERE subject_id = %s
+        AND drug IS NOT NULL
+        ORDER BY starttime DESC
+        LIMIT %s
+    """,
+    'get_medication_administrations': """
+        SELECT 
+            charttime,
+            medication,
+            event_txt,
+            scheduletime
+        FROM emar
+        WHERE subject_id = %s
+        AND medication IS NOT NULL
+        ORDER BY charttime DESC
+        LIMIT %s
+    """,
+    'get_provider_orders': """
+        SELECT 
+            poe_id,
+            ordertime,
+            order_type,
+            order_subtype,
+            transaction_type,
+            order_provider_id,
+            order_status
+        FROM poe
+        WHERE subject_id = %s
+        ORDER BY ordertime DESC
+        LIMIT %s
+    """,
+    'get_icu_stays': """
+        SELECT 
+            stay_id,
+            hadm_id,
+            first_careunit,
+            last_careunit,
+            intime,
+            outtime,
+            los as los_days
+        FROM icustays
+        WHERE subject_id = %s
+        ORDER BY intime DESC
+    """,
+    'get_icu_vitals': """
+        SELECT 
+            ce.charttime,
+            ce.itemid,
+            ce.value,
+            ce.valuenum,
+            ce.valueuom,
+            CASE WHEN ce.warning = 1 THEN 'Warning' ELSE 'Normal' END as status
+        FROM chartevents ce
+        WHERE ce.subject_id = %s
+        AND ce.itemid = ANY(%s)
+        ORDER BY ce.charttime DESC
+        LIMIT %s
+    """,
+    'get_icu_inputs': """
+        SELECT 
+            ie.starttime,
+            ie.endtime,
+            ie.itemid,
+            ie.amount,
+            ie.amountuom,
+            ie.rate,
+            ie.rateuom,
+            ie.ordercategoryname,
+            ie.statusdescription
+        FROM inputevents ie
+        WHERE ie.subject_id = %s
+        ORDER BY ie.starttime DESC
+        LIMIT %s
+    """,
+    'get_lab_trends': """
+        SELECT 
+            le.itemid,
+            le.valueuom,
+            le.charttime,
+            le.valuenum,
+            le.ref_range_lower,
+            le.ref_range_upper
+        FROM labevents le
+        WHERE le.subject_id = %s
+        AND le.valuenum IS NOT NULL
+        AND le.charttime IS NOT NULL
+        ORDER BY le.itemid, le.charttime
+    """,
+    'get_vital_trends': """
+        SELECT 
+            ce.itemid,
+            ce.valueuom,
+            ce.charttime,
+            ce.valuenum
+        FROM chartevents ce
+        WHERE ce.subject_id = %s
+        AND ce.itemid = ANY(%s)
+        AND ce.valuenum IS NOT NULL
+        AND ce.charttime IS NOT NULL
+        ORDER BY ce.itemid, ce.charttime
+    """,
+    # data_version: first 16 hex digits of md5('<CONTEXT_FORMAT_VERSION>:<clinical_data_version.version>')
+    'get_data_version': """
+        SELECT left(md5(%s || ':' || version), 16) AS version
+        FROM clinical_data_version
+    """,
+    # Checked against the current data version in the same statement, so a write is seen by the next read
+    'get_cached_context': """
+        SELECT c.sections
+        FROM patient_context_cache c
+        JOIN clinical_data_version v ON c.data_version = left(md5(%s || ':' || v.version), 16)
+        WHERE c.subject_id = %s
+    """,
+    'insert_retriever_diagnostic': """
+        INSERT INTO retriever_diagnostics
+        (method, statement, endpoint, duration_ms, row_count, planning_ms, execution_ms,
+        shared_hit_blocks, shared_read_blocks, plan, captured_at)
+        VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+    """,
+    'insert_kb_query': """
+        INSERT INTO kb_queries 
+        (subject_id, query_text, response_text, session_id, 
+        response_time_ms, citation_count, success, error_message, 
+        model_arn, cache_hit, created_at)
+        VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+        RETURNING query_id
+    """,
+    'insert_kb_citation': """
+        INSERT INTO kb_citations 
+        (query_id, source_document, excerpt_text, metadata, created_at)
+        VALUES (%s, %s, %s, %s, %s)
+    """,
+}
+
+# Cohort variants of the section queries: one statement per section for many subjects.
+# "Recent N" sections use a LATERAL top-N per subject so each patient's
+# (subject_id, time DESC) index is read only N rows deep; aggregated sections
+# rank their groups with ROW_NUMBER() per subject.
+COHORT_QUERIES = {
+    'cohort_get_patient_profile': """
+        WITH cohort AS (SELECT DISTINCT unnest(%s::int[]) AS subject_id)
+        SELECT 
+            p.subject_id,
+            p.gender,
+            p.anchor_age,
+            p.anchor_year_group,
+            COALESCE(a.total_admissions, 0) as total_admissions,
+            COALESCE(d.unique_diagnoses, 0) as unique_diagnoses,
+            COALESCE(i.icu_stays, 0) as icu_stays,
+            COALESCE(pr.unique_medications, 0) as unique_medications,
+            a.most_recent_admission,
+            CASE WHEN p.dod IS NOT NULL THEN 'Deceased' ELSE 'Living' END as status
+        FROM cohort c
+        JOIN patients p ON p.subject_id = c.subject_id
+        LEFT JOIN (
+            SELECT subject_id, COUNT(DISTINCT hadm_id) as total_admissions, MAX(admittime) as most_recent_admission
+            FROM admissions WHERE subject_id IN (SELECT subject_id FROM cohort) GROUP BY subject_id
+        ) a ON a.subject_id = p.subject_id
+        LEFT JOIN (
+            SELECT subject_id, COUNT(DISTINCT icd_code) as unique_diagnoses
+            FROM diagnoses_icd WHERE subject_id IN (SELECT subject_id FROM cohort) GROUP BY subject_id
+        ) d ON d.subject_id = p.subject_id
+        LEFT JOIN (
+            SELECT subject_id, COUNT(DISTINCT stay_id) as icu_stays
+            FROM icustays WHERE subject_id IN (SELECT subject_id FROM cohort) GROUP BY subject_id
+        ) i ON i.subject_id = p.subject_id
+        LEFT JOIN (
+            SELECT subject_id, COUNT(DISTINCT drug) as unique_medications
+            FROM prescriptions WHERE subject_id IN (SELECT subject_id FROM cohort) GROUP BY subject_id
+        ) pr ON pr.subject_id = p.subject_id
+    """,
+    'cohort_get_recent_admissions': """
+        SELECT c.subject_id, x.*
+        FROM unnest(%s::int[]) AS c(subject_id)
+        CROSS JOIN LATERAL (
             SELECT 
                 a.hadm_id,
                 a.admittime,
@@ -98,57 +521,53 @@ class PatientDataRetriever:
                 drg.drg_mortality
             FROM admissions a
             LEFT JOIN drgcodes drg ON a.hadm_id = drg.hadm_id
-            WHERE a.subject_id = %s
+            WHERE a.subject_id = c.subject_id
             ORDER BY a.admittime DESC
             LIMIT %s
-        """, (subject_id, limit))
-        return self.cursor.fetchall()
-    
-    def get_diagnoses(self, subject_id: int, limit: int = 10) -> List[Dict]:
-        """Get diagnoses with full descriptions"""
-        self.cursor.execute("""
+        ) x
+        ORDER BY c.subject_id, x.admittime DESC
+    """,
+    'cohort_get_diagnoses': """
+        SELECT * FROM (
             SELECT 
+                d.subject_id,
                 d.icd_code,
                 d.icd_version,
-                dd.long_title,
                 d.seq_num,
                 COUNT(*) as occurrence_count,
-                MAX(a.admittime) as most_recent
+                MAX(a.admittime) as most_recent,
+                ROW_NUMBER() OVER (PARTITION BY d.subject_id ORDER BY COUNT(*) DESC, d.seq_num ASC) as rn
             FROM diagnoses_icd d
-            LEFT JOIN d_icd_diagnoses dd ON d.icd_code = dd.icd_code AND d.icd_version = dd.icd_version
             LEFT JOIN admissions a ON d.hadm_id = a.hadm_id
-            WHERE d.subject_id = %s
-            GROUP BY d.icd_code, d.icd_version, dd.long_title, d.seq_num
-            ORDER BY occurrence_count DESC, d.seq_num ASC
-            LIMIT %s
-        """, (subject_id, limit))
-        return self.cursor.fetchall()
-    
-    def get_procedures(self, subject_id: int, limit: int = 10) -> List[Dict]:
-        """Get procedures with descriptions"""
-        self.cursor.execute("""
+            WHERE d.subject_id = ANY(%s)
+            GROUP BY d.subject_id, d.icd_code, d.icd_version, d.seq_num
+        ) ranked
+        WHERE rn <= %s
+        ORDER BY subject_id, rn
+    """,
+    'cohort_get_procedures': """
+        SELECT * FROM (
             SELECT 
+                p.subject_id,
                 p.icd_code,
-                dp.long_title,
+                p.icd_version,
                 p.chartdate,
-                COUNT(*) as occurrence_count
+                COUNT(*) as occurrence_count,
+                ROW_NUMBER() OVER (PARTITION BY p.subject_id ORDER BY p.chartdate DESC) as rn
             FROM procedures_icd p
-            LEFT JOIN d_icd_procedures dp ON p.icd_code = dp.icd_code AND p.icd_version = dp.icd_version
-            WHERE p.subject_id = %s
-            GROUP BY p.icd_code, dp.long_title, p.chartdate
-            ORDER BY p.chartdate DESC
-            LIMIT %s
-        """, (subject_id, limit))
-        return self.cursor.fetchall()
-    
-    def get_recent_labs(self, subject_id: int, limit: int = 15) -> List[Dict]:
-        """Get recent lab results with abnormal flags"""
-        self.cursor.execute("""
+            WHERE p.subject_id = ANY(%s)
+            GROUP BY p.subject_id, p.icd_code, p.icd_version, p.chartdate
+        ) ranked
+        WHERE rn <= %s
+        ORDER BY subject_id, rn
+    """,
+    'cohort_get_recent_labs': """
+        SELECT c.subject_id, x.*
+        FROM unnest(%s::int[]) AS c(subject_id)
+        CROSS JOIN LATERAL (
             SELECT 
                 le.charttime,
-                li.label,
-                li.fluid,
-                li.category,
+                le.itemid,
                 le.value,
                 le.valuenum,
                 le.valueuom,
@@ -156,17 +575,17 @@ class PatientDataRetriever:
                 le.ref_range_lower,
                 le.ref_range_upper
             FROM labevents le
-            LEFT JOIN d_labitems li ON le.itemid = li.itemid
-            WHERE le.subject_id = %s
+            WHERE le.subject_id = c.subject_id
             AND le.charttime IS NOT NULL
             ORDER BY le.charttime DESC
             LIMIT %s
-        """, (subject_id, limit))
-        return self.cursor.fetchall()
-    
-    def get_medications(self, subject_id: int, limit: int = 15) -> List[Dict]:
-        """Get prescribed medications"""
-        self.cursor.execute("""
+        ) x
+        ORDER BY c.subject_id, x.charttime DESC
+    """,
+    'cohort_get_medications': """
+        SELECT c.subject_id, x.*
+        FROM unnest(%s::int[]) AS c(subject_id)
+        CROSS JOIN LATERAL (
             SELECT 
                 drug,
                 drug_type,
@@ -179,32 +598,34 @@ class PatientDataRetriever:
                 gsn,
                 ndc
             FROM prescriptions
-            WHERE subject_id = %s
+            WHERE subject_id = c.subject_id
             AND drug IS NOT NULL
             ORDER BY starttime DESC
             LIMIT %s
-        """, (subject_id, limit))
-        return self.cursor.fetchall()
-    
-    def get_medication_administrations(self, subject_id: int, limit: int = 10) -> List[Dict]:
-        """Get actual medication administration records (eMAR)"""
-        self.cursor.execute("""
+        ) x
+        ORDER BY c.subject_id, x.starttime DESC
+    """,
+    'cohort_get_medication_administrations': """
+        SELECT c.subject_id, x.*
+        FROM unnest(%s::int[]) AS c(subject_id)
+        CROSS JOIN LATERAL (
             SELECT 
                 charttime,
                 medication,
                 event_txt,
                 scheduletime
             FROM emar
-            WHERE subject_id = %s
+            WHERE subject_id = c.subject_id
             AND medication IS NOT NULL
             ORDER BY charttime DESC
             LIMIT %s
-        """, (subject_id, limit))
-        return self.cursor.fetchall()
-    
-    def get_provider_orders(self, subject_id: int, limit: int = 10) -> List[Dict]:
-        """Get provider orders (POE)"""
-        self.cursor.execute("""
+        ) x
+        ORDER BY c.subject_id, x.charttime DESC
+    """,
+    'cohort_get_provider_orders': """
+        SELECT c.subject_id, x.*
+        FROM unnest(%s::int[]) AS c(subject_id)
+        CROSS JOIN LATERAL (
             SELECT 
                 poe_id,
                 ordertime,
@@ -214,56 +635,53 @@ class PatientDataRetriever:
                 order_provider_id,
                 order_status
             FROM poe
-            WHERE subject_id = %s
+            WHERE subject_id = c.subject_id
             ORDER BY ordertime DESC
             LIMIT %s
-        """, (subject_id, limit))
-        return self.cursor.fetchall()
-    
-    def get_icu_stays(self, subject_id: int) -> List[Dict]:
-        """Get ICU stay information"""
-        self.cursor.execute("""
-            SELECT 
-                stay_id,
-                hadm_id,
-                first_careunit,
-                last_careunit,
-                intime,
-                outtime,
-                los as los_days
-            FROM icustays
-            WHERE subject_id = %s
-            ORDER BY intime DESC
-        """, (subject_id,))
-        return self.cursor.fetchall()
-    
-    def get_icu_vitals(self, subject_id: int, limit: int = 20) -> List[Dict]:
-        """Get ICU vital signs and assessments"""
-        self.cursor.execute("""
+        ) x
+        ORDER BY c.subject_id, x.ordertime DESC
+    """,
+    'cohort_get_icu_stays': """
+        SELECT 
+            subject_id,
+            stay_id,
+            hadm_id,
+            first_careunit,
+            last_careunit,
+            intime,
+            outtime,
+            los as los_days
+        FROM icustays
+        WHERE subject_id = ANY(%s)
+        ORDER BY subject_id, intime DESC
+    """,
+    'cohort_get_icu_vitals': """
+        SELECT c.subject_id, x.*
+        FROM unnest(%s::int[]) AS c(subject_id)
+        CROSS JOIN LATERAL (
             SELECT 
                 ce.charttime,
-                di.label,
-                di.category,
+                ce.itemid,
                 ce.value,
                 ce.valuenum,
                 ce.valueuom,
                 CASE WHEN ce.warning = 1 THEN 'Warning' ELSE 'Normal' END as status
             FROM chartevents ce
-            LEFT JOIN d_items di ON ce.itemid = di.itemid
-            WHERE ce.subject_id = %s
-            AND di.category IN ('Vital Signs', 'Labs', 'Respiratory')
+            WHERE ce.subject_id = c.subject_id
+            AND ce.itemid = ANY(%s)
             ORDER BY ce.charttime DESC
             LIMIT %s
-        """, (subject_id, limit))
-        return self.cursor.fetchall()
-    
-    def get_icu_inputs(self, subject_id: int, limit: int = 10) -> List[Dict]:
-        """Get ICU fluid/medication inputs"""
-        self.cursor.execute("""
+        ) x
+        ORDER BY c.subject_id, x.charttime DESC
+    """,
+    'cohort_get_icu_inputs': """
+        SELECT c.subject_id, x.*
+        FROM unnest(%s::int[]) AS c(subject_id)
+        CROSS JOIN LATERAL (
             SELECT 
                 ie.starttime,
                 ie.endtime,
-                di.label,
+                ie.itemid,
                 ie.amount,
                 ie.amountuom,
                 ie.rate,
@@ -271,204 +689,1942 @@ class PatientDataRetriever:
                 ie.ordercategoryname,
                 ie.statusdescription
             FROM inputevents ie
-            LEFT JOIN d_items di ON ie.itemid = di.itemid
-            WHERE ie.subject_id = %s
+            WHERE ie.subject_id = c.subject_id
             ORDER BY ie.starttime DESC
             LIMIT %s
-        """, (subject_id, limit))
-        return self.cursor.fetchall()
+        ) x
+        ORDER BY c.subject_id, x.starttime DESC
+    """,
+    'cohort_get_lab_trends': """
+        SELECT 
+            le.subject_id,
+            le.itemid,
+            le.valueuom,
+            le.charttime,
+            le.valuenum,
+            le.ref_range_lower,
+            le.ref_range_upper
+        FROM labevents le
+        WHERE le.subject_id = ANY(%s)
+        AND le.valuenum IS NOT NULL
+        AND le.charttime IS NOT NULL
+        ORDER BY le.subject_id, le.itemid, le.charttime
+    """,
+    'cohort_get_vital_trends': """
+        SELECT 
+            ce.subject_id,
+            ce.itemid,
+            ce.valueuom,
+            ce.charttime,
+            ce.valuenum
+        FROM chartevents ce
+        WHERE ce.subject_id = ANY(%s)
+        AND ce.itemid = ANY(%s)
+        AND ce.valuenum IS NOT NULL
+        AND ce.charttime IS NOT NULL
+        ORDER BY ce.subject_id, ce.itemid, ce.charttime
+    """,
+}
+RETRIEVER_QUERIES.update(COHORT_QUERIES)
+
+# Full-history event streams for PatientDataRetriever.iter_events, by event type.
+# Each is read through a named server-side cursor and must be ordered by its
+# leading event_time column (a timestamp; dates are cast) so the streams can be merged.
+EXPORT_QUERIES = {
+    'admission': """
+        SELECT admittime AS event_time, hadm_id, dischtime, deathtime, admission_type,
+               admission_location, discharge_location, insurance, race
+        FROM admissions
+        WHERE subject_id = %s
+        ORDER BY admittime
+    """,
+    'transfer': """
+        SELECT intime AS event_time, hadm_id, eventtype, careunit, outtime
+        FROM transfers
+        WHERE subject_id = %s AND intime IS NOT NULL
+        ORDER BY intime
+    """,
+    'diagnosis': """
+        SELECT a.dischtime AS event_time, d.hadm_id, d.seq_num, d.icd_code, d.icd_version
+        FROM diagnoses_icd d
+        JOIN admissions a ON a.hadm_id = d.hadm_id
+        WHERE d.subject_id = %s AND a.dischtime IS NOT NULL
+        ORDER BY a.dischtime, d.hadm_id, d.seq_num
+    """,
+    'procedure': """
+        SELECT chartdate::timestamp AS event_time, hadm_id, seq_num, icd_code, icd_version
+        FROM procedures_icd
+        WHERE subject_id = %s AND chartdate IS NOT NULL
+        ORDER BY chartdate, seq_num
+    """,
+    'lab': """
+        SELECT charttime AS event_time, hadm_id, itemid, value, valuenum, valueuom,
+               ref_range_lower, ref_range_upper, flag
+        FROM labevents
+        WHERE subject_id = %s AND charttime IS NOT NULL
+        ORDER BY charttime
+    """,
+    'prescription': """
+        SELECT starttime AS event_time, hadm_id, drug, drug_type, dose_val_rx, dose_unit_rx,
+               route, stoptime
+        FROM prescriptions
+        WHERE subject_id = %s AND starttime IS NOT NULL
+        ORDER BY starttime
+    """,
+    'medication_administration': """
+        SELECT charttime AS event_time, hadm_id, medication, event_txt, scheduletime
+        FROM emar
+        WHERE subject_id = %s AND charttime IS NOT NULL
+        ORDER BY charttime
+    """,
+    'order': """
+        SELECT ordertime AS event_time, hadm_id, poe_id, order_type, order_subtype,
+               transaction_type, order_provider_id, order_status
+        FROM poe
+        WHERE subject_id = %s AND ordertime IS NOT NULL
+        ORDER BY ordertime
+    """,
+    'icu_stay': """
+        SELECT intime AS event_time, hadm_id, stay_id, first_careunit, last_careunit, outtime, los
+        FROM icustays
+        WHERE subject_id = %s AND intime IS NOT NULL
+        ORDER BY intime
+    """,
+    'chart': """
+        SELECT charttime AS event_time, stay_id, itemid, value, valuenum, valueuom, warning
+        FROM chartevents
+        WHERE subject_id = %s AND charttime IS NOT NULL
+        ORDER BY charttime
+    """,
+    'input': """
+        SELECT starttime AS event_time, stay_id, itemid, amount, amountuom, rate, rateuom,
+               ordercategoryname, statusdescription, endtime
+        FROM inputevents
+        WHERE subject_id = %s AND starttime IS NOT NULL
+        ORDER BY starttime
+    """,
+}
+RETRIEVER_QUERIES.update(DICTIONARY_QUERIES)
+RETRIEVER_QUERIES['get_stay_admission'] = "SELECT hadm_id FROM icustays WHERE subject_id = %s AND stay_id = %s"
+
+# Columns each section query filters on under a ContextScope (the patient profile stays patient-wide).
+# ICU event tables have no (hadm_id, time) index; an admission scope reaches them through its stays.
+SCOPE_COLUMNS = {
+    'get_recent_admissions': {'hadm_id': 'a.hadm_id', 'time': 'a.admittime'},
+    'get_diagnoses': {'hadm_id': 'd.hadm_id', 'time': 'a.admittime'},
+    'get_procedures': {'hadm_id': 'p.hadm_id', 'time': 'p.chartdate'},
+    'get_recent_labs': {'hadm_id': 'le.hadm_id', 'time': 'le.charttime'},
+    'get_medications': {'hadm_id': 'hadm_id', 'time': 'starttime'},
+    'get_medication_administrations': {'hadm_id': 'hadm_id', 'time': 'charttime'},
+    'get_provider_orders': {'hadm_id': 'hadm_id', 'time': 'ordertime'},
+    'get_lab_trends': {'hadm_id': 'le.hadm_id', 'time': 'le.charttime'},
+    'get_icu_stays': {'hadm_id': 'hadm_id', 'stay_id': 'stay_id', 'time': 'intime'},
+    'get_icu_vitals': {
+        'hadm_id': 'ce.stay_id IN (SELECT stay_id FROM icustays WHERE hadm_id = %s)',
+        'stay_id': 'ce.stay_id', 'time': 'ce.charttime',
+    },
+    'get_vital_trends': {
+        'hadm_id': 'ce.stay_id IN (SELECT stay_id FROM icustays WHERE hadm_id = %s)',
+        'stay_id': 'ce.stay_id', 'time': 'ce.charttime',
+    },
+    'get_icu_inputs': {
+        'hadm_id': 'ie.stay_id IN (SELECT stay_id FROM icustays WHERE hadm_id = %s)',
+        'stay_id': 'ie.stay_id', 'time': 'ie.starttime',
+    },
+}
+SUBJECT_PREDICATE = re.compile(r'WHERE (?:\w+\.)?subject_id = %s')
+
+# Bump when section rendering changes so precomputed contexts are rebuilt
+CONTEXT_FORMAT_VERSION = 2
+
+# Sections rendered only as part of the ICU stays block
+ICU_SUBSECTIONS = ('vitals', 'vital_trends', 'icu_inputs')
+
+# Section queries filtered on the d_items itemids of ClinicalDictionaries.vital_itemids
+VITAL_METHODS = ('get_icu_vitals', 'get_vital_trends')
+
+# Sections summarized from the full numeric series (trend_summary.SERIES_COLUMNS rows, no row limit in SQL)
+TREND_SECTIONS = ('lab_trends', 'vital_trends')
+
+# invoke_model parameters of the direct (patient data) path
+GENERATION_PARAMS = {"max_tokens": 3000, "temperature": 0.7}
+
+CONTEXT_RULE = "═══════════════════════════════════════════════════════════════════════════════\n"
+
+# Seconds the replica is behind the primary (0 when caught up or when not a standby)
+REPLICA_LAG_QUERY = """
+    SELECT CASE
+        WHEN NOT pg_is_in_recovery() THEN 0
+        WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+        ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0)
+    END AS lag_seconds
+"""
+
+# Shared across retrievers and warm Lambda invocations
+_connection_pool = None
+_fetch_executor = None
+_pool_lock = threading.Lock()
+_replica_router = None
+_dictionaries = None
+_dictionary_lock = threading.Lock()
+_prepared_statements_supported = True
+_context_cache_available = True
+_bedrock_clients = {}
+_bedrock_lock = threading.Lock()
+_bedrock_limiters = {}  # model id -> AIMDLimiter
+_hedge_executor = None
+_batch_executor = None
+_response_cache = None
+_retrieval_cache = None
+_kb_index = None
+_vector_index = None
+_response_cache_lock = threading.Lock()
+
+
+class ContextScope:
+    """Restricts section queries to one admission, one ICU stay and/or a time window"""
+    
+    def __init__(self, hadm_id: Optional[int] = None, stay_id: Optional[int] = None,
+                 start: Optional[datetime] = None, end: Optional[datetime] = None):
+        self.hadm_id = hadm_id
+        self.stay_id = stay_id
+        self.start = start  # inclusive
+        self.end = end  # exclusive
+    
+    def __bool__(self) -> bool:
+        return any(v is not None for v in (self.hadm_id, self.stay_id, self.start, self.end))
+    
+    def __repr__(self) -> str:
+        return f"ContextScope(hadm_id={self.hadm_id}, stay_id={self.stay_id}, start={self.start}, end={self.end})"
+    
+    def filters(self, method: str) -> List[tuple]:
+        """(statement suffix, SQL condition, value) for each filter the method's tables support"""
+        columns = SCOPE_COLUMNS.get(method, {})
+        filters = []
+        for key, column_key, op, value in (('hadm', 'hadm_id', '=', self.hadm_id),
+                                           ('stay', 'stay_id', '=', self.stay_id),
+                                           ('from', 'time', '>=', self.start),
+                                           ('to', 'time', '<', self.end)):
+            column = columns.get(column_key)
+            if value is None or column is None:
+                continue
+            if key == 'hadm' and self.stay_id is not None and 'stay_id' in columns:
+                continue  # the stay already pins the admission
+
+            condition = column if '%s' in column else f"{column} {op} %s"
+            filters.append((key, condition, value))
+        return filters
+    
+    def describe(self) -> str:
+        parts = []
+        if self.hadm_id is not None:
+            parts.append(f"Admission {self.hadm_id}")
+        if self.stay_id is not None:
+            parts.append(f"ICU stay {self.stay_id}")
+        if self.start is not None or self.end is not None:
+            parts.append(f"{self.start or '...'} to {self.end or '...'}")
+        return ", ".join(parts)
+
+
+def _scoped_statement(method: str, scope: Optional[ContextScope]) -> tuple:
+    """RETRIEVER_QUERIES name and scope parameters of a section query under `scope`"""
+    filters = scope.filters(method) if scope else []
+    if not filters:
+        return method, ()
+    
+    # One variant (and prepared statement) per combination of filters
+    name = f"{method}__{'_'.join(key for key, _, _ in filters)}"
+    if name not in RETRIEVER_QUERIES:
+        conditions = ''.join(f" AND {condition}" for _, condition, _ in filters)
+        RETRIEVER_QUERIES[name] = SUBJECT_PREDICATE.sub(
+            lambda m: m.group(0) + conditions, RETRIEVER_QUERIES[method], count=1
+        )
+    return name, tuple(value for _, _, value in filters)
+
+
+DATE_PATTERN = re.compile(r'\d{4}-\d{2}-\d{2}')
+
+# First line of one item in a rendered block (continuation lines are indented text)
+BLOCK_ITEM_PATTERN = re.compile(r'\s*(?:\d+\.|•|[├└]─)')
+
+
+def estimate_tokens(text: str) -> int:
+    """Rough token count of prompt text (Config.CHARS_PER_TOKEN characters per token)"""
+    return math.ceil(len(text) / Config.CHARS_PER_TOKEN)
+
+
+class ContextPacker:
+    """Fits rendered section blocks into a token budget, most relevant and most recent first"""
+    
+    TRUNCATION_NOTE = "   ... {} more item(s) omitted to fit the token budget\n"
+    
+    def __init__(self, budget: int):
+        self.budget = budget
+    
+    def rank(self, blocks: Dict[str, str], relevant: set) -> List[str]:
+        """
+        Packing order: the profile, then sections the question asks about, then
+        the rest; ties go to the section with the newest date, then render order.
+        The ICU stays block always precedes its subsections.
+        """
+        ranked = [name for name, _, _ in CONTEXT_SECTIONS if blocks.get(name)]
+        ranked.sort(key=lambda name: max(DATE_PATTERN.findall(blocks[name]), default=''), reverse=True)
+        ranked.sort(key=lambda name: (name != 'profile', name not in relevant))
+        
+        subsections = [i for i, name in enumerate(ranked) if name in ICU_SUBSECTIONS]
+        if 'icu_stays' in ranked and subsections and ranked.index('icu_stays') > subsections[0]:
+            ranked.remove('icu_stays')
+            ranked.insert(subsections[0], 'icu_stays')
+        return ranked
+    
+    def pack(self, blocks: Dict[str, str], relevant: set, reserved_tokens: int = 0) -> tuple:
+        """Return (packed blocks, report) with the blocks trimmed to the budget left after reserved_tokens"""
+        remaining = self.budget - reserved_tokens
+        packed = {name: "" for name in blocks}
+        report = {'budget_tokens': self.budget, 'context_tokens': 0, 'truncated': {}, 'dropped': []}
+        
+        for name in self.rank(blocks, relevant):
+            text = blocks[name]
+            if name in ICU_SUBSECTIONS and not packed.get('icu_stays'):
+                report['dropped'].append(name)
+                continue
+            
+            tokens = estimate_tokens(text)
+            if tokens > remaining:
+                text, omitted = self._truncate(text, remaining)
+                if not text:
+                    report['dropped'].append(name)
+                    continue
+                report['truncated'][name] = omitted
+                tokens = estimate_tokens(text)
+            
+            packed[name] = text
+            remaining -= tokens
+            report['context_tokens'] += tokens
+        return packed, report
+    
+    def _truncate(self, text: str, budget: int) -> tuple:
+        """Keep the header and the leading (newest) whole items that fit; ('', n) if none do"""
+        lines = text.splitlines(keepends=True)
+        header, items = lines[0], []
+        for line in lines[1:]:
+            if not line.strip():
+                continue
+            if BLOCK_ITEM_PATTERN.match(line) or not items:
+                items.append(line)
+            else:
+                items[-1] += line
+        if not items:
+            return "", 0  # a header or note on its own: nothing to trim, and it does not fit
+        
+        kept = header
+        for count, item in enumerate(items):
+            note = self.TRUNCATION_NOTE.format(len(items) - count - 1)
+            if estimate_tokens(kept + item + note + "\n") > budget:
+                if count == 0:
+                    return "", len(items)
+                return kept + self.TRUNCATION_NOTE.format(len(items) - count) + "\n", len(items) - count
+            kept += item
+        return kept + "\n", 0
+
+
+def _payload_bytes(rows: List[tuple]) -> int:
+    """Approximate size of fetched tuple rows: text length of their non-null values"""
+    return sum(len(str(value)) for row in rows for value in row if value is not None)
+
+
+class QueryStats:
+    """Wall time, rows and bytes per retriever method, shared by a request's concurrent workers"""
+    
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.methods = {}
+    
+    def record(self, method: str, elapsed_ms: float, rows: int, nbytes: int):
+        with self._lock:
+            stats = self.methods.setdefault(method, {'calls': 0, 'ms': 0.0, 'max_ms': 0.0, 'rows': 0, 'bytes': 0})
+            stats['calls'] += 1
+            stats['ms'] += elapsed_ms
+            stats['max_ms'] = max(stats['max_ms'], elapsed_ms)
+            stats['rows'] += rows
+            stats['bytes'] += nbytes
+    
+    def take(self) -> Dict[str, Dict]:
+        """Stats recorded so far, slowest method first, and start over"""
+        with self._lock:
+            methods, self.methods = self.methods, {}
+        return {
+            method: dict(stats, ms=round(stats['ms'], 2), max_ms=round(stats['max_ms'], 2))
+            for method, stats in sorted(methods.items(), key=lambda item: -item[1]['ms'])
+        }
+
+
+def normalize_question(question: str) -> str:
+    """Case, whitespace and trailing punctuation folded, for response cache keys"""
+    return ' '.join(question.lower().split()).rstrip('?.! ')
+
+
+class ResponseCache:
+    """Thread-safe LRU with a per-entry TTL and hit-rate counters (answers, KB passages)"""
+    
+    def __init__(self, max_entries: int, ttl_seconds: float):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries = OrderedDict()  # key -> (stored_at, value), least recently used first
+        self._lock = threading.Lock()
+        self.hits = self.misses = self.evictions = self.expirations = 0
+    
+    def get(self, key: str):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and now - entry[0] >= self.ttl_seconds:
+                del self._entries[key]
+                self.expirations += 1
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+    
+    def put(self, key: str, value):
+        with self._lock:
+            self._entries[key] = (time.monotonic(), value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+    
+    def stats(self) -> Dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / lookups, 4) if lookups else 0.0,
+                'evictions': self.evictions,
+                'expirations': self.expirations,
+            }
+
+
+# Bedrock error codes worth retrying; the throttling ones also shrink the model's concurrency limit
+THROTTLING_ERRORS = ('ThrottlingException', 'TooManyRequestsException')
+RETRYABLE_ERRORS = THROTTLING_ERRORS + ('ServiceUnavailableException', 'InternalServerException',
+                                        'ModelNotReadyException')
+# Connection and timeout errors botocore would retry itself; its retries are off on the shared clients
+NETWORK_ERRORS = (EndpointConnectionError, ConnectTimeoutError, ReadTimeoutError, ConnectionClosedError)
+
+
+class BedrockDeadlineExceeded(Exception):
+    """A Bedrock call could not start (or be retried) before the request deadline"""
+    
+    def __init__(self, model_id: str, waited_ms: float):
+        super().__init__(f"Bedrock capacity for {model_id} not available before the request deadline "
+                         f"(waited {waited_ms:.0f}ms)")
+        self.model_id = model_id
+
+
+class AIMDLimiter:
+    """
+    Concurrency limit for one model: grows by about one slot per limit's worth
+    of successful calls (additive increase), halves on a throttle
+    (multiplicative decrease), so it settles at the rate the model's quota
+    sustains. Also keeps the call / throttle / retry / queueing / hedge metrics
+    and a window of recent call latencies for the hedge delay
+    """
+    
+    def __init__(self, initial: int, maximum: int):
+        self.maximum = max(1, maximum)
+        self.limit = float(min(max(1, initial), self.maximum))
+        self.in_flight = 0
+        self._cond = threading.Condition()
+        self.calls = self.throttles = self.retries = self.errors = self.deadline_exceeded = 0
+        self.hedges = self.hedge_wins = self.hedges_denied = 0
+        self.queue_ms = self.max_queue_ms = 0.0
+        self.latencies = deque(maxlen=max(1, Config.BEDROCK_LATENCY_WINDOW))
+    
+    def acquire(self, model_id: str, deadline: Optional[float] = None):
+        """Wait for a free slot, at most until deadline (time.monotonic())"""
+        start = time.monotonic()
+        with self._cond:
+            while self.in_flight >= int(self.limit):
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    self.deadline_exceeded += 1
+                    raise BedrockDeadlineExceeded(model_id, (time.monotonic() - start) * 1000)
+                self._cond.wait(remaining)
+            self.in_flight += 1
+            self.calls += 1
+            waited_ms = (time.monotonic() - start) * 1000
+            self.queue_ms += waited_ms
+            self.max_queue_ms = max(self.max_queue_ms, waited_ms)
+    
+    def release(self, error_code: Optional[str] = None):
+        with self._cond:
+            self.in_flight -= 1
+            if error_code in THROTTLING_ERRORS:
+                self.throttles += 1
+                self.limit = max(1.0, self.limit / 2)
+            elif error_code:
+                self.errors += 1
+            else:
+                self.limit = min(float(self.maximum), self.limit + 1 / self.limit)
+            self._cond.notify_all()
+    
+    def record_retry(self):
+        with self._cond:
+            self.retries += 1
+    
+    def record_latency(self, elapsed_ms: float):
+        with self._cond:
+            self.latencies.append(elapsed_ms)
+    
+    def hedge_delay_ms(self) -> Optional[float]:
+        """BEDROCK_HEDGE_PERCENTILE of the recent latencies, or None until there are enough samples"""
+        with self._cond:
+            if len(self.latencies) < Config.BEDROCK_HEDGE_MIN_SAMPLES:
+                return None
+            latencies = sorted(self.latencies)
+        rank = round(Config.BEDROCK_HEDGE_PERCENTILE / 100 * (len(latencies) - 1))
+        return max(Config.BEDROCK_HEDGE_MIN_DELAY_MS, latencies[min(max(rank, 0), len(latencies) - 1)])
+    
+    def try_acquire_hedge(self) -> bool:
+        """A slot for a hedge, without waiting: only while a slot is free and hedges stay within budget"""
+        with self._cond:
+            if self.in_flight >= int(self.limit) or self.hedges + 1 > Config.BEDROCK_HEDGE_BUDGET * self.calls:
+                self.hedges_denied += 1
+                return False
+            self.in_flight += 1
+            self.hedges += 1
+            return True
+    
+    def record_hedge_win(self):
+        with self._cond:
+            self.hedge_wins += 1
+    
+    def stats(self) -> Dict:
+        with self._cond:
+            return {
+                'limit': round(self.limit, 2),
+                'in_flight': self.in_flight,
+                'calls': self.calls,
+                'throttles': self.throttles,
+                'retries': self.retries,
+                'errors': self.errors,
+                'deadline_exceeded': self.deadline_exceeded,
+                'queue_ms': round(self.queue_ms, 1),
+                'max_queue_ms': round(self.max_queue_ms, 1),
+                'hedges': self.hedges,
+                'hedge_wins': self.hedge_wins,
+                'hedges_denied': self.hedges_denied,
+            }
+
+
+class SectionRow:
+    """Base of the generated section row classes: one __slots__ attribute per column"""
+    __slots__ = ()
+    
+    def __repr__(self) -> str:
+        values = ', '.join(f"{name}={getattr(self, name, None)!r}" for name in self.__slots__)
+        return f"{type(self).__name__}({values})"
+
+
+_row_classes = {}
+
+
+def row_class(columns: tuple, extra_columns: tuple = ()) -> type:
+    """
+    SectionRow subclass for a statement's result columns, generated once per
+    column list. Its __init__ takes the column values positionally, so a
+    plain tuple row maps with cls(*row); extra_columns are left unset for
+    the caller to fill in.
+    """
+    key = (columns, extra_columns)
+    cls = _row_classes.get(key)
+    if cls is None:
+        # Generated like a dataclass __init__: plain attribute stores, no per-row loop
+        body = ''.join(f"\n    self.{name} = {name}" for name in columns) or "\n    pass"
+        namespace = {}
+        exec(f"def __init__(self, {', '.join(columns)}):{body}", namespace)
+        cls = type('SectionRow', (SectionRow,), {'__slots__': columns + extra_columns, '__init__': namespace['__init__']})
+        _row_classes[key] = cls
+    return cls
+
+
+def section_rows(cursor, rows: List[tuple], extra_columns: tuple = ()) -> List[SectionRow]:
+    """Tuple rows fetched from cursor as instances of its row_class"""
+    cls = row_class(tuple(column.name for column in cursor.description), extra_columns)
+    return list(starmap(cls, rows))
+
+
+class SectionTimeout(Exception):
+    """A section query was cancelled by its statement_timeout (or the build budget ran out first)"""
+    
+    def __init__(self, section: str, timeout_ms: int):
+        super().__init__(f"{section} section exceeded its {timeout_ms} ms time budget")
+        self.section = section
+        self.timeout_ms = timeout_ms
+    
+    def note(self) -> str:
+        """Context line standing in for the dropped section"""
+        return f"{OPTIONAL_SECTIONS[self.section]}: omitted, the query exceeded its {self.timeout_ms} ms time budget\n\n"
+
+
+def _json_value(value):
+    """json.dumps default for database values"""
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        return float(value)
+    return str(value)
+
+
+def statement_sql(query: bytes) -> str:
+    """SQL a cursor last ran (cursor.query) without the statement_timeout prefix of execute_named"""
+    sql = query.decode('utf-8')
+    return sql.split('; ', 1)[1] if sql.startswith('SET LOCAL statement_timeout') else sql
+
+
+class PreparedStatementFallback(Exception):
+    """Raised when a prepared statement is lost mid-transaction (transaction-mode pooler)"""
+
+
+class RetrieverConnection(PgConnection):
+    """psycopg2 connection that remembers which retriever statements it has prepared"""
+    
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.prepared = set()
+
+
+def _positional_sql(sql: str) -> str:
+    """Rewrite %s placeholders as $1..$n for PREPARE"""
+    counter = iter(range(1, sql.count('%s') + 1))
+    return re.sub(r'%s', lambda _: f"${next(counter)}", sql)
+
+
+def _create_pool(host: str, port: int) -> pg_pool.ThreadedConnectionPool:
+    return pg_pool.ThreadedConnectionPool(
+        Config.DB_POOL_MIN,
+        Config.DB_POOL_MAX,
+        host=host,
+        port=port,
+        database=Config.DB_NAME,
+        user=Config.DB_USER,
+        password=Config.DB_PASSWORD,
+        cursor_factory=RealDictCursor,
+        connection_factory=RetrieverConnection
+    )
+
+
+def get_connection_pool() -> pg_pool.ThreadedConnectionPool:
+    """Process-wide PostgreSQL connection pool (created on first use)"""
+    global _connection_pool
+    with _pool_lock:
+        if _connection_pool is None or _connection_pool.closed:
+            _connection_pool = _create_pool(Config.DB_HOST, Config.DB_PORT)
+        return _connection_pool
+
+
+def get_bedrock_client(service: str):
+    """
+    Process-wide boto3 client for a Bedrock service ('bedrock-runtime',
+    'bedrock-agent-runtime'), shared by every assistant and kept across warm
+    Lambda invocations so its endpoint, credentials and open HTTPS connections
+    are reused
+    """
+    client = _bedrock_clients.get(service)
+    if client is None:
+        with _bedrock_lock:  # boto3's default session is not thread-safe
+            client = _bedrock_clients.get(service)
+            if client is None:
+                client = boto3.client(service, config=BotoConfig(
+                    region_name=Config.AWS_REGION,
+                    # A connection for every call the limiter can let through
+                    max_pool_connections=max(Config.BEDROCK_MAX_POOL_CONNECTIONS, Config.BEDROCK_CONCURRENCY_MAX),
+                    connect_timeout=Config.BEDROCK_CONNECT_TIMEOUT,
+                    read_timeout=Config.BEDROCK_READ_TIMEOUT,
+                    retries={'total_max_attempts': 1},  # retried by call_bedrock, within the deadline
+                    tcp_keepalive=True,
+                ))
+                _bedrock_clients[service] = client
+    return client
+
+
+class ReplicaRouter:
+    """Round-robin over Config.DB_READ_HOSTS, ejecting replicas that fail or lag"""
+    
+    def __init__(self, hosts: List[str]):
+        self.hosts = hosts
+        self.pools = {}
+        self.ejected_until = {}  # host -> monotonic time it rejoins the rotation
+        self.lag_checked_at = {}
+        self._next = 0
+        self._lock = threading.Lock()
+    
+    def _pool(self, host: str) -> pg_pool.ThreadedConnectionPool:
+        with self._lock:
+            if host not in self.pools:
+                name, _, port = host.partition(':')
+                self.pools[host] = _create_pool(name, int(port or Config.DB_PORT))
+            return self.pools[host]
+    
+    def acquire(self) -> Optional[tuple]:
+        """(host, connection) from the next healthy replica, or None to read from the primary"""
+        for _ in range(len(self.hosts)):
+            with self._lock:
+                host = self.hosts[self._next % len(self.hosts)]
+                self._next += 1
+                if self.ejected_until.get(host, 0) > time.monotonic():
+                    continue
+            conn = None
+            try:
+                pool = self._pool(host)
+                conn = pool.getconn()
+                if conn.closed:
+                    pool.putconn(conn, close=True)
+                    conn = pool.getconn()
+                # Reads need no transaction; an idle-in-transaction standby session
+                # would hold locks that conflict with WAL replay
+                conn.autocommit = True
+                lag = self._lag_seconds(host, conn)
+            except (psycopg2.OperationalError, pg_pool.PoolError) as e:
+                if conn is not None:
+                    pool.putconn(conn, close=True)
+                self.eject(host, str(e).strip())
+                continue
+            if lag is not None and lag > Config.DB_REPLICA_MAX_LAG_SECONDS:
+                self.release(host, conn)
+                self.eject(host, f"{lag:.1f}s behind the primary")
+                continue
+            return host, conn
+        return None
+    
+    def _lag_seconds(self, host: str, conn) -> Optional[float]:
+        """Replication lag, checked at most every DB_REPLICA_LAG_CHECK_SECONDS per replica"""
+        now = time.monotonic()
+        if now - self.lag_checked_at.get(host, 0) < Config.DB_REPLICA_LAG_CHECK_SECONDS:
+            return None
+        self.lag_checked_at[host] = now
+        with conn.cursor() as cursor:
+            cursor.execute(REPLICA_LAG_QUERY)
+            return float(cursor.fetchone()['lag_seconds'])
+    
+    def release(self, host: str, conn, broken: bool = False):
+        self.pools[host].putconn(conn, close=broken or bool(conn.closed))
+    
+    def eject(self, host: str, reason: str):
+        logger.debug(f"Replica {host} ejected for {Config.DB_REPLICA_EJECT_SECONDS:.0f}s: {reason}")
+        with self._lock:
+            self.ejected_until[host] = time.monotonic() + Config.DB_REPLICA_EJECT_SECONDS
+            self.lag_checked_at.pop(host, None)
+
+
+def get_bedrock_limiter(model_id: str) -> AIMDLimiter:
+    """Process-wide AIMD limiter for a model (or knowledge base)"""
+    limiter = _bedrock_limiters.get(model_id)
+    if limiter is None:
+        with _bedrock_lock:
+            limiter = _bedrock_limiters.setdefault(
+                model_id, AIMDLimiter(Config.BEDROCK_CONCURRENCY_INITIAL, Config.BEDROCK_CONCURRENCY_MAX)
+            )
+    return limiter
+
+
+def bedrock_metrics() -> Dict[str, Dict]:
+    """Limit, throttles, retries, queueing delay and hedges per model since the process started"""
+    return {model_id: limiter.stats() for model_id, limiter in list(_bedrock_limiters.items())}
+
+
+def get_hedge_executor() -> ThreadPoolExecutor:
+    """Thread pool running hedged Bedrock calls (a primary and at most one hedge each)"""
+    global _hedge_executor
+    with _bedrock_lock:
+        if _hedge_executor is None:
+            # Primaries and hedges both hold limiter slots: one thread per slot of the model and KB limiters
+            _hedge_executor = ThreadPoolExecutor(
+                max_workers=max(2, 2 * Config.BEDROCK_CONCURRENCY_MAX),
+                thread_name_prefix='bedrock-hedge'
+            )
+        return _hedge_executor
+
+
+def get_batch_executor() -> ThreadPoolExecutor:
+    """Thread pool running the retrievals and model calls of query_many() batches"""
+    global _batch_executor
+    with _bedrock_lock:
+        if _batch_executor is None:
+            _batch_executor = ThreadPoolExecutor(
+                max_workers=max(1, Config.QUERY_BATCH_CONCURRENCY),
+                thread_name_prefix='query-batch'
+            )
+        return _batch_executor
+
+
+def _settled(fn, *args) -> tuple:
+    """(value, exception, elapsed ms) of fn(*args), for results gathered from a batch executor"""
+    start = time.monotonic()
+    try:
+        return fn(*args), None, int((time.monotonic() - start) * 1000)
+    except Exception as e:
+        return None, e, int((time.monotonic() - start) * 1000)
+
+
+PACKED_ANSWER_PATTERN = re.compile(r'^[\s*#]*ANSWER\s*\[(\d+)\][\s*:]*', re.MULTILINE | re.IGNORECASE)
+
+
+def pack_questions(questions: List[str]) -> str:
+    """Several questions as one, asking for answers the model marks with their numbers"""
+    lines = ["Answer each of these questions separately. Start each answer on a new line with "
+             "'ANSWER [n]:', where n is the question's number, and answer every question."]
+    lines += [f"[{i}] {question}" for i, question in enumerate(questions, 1)]
+    return '\n'.join(lines)
+
+
+def split_packed_answers(text: str, count: int) -> List[Optional[str]]:
+    """The numbered answers of a pack_questions() response (None where one is missing)"""
+    answers = [None] * count
+    matches = list(PACKED_ANSWER_PATTERN.finditer(text))
+    for match, following in zip(matches, matches[1:] + [None]):
+        n = int(match.group(1))
+        if 1 <= n <= count and answers[n - 1] is None:
+            answers[n - 1] = text[match.end():following.start() if following else len(text)].strip() or None
+    return answers
+
+
+class PrefetchedStream:
+    """A response event stream whose first event has already been read; close() closes the stream"""
+    
+    def __init__(self, stream):
+        self.stream = stream
+        self._events = iter(stream)
+        self.first = next(self._events, None)
+    
+    def __iter__(self):
+        return chain([self.first] if self.first is not None else [], self._events)
+    
+    def close(self):
+        close = getattr(self.stream, 'close', None)
+        if close:
+            close()
+
+
+def with_first_event(operation):
+    """
+    A streaming Bedrock operation that returns only once the first event has
+    arrived (PrefetchedStream body), so call_bedrock's latency, retries and
+    hedging cover time to first token rather than to the response headers
+    """
+    def call(**kwargs):
+        response = operation(**kwargs)
+        response['body'] = PrefetchedStream(response['body'])
+        return response
+    return call
+
+
+def _attempt(limiter: AIMDLimiter, operation, kwargs: Dict):
+    """operation(**kwargs) on an acquired limiter slot, released with its outcome"""
+    error_code = None
+    start = time.monotonic()
+    try:
+        response = operation(**kwargs)
+        limiter.record_latency((time.monotonic() - start) * 1000)
+        return response
+    except ClientError as e:
+        error_code = e.response['Error']['Code']
+        raise
+    except Exception as e:
+        error_code = type(e).__name__
+        raise
+    finally:
+        limiter.release(error_code)
+
+
+def _discard(future):
+    """Close the body of a hedged call's losing response so its connection goes back to the pool"""
+    if future.cancelled() or future.exception() is not None:
+        return
+    body = future.result().get('body')
+    close = getattr(body, 'close', None)
+    if close:
+        close()
+
+
+def _hedged_attempt(limiter: AIMDLimiter, operation, kwargs: Dict):
+    """
+    _attempt on the hedge executor; if it is still running after the model's
+    hedge delay, a second identical attempt is sent (budget and limit allowing)
+    and the first to succeed wins. Errors only surface once both have failed
+    """
+    executor = get_hedge_executor()
+    primary = executor.submit(_attempt, limiter, operation, kwargs)
+    delay_ms = limiter.hedge_delay_ms()
+    if delay_ms is None:
+        return primary.result()
+    done, _ = wait([primary], timeout=delay_ms / 1000)
+    if done or not limiter.try_acquire_hedge():
+        return primary.result()
+    
+    hedge = executor.submit(_attempt, limiter, operation, kwargs)
+    logger.debug(f"Bedrock call running past {delay_ms:.0f}ms, hedge sent")
+    pending = {primary, hedge}
+    while pending:
+        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            if future.exception() is None:
+                if future is hedge:
+                    limiter.record_hedge_win()
+                for loser in pending:
+                    loser.add_done_callback(_discard)
+                return future.result()
+    return primary.result()
+
+
+def call_bedrock(operation, model_id: str, deadline: Optional[float] = None, hedge: bool = False, **kwargs):
+    """
+    operation(**kwargs) (a Bedrock client method) under the model's AIMD
+    limiter, retrying throttles, transient errors and NETWORK_ERRORS with
+    decorrelated jitter while the next attempt can still start before deadline
+    (time.monotonic()). With hedge, slow attempts are hedged (_hedged_attempt)
+    """
+    limiter = get_bedrock_limiter(model_id)
+    attempts = max(1, Config.BEDROCK_MAX_ATTEMPTS)
+    backoff_ms = Config.BEDROCK_RETRY_BASE_MS
+    for attempt in range(1, attempts + 1):
+        limiter.acquire(model_id, deadline)
+        try:
+            if hedge:
+                return _hedged_attempt(limiter, operation, kwargs)
+            return _attempt(limiter, operation, kwargs)
+        except (ClientError,) + NETWORK_ERRORS as e:
+            if isinstance(e, ClientError):
+                error_code = e.response['Error']['Code']
+                retryable = error_code in RETRYABLE_ERRORS
+            else:
+                error_code, retryable = type(e).__name__, True
+            if not retryable or attempt == attempts:
+                raise
+            # Decorrelated jitter: uniform between the base and three times the previous backoff
+            backoff_ms = min(Config.BEDROCK_RETRY_MAX_MS, random.uniform(Config.BEDROCK_RETRY_BASE_MS, backoff_ms * 3))
+            if deadline is not None and time.monotonic() + backoff_ms / 1000 >= deadline:
+                raise
+        
+        logger.debug(f"Bedrock {error_code} on {model_id}, retrying in {backoff_ms:.0f}ms (attempt {attempt})")
+        limiter.record_retry()
+        time.sleep(backoff_ms / 1000)
+
+
+def get_response_cache() -> Optional[ResponseCache]:
+    """Process-wide answer cache (kept across warm Lambda invocations), or None when disabled"""
+    global _response_cache
+    if not (Config.RESPONSE_CACHE and Config.RESPONSE_CACHE_MAX_ENTRIES > 0):
+        return None
+    with _response_cache_lock:
+        if _response_cache is None:
+            _response_cache = ResponseCache(Config.RESPONSE_CACHE_MAX_ENTRIES, Config.RESPONSE_CACHE_TTL_SECONDS)
+        return _response_cache
+
+
+def get_retrieval_cache() -> Optional[ResponseCache]:
+    """Process-wide cache of knowledge base passages per question, shared across patients"""
+    global _retrieval_cache
+    if Config.KB_RETRIEVAL_CACHE_MAX_ENTRIES <= 0:
+        return None
+    with _response_cache_lock:
+        if _retrieval_cache is None:
+            _retrieval_cache = ResponseCache(Config.KB_RETRIEVAL_CACHE_MAX_ENTRIES,
+                                             Config.KB_RETRIEVAL_CACHE_TTL_SECONDS)
+        return _retrieval_cache
+
+
+def get_kb_index() -> kb_index.BM25Index:
+    """Process-wide BM25 index of the local KB documents (loaded from LOCAL_KB_INDEX_PATH when current)"""
+    global _kb_index
+    with _response_cache_lock:
+        if _kb_index is None:
+            _kb_index = kb_index.load_index(Config.LOCAL_KB_DIR, Config.LOCAL_KB_INDEX_PATH or None,
+                                            Config.LOCAL_KB_URI_PREFIX)
+        return _kb_index
+
+
+def get_vector_index() -> vector_index.VectorIndex:
+    """Process-wide dense index of the local KB documents (memory-mapped from LOCAL_KB_VECTOR_DIR when current)"""
+    global _vector_index
+    with _response_cache_lock:
+        if _vector_index is None:
+            _vector_index = vector_index.load_vector_index(
+                Config.LOCAL_KB_DIR, Config.LOCAL_KB_VECTOR_DIR or None, Config.LOCAL_KB_URI_PREFIX,
+                Config.VECTOR_INDEX_MODE
+            )
+        return _vector_index
+
+
+def get_replica_router() -> Optional[ReplicaRouter]:
+    """Process-wide replica router, or None when no DB_READ_HOSTS are configured"""
+    global _replica_router
+    if not Config.DB_READ_HOSTS:
+        return None
+    with _pool_lock:
+        if _replica_router is None or _replica_router.hosts != Config.DB_READ_HOSTS:
+            _replica_router = ReplicaRouter(Config.DB_READ_HOSTS)
+        return _replica_router
+
+
+def get_fetch_executor() -> ThreadPoolExecutor:
+    """Thread pool used for concurrent section fetching"""
+    global _fetch_executor
+    with _pool_lock:
+        if _fetch_executor is None:
+            _fetch_executor = ThreadPoolExecutor(
+                max_workers=max(1, min(len(CONTEXT_SECTIONS), Config.DB_POOL_MAX - 1)),
+                thread_name_prefix='context-fetch'
+            )
+        return _fetch_executor
+
+
+class PatientDataRetriever:
+    """Retrieve comprehensive patient data from PostgreSQL"""
+    
+    def __init__(self, conn=None, stats: Optional[QueryStats] = None):
+        # Borrow a pooled primary connection (on first use) unless the caller lends one
+        self._pool = None if conn is not None else get_connection_pool()
+        self._conn = conn
+        self._cursor = None
+        # Read endpoint: (host, connection) of a replica, or None to read from the primary
+        router = get_replica_router()
+        self._replica = router.acquire() if router else None
+        self._read_cursor = None
+        # Per-method query stats (Config.RETRIEVER_STATS); concurrent workers share their parent's
+        self.stats = stats if stats is not None else (QueryStats() if Config.RETRIEVER_STATS else None)
+        # time.monotonic() at which the current context build runs out of CONTEXT_BUDGET_MS
+        self.deadline = None
+        self.last_query = None  # SQL of the latest section query (cursor.query)
+    
+    @property
+    def conn(self):
+        """Primary connection (writes; reads too when no replica is available)"""
+        if self._conn is None:
+            self._conn = self._pool.getconn()
+            if self._conn.closed:
+                self._pool.putconn(self._conn, close=True)
+                self._conn = self._pool.getconn()
+        return self._conn
+    
+    @property
+    def cursor(self):
+        if self._cursor is None:
+            self._cursor = self.conn.cursor()
+        return self._cursor
+    
+    @property
+    def read_conn(self):
+        return self._replica[1] if self._replica else self.conn
+    
+    @property
+    def read_cursor(self):
+        if self._replica is None:
+            return self.cursor
+        if self._read_cursor is None:
+            self._read_cursor = self._replica[1].cursor()
+        return self._read_cursor
+    
+    def execute_read(self, name: str, params: tuple, tuples: bool = False, timeout_ms: Optional[int] = None):
+        """
+        execute_named on the read endpoint and return the cursor
+        
+        A replica whose connection breaks is ejected from the rotation and the
+        statement re-run on the primary. tuples=True runs it on a new plain
+        tuple cursor, which the caller closes.
+        """
+        while True:
+            replica = self._replica
+            cursor = self.read_conn.cursor(cursor_factory=PgCursor) if tuples else self.read_cursor
+            try:
+                return self.execute_named(name, params, cursor=cursor, timeout_ms=timeout_ms)
+            except psycopg2.OperationalError as e:
+                if tuples:
+                    cursor.close()
+                if replica is None or not replica[1].closed:
+                    raise  # a query error (e.g. timeout), not a lost replica
+                self._drop_replica(str(e).strip(), broken=True)
+    
+    def _statement_timeout_ms(self, method: str) -> Optional[int]:
+        """statement_timeout of a section query; SectionTimeout if the build budget is already spent"""
+        section = SECTION_METHODS[method]
+        if section not in OPTIONAL_SECTIONS:
+            return Config.SECTION_TIMEOUT_MS or None
+        timeout_ms = Config.OPTIONAL_SECTION_TIMEOUT_MS
+        if self.deadline is not None:
+            remaining_ms = int((self.deadline - time.monotonic()) * 1000)
+            timeout_ms = min(timeout_ms, remaining_ms) if timeout_ms else remaining_ms
+            if timeout_ms <= 0:
+                raise SectionTimeout(section, Config.CONTEXT_BUDGET_MS)
+        return timeout_ms or None
+    
+    def _fetch_rows(self, method: str, name: str, params: tuple, tuples: bool = False,
+                    extra_columns: tuple = ()) -> list:
+        """
+        execute_read a section statement on a tuple cursor and fetch all rows as
+        SectionRow objects (plain tuples with tuples=True), recording stats and
+        sampled plans
+        """
+        timeout_ms = self._statement_timeout_ms(method) if method in SECTION_METHODS else None
+        start = time.perf_counter()
+        try:
+            cursor = self.execute_read(name, params, tuples=True, timeout_ms=timeout_ms)
+        except pg_errors.QueryCanceled:
+            self.read_conn.rollback()
+            if method not in SECTION_METHODS:
+                raise  # a cohort query has no section to drop
+            raise SectionTimeout(SECTION_METHODS[method], timeout_ms)
+        try:
+            values = cursor.fetchall()
+            rows = values if tuples else section_rows(cursor, values, extra_columns)
+            self.last_query = cursor.query
+            elapsed_ms = (time.perf_counter() - start) * 1000
+            if self.stats is not None:
+                self.stats.record(method, elapsed_ms, len(rows), _payload_bytes(values))
+            if (Config.EXPLAIN_SAMPLE_RATE > 0 and elapsed_ms >= Config.EXPLAIN_SLOW_MS
+                    and random.random() < Config.EXPLAIN_SAMPLE_RATE):
+                self._capture_plan(method, name, cursor.query, elapsed_ms, len(rows))
+            return rows
+        finally:
+            cursor.close()
+    
+    def _capture_plan(self, method: str, name: str, query: bytes, elapsed_ms: float, row_count: int):
+        """Re-run a slow statement under EXPLAIN (ANALYZE, BUFFERS) and store the plan in retriever_diagnostics"""
+        try:
+            with self.read_conn.cursor(cursor_factory=PgCursor) as explain:
+                explain.execute("EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) " + statement_sql(query))
+                plan = explain.fetchone()[0][0]
+            root = plan['Plan']
+            self.cursor.execute(RETRIEVER_QUERIES['insert_retriever_diagnostic'], (
+                method, name, self._replica[0] if self._replica else Config.DB_HOST,
+                round(elapsed_ms, 3), row_count, plan.get('Planning Time'), plan.get('Execution Time'),
+                root.get('Shared Hit Blocks', 0), root.get('Shared Read Blocks', 0),
+                json.dumps(plan), datetime.now()
+            ))
+            self.conn.commit()
+            logger.debug(f"Captured plan of {name} ({elapsed_ms:.0f} ms)")
+        except psycopg2.Error as e:
+            logger.debug(f"Plan capture for {name} failed: {e}")
+            self.read_conn.rollback()
+            if self.read_conn is not self.conn:
+                self.conn.rollback()
+    
+    def _drop_replica(self, reason: str, broken: bool = False):
+        host, conn = self._replica
+        router = get_replica_router()
+        if broken:
+            router.eject(host, reason)
+        router.release(host, conn, broken=broken)
+        self._replica = None
+        self._read_cursor = None
+    
+    def execute_named(self, name: str, params: tuple, cursor=None, replay: bool = True,
+                      timeout_ms: Optional[int] = None):
+        """
+        Execute a RETRIEVER_QUERIES statement and return the cursor
+        
+        The statement is PREPAREd the first time this connection runs it and
+        EXECUTEd with parameters afterwards, so Postgres skips parsing and can
+        reuse a cached plan. If the server session has no such statement
+        (transaction-mode pooler), prepared statements are switched off for the
+        process and the statement is replayed as plain SQL. Callers with
+        uncommitted writes pass replay=False and get PreparedStatementFallback
+        to redo their transaction instead.
+        
+        timeout_ms sends a SET LOCAL statement_timeout in the same round trip;
+        it lasts until the end of the transaction (just the statement on an
+        autocommit replica connection).
+        """
+        global _prepared_statements_supported
+        cursor = cursor or self.cursor
+        conn = cursor.connection
+        sql = RETRIEVER_QUERIES[name]
+        timeout = f"SET LOCAL statement_timeout = {int(timeout_ms)}; " if timeout_ms else ""
+        
+        if not (Config.DB_PREPARED_STATEMENTS and _prepared_statements_supported
+                and isinstance(conn, RetrieverConnection)):
+            cursor.execute(timeout + sql, params)
+            return cursor
+        
+        statement = f"hc_{name}"
+        try:
+            if statement not in conn.prepared:
+                cursor.execute(f"PREPARE {statement} AS {_positional_sql(sql)}")
+                conn.prepared.add(statement)
+            if params:
+                cursor.execute(f"{timeout}EXECUTE {statement} ({', '.join(['%s'] * len(params))})", params)
+            else:
+                cursor.execute(f"{timeout}EXECUTE {statement}")
+        except (pg_errors.InvalidSqlStatementName, pg_errors.DuplicatePreparedStatement):
+            logger.debug(f"Prepared statement {statement} unavailable, using plain SQL")
+            conn.rollback()
+            _prepared_statements_supported = False
+            if not replay:
+                raise PreparedStatementFallback(statement)
+            cursor.execute(timeout + sql, params)
+        return cursor
+    
+    def validate_subject_id(self, subject_id: int) -> bool:
+        """Check if subject_id exists"""
+        result = self.execute_read('validate_subject_id', (subject_id,)).fetchone()
+        return result['count'] > 0
+    
+    def resolve_scope(self, subject_id: int, scope: Optional[ContextScope]) -> Optional[ContextScope]:
+        """Fill in the admission of a stay-only scope; ValueError if the stay is not the patient's"""
+        if scope is None or scope.stay_id is None or scope.hadm_id is not None:
+            return scope
+        row = self.execute_read('get_stay_admission', (subject_id, scope.stay_id)).fetchone()
+        if row is None:
+            raise ValueError(f"ICU stay {scope.stay_id} not found for subject {subject_id}")
+        return ContextScope(hadm_id=row['hadm_id'], stay_id=scope.stay_id, start=scope.start, end=scope.end)
+    
+    @property
+    def dictionaries(self) -> ClinicalDictionaries:
+        """d_* lookup tables, loaded once per process (see clinical_dictionaries)"""
+        global _dictionaries
+        if _dictionaries is None:
+            with _dictionary_lock:
+                if _dictionaries is None:
+                    _dictionaries = load_dictionaries(self._fetch_dictionary, Config.DICTIONARY_CACHE_PATH or None)
+        return _dictionaries
+    
+    def _fetch_dictionary(self, name: str) -> List[tuple]:
+        cursor = self.execute_read(name, (), tuples=True)
+        try:
+            return cursor.fetchall()
+        finally:
+            cursor.close()
+    
+    def section_statement(self, method: str, subject_id, limit: Optional[int] = None,
+                          scope: Optional[ContextScope] = None) -> tuple:
+        """RETRIEVER_QUERIES name and parameters of a section query (subject_id may be a cohort id list)"""
+        name, scope_params = _scoped_statement(method, scope)
+        extra = (self.dictionaries.vital_itemids,) if method in VITAL_METHODS else ()
+        return name, (subject_id,) + scope_params + extra + (() if limit is None else (limit,))
+    
+    def _execute_section(self, method: str, subject_id: int, limit: Optional[int],
+                         scope: Optional[ContextScope]) -> List[SectionRow]:
+        name, params = self.section_statement(method, subject_id, limit, scope)
+        rows = self._fetch_rows(method, name, params, extra_columns=DICTIONARY_COLUMNS.get(method, ()))
+        return self._decorate(method, rows)
+    
+    def _decorate(self, method: str, rows: List[SectionRow]) -> List[SectionRow]:
+        """Attach the dictionary labels the section queries no longer join"""
+        d = self.dictionaries
+        if method == 'get_recent_labs':
+            for row in rows:
+                row.label, row.fluid, row.category = d.lab_item(row.itemid)
+        elif method == 'get_diagnoses':
+            for row in rows:
+                row.long_title = d.diagnosis_title(row.icd_code, row.icd_version)
+        elif method == 'get_procedures':
+            for row in rows:
+                row.long_title = d.procedure_title(row.icd_code, row.icd_version)
+        elif method == 'get_icu_vitals':
+            for row in rows:
+                row.label, row.category = d.item(row.itemid)[:2]
+        elif method == 'get_icu_inputs':
+            for row in rows:
+                row.label = d.item(row.itemid)[0]
+        return rows
+    
+    def _decorate_series(self, method: str, rows: List[tuple]) -> List[tuple]:
+        """Expand trend query rows to trend_summary.SERIES_COLUMNS"""
+        d = self.dictionaries
+        if method == 'get_lab_trends':
+            return [(itemid, d.lab_item(itemid)[0], unit, charttime, value, low, high)
+                    for itemid, unit, charttime, value, low, high in rows]
+        return [(itemid, item[0], unit or item[2], charttime, value, item[3], item[4])
+                for itemid, unit, charttime, value in rows
+                for item in (d.item(itemid),)]
+    
+    def get_patient_profile(self, subject_id: int, scope: Optional[ContextScope] = None) -> Optional[SectionRow]:
+        """Get patient demographics and summary statistics (always patient-wide)"""
+        rows = self._fetch_rows('get_patient_profile', 'get_patient_profile', (subject_id,))
+        return rows[0] if rows else None
+    
+    def get_recent_admissions(self, subject_id: int, limit: int = 3,
+                              scope: Optional[ContextScope] = None) -> List[SectionRow]:
+        """Get recent hospital admissions with detailed info"""
+        return self._execute_section('get_recent_admissions', subject_id, limit, scope)
+    
+    def get_diagnoses(self, subject_id: int, limit: int = 10,
+                      scope: Optional[ContextScope] = None) -> List[SectionRow]:
+        """Get diagnoses with full descriptions"""
+        return self._execute_section('get_diagnoses', subject_id, limit, scope)
+    
+    def get_procedures(self, subject_id: int, limit: int = 10,
+                       scope: Optional[ContextScope] = None) -> List[SectionRow]:
+        """Get procedures with descriptions"""
+        return self._execute_section('get_procedures', subject_id, limit, scope)
+    
+    def get_recent_labs(self, subject_id: int, limit: int = 15,
+                        scope: Optional[ContextScope] = None) -> List[SectionRow]:
+        """Get recent lab results with abnormal flags"""
+        return self._execute_section('get_recent_labs', subject_id, limit, scope)
+    
+    def get_medications(self, subject_id: int, limit: int = 15,
+                        scope: Optional[ContextScope] = None) -> List[SectionRow]:
+        """Get prescribed medications"""
+        return self._execute_section('get_medications', subject_id, limit, scope)
+    
+    def get_medication_administrations(self, subject_id: int, limit: int = 10,
+                                       scope: Optional[ContextScope] = None) -> List[SectionRow]:
+        """Get actual medication administration records (eMAR)"""
+        return self._execute_section('get_medication_administrations', subject_id, limit, scope)
+    
+    def get_provider_orders(self, subject_id: int, limit: int = 10,
+                            scope: Optional[ContextScope] = None) -> List[SectionRow]:
+        """Get provider orders (POE)"""
+        return self._execute_section('get_provider_orders', subject_id, limit, scope)
+    
+    def get_icu_stays(self, subject_id: int, scope: Optional[ContextScope] = None) -> List[SectionRow]:
+        """Get ICU stay information"""
+        return self._execute_section('get_icu_stays', subject_id, None, scope)
+    
+    def get_icu_vitals(self, subject_id: int, limit: int = 20,
+                       scope: Optional[ContextScope] = None) -> List[SectionRow]:
+        """Get ICU vital signs and assessments"""
+        return self._execute_section('get_icu_vitals', subject_id, limit, scope)
+    
+    def get_icu_inputs(self, subject_id: int, limit: int = 10,
+                       scope: Optional[ContextScope] = None) -> List[SectionRow]:
+        """Get ICU fluid/medication inputs"""
+        return self._execute_section('get_icu_inputs', subject_id, limit, scope)
+    
+    def get_lab_trends(self, subject_id: int, limit: int = 20,
+                       scope: Optional[ContextScope] = None) -> List[SectionRow]:
+        """Summarize every numeric lab result per test (see trend_summary)"""
+        return self._trend_section('get_lab_trends', subject_id, limit, scope)
+    
+    def get_vital_trends(self, subject_id: int, limit: int = 12,
+                         scope: Optional[ContextScope] = None) -> List[SectionRow]:
+        """Summarize every numeric ICU vital sign per item (see trend_summary)"""
+        return self._trend_section('get_vital_trends', subject_id, limit, scope)
+    
+    def _trend_section(self, method: str, subject_id: int, limit: Optional[int],
+                       scope: Optional[ContextScope]) -> List[Dict]:
+        if not (Config.TREND_SUMMARIES and trend_summary.available()):
+            return []
+        name, params = self.section_statement(method, subject_id, scope=scope)
+        # Plain tuples: the numeric series can be thousands of rows
+        rows = self._fetch_rows(method, name, params, tuples=True)
+        return trend_summary.summarize_series(self._decorate_series(method, rows), limit)
+    
+    def get_data_version(self) -> str:
+        """Fingerprint of the clinical data (clinical_data_version, bumped by every write) and context format"""
+        return self.execute_read('get_data_version', (str(CONTEXT_FORMAT_VERSION),)).fetchone()['version']
+    
+    def get_cached_context(self, subject_id: int) -> Optional[Dict[str, str]]:
+        """Precomputed section blocks for the patient, if built from the current data version"""
+        global _context_cache_available
+        if not (Config.CONTEXT_CACHE and _context_cache_available):
+            return None
+        try:
+            row = self.execute_read('get_cached_context', (str(CONTEXT_FORMAT_VERSION), subject_id)).fetchone()
+        except pg_errors.UndefinedTable:
+            logger.debug("patient_context_cache or clinical_data_version table not found (psql/migrations 002, 006), building contexts live")
+            self.read_conn.rollback()
+            _context_cache_available = False
+            return None
+        return row['sections'] if row else None
+    
+    def store_cached_contexts(self, entries: List[tuple], data_version: str):
+        """Upsert (subject_id, section blocks, build_ms) entries into patient_context_cache"""
+        execute_values(self.cursor, """
+            INSERT INTO patient_context_cache
+            (subject_id, data_version, sections, context_text, build_ms, built_at)
+            VALUES %s
+            ON CONFLICT (subject_id) DO UPDATE SET
+                data_version = EXCLUDED.data_version,
+                sections = EXCLUDED.sections,
+                context_text = EXCLUDED.context_text,
+                build_ms = EXCLUDED.build_ms,
+                built_at = EXCLUDED.built_at
+        """, [
+            (subject_id, data_version, json.dumps(blocks), self.compose_context(subject_id, blocks),
+             build_ms, datetime.now())
+            for subject_id, blocks, build_ms in entries
+        ])
+        self.conn.commit()
+    
+    def build_patient_contexts(self, subject_ids: List[int], chunk_size: int = 1000) -> Dict[int, str]:
+        """Build contexts for a cohort with one query per section per chunk of subjects"""
+        contexts = {}
+        ids = sorted(set(subject_ids))
+        for i in range(0, len(ids), chunk_size):
+            cohort = self.fetch_cohort_sections(ids[i:i + chunk_size])
+            for subject_id, data in cohort.items():
+                contexts[subject_id] = self.render_patient_context(subject_id, data)
+        return contexts
+    
+    def fetch_cohort_sections(self, subject_ids: List[int],
+                              sections: Optional[List[str]] = None) -> Dict[int, Dict[str, object]]:
+        """Run each section query once for all subjects and split the rows per subject"""
+        ids = sorted(set(subject_ids))
+        cohort = {subject_id: {} for subject_id in ids}
+        for name, method, limit in CONTEXT_SECTIONS:
+            if sections is not None and name not in sections:
+                continue
+            for data in cohort.values():
+                data[name] = None if name == 'profile' else []
+            
+            if name in TREND_SECTIONS:
+                if Config.TREND_SUMMARIES and trend_summary.available():
+                    _, params = self.section_statement(method, ids)
+                    rows = self._fetch_rows(f"cohort_{method}", f"cohort_{method}", params, tuples=True)
+                    for subject_id, series in groupby(rows, key=lambda row: row[0]):
+                        series = self._decorate_series(method, [row[1:] for row in series])
+                        cohort[subject_id][name] = trend_summary.summarize_series(series, limit)
+                continue
+            
+            _, params = self.section_statement(method, ids, limit)
+            rows = self._fetch_rows(f"cohort_{method}", f"cohort_{method}", params,
+                                    extra_columns=DICTIONARY_COLUMNS.get(method, ()))
+            for row in self._decorate(method, rows):
+                if name == 'profile':
+                    cohort[row.subject_id][name] = row
+                else:
+                    cohort[row.subject_id][name].append(row)
+        return cohort
     
-    def build_patient_context(self, subject_id: int) -> str:
+    def iter_events(self, subject_id: int, event_types: Optional[List[str]] = None) -> Iterator[Dict]:
+        """
+        Every event of the patient's record (EXPORT_QUERIES) in time order
+        
+        Each table is read through its own named server-side cursor,
+        Config.EXPORT_ITERSIZE rows per round trip, and the streams are merged
+        with heapq.merge, so memory stays flat however long the history is.
+        All cursors share one read-only transaction, i.e. one snapshot.
+        """
+        conn = self.read_conn
+        autocommit = conn.autocommit
+        if autocommit:
+            conn.autocommit = False  # named cursors only live inside a transaction
+        cursors = []
+        try:
+            streams = []
+            for event_type in event_types or EXPORT_QUERIES:
+                cursor = conn.cursor(name=f"export_{event_type}", cursor_factory=PgCursor)
+                cursor.itersize = Config.EXPORT_ITERSIZE
+                cursor.execute(EXPORT_QUERIES[event_type], (subject_id,))
+                cursors.append(cursor)
+                streams.append(self._event_stream(event_type, cursor))
+            yield from heapq.merge(*streams, key=itemgetter('time'))
+        finally:
+            for cursor in cursors:
+                cursor.close()
+            conn.rollback()
+            if autocommit:
+                conn.autocommit = True
+
+    def _event_stream(self, event_type: str, cursor) -> Iterator[Dict]:
+        """Events of one export cursor, with dictionary labels attached"""
+        d = self.dictionaries
+        columns = None
+        for row in cursor:
+            if columns is None:
+                columns = [column.name for column in cursor.description][1:]  # known after the first FETCH
+            event = {'time': row[0], 'type': event_type}
+            event.update(zip(columns, row[1:]))
+            if event_type == 'lab':
+                event['label'], event['fluid'] = d.lab_item(event['itemid'])[:2]
+            elif event_type in ('chart', 'input'):
+                event['label'] = d.item(event['itemid'])[0]
+            elif event_type == 'diagnosis':
+                event['long_title'] = d.diagnosis_title(event['icd_code'], event['icd_version'])
+            elif event_type == 'procedure':
+                event['long_title'] = d.procedure_title(event['icd_code'], event['icd_version'])
+            yield event
+
+    def export_events(self, subject_id: int, out: TextIO, event_types: Optional[List[str]] = None) -> int:
+        """Write iter_events to out as NDJSON, one line per event; returns the event count"""
+        count = 0
+        for event in self.iter_events(subject_id, event_types):
+            out.write(json.dumps(event, default=_json_value) + "\n")
+            count += 1
+        return count
+
+    def build_patient_context(self, subject_id: int, concurrent: Optional[bool] = None,
+                              scope: Optional[ContextScope] = None) -> str:
         """Build comprehensive patient context for AI with all available data"""
-        profile = self.get_patient_profile(subject_id)
-        admissions = self.get_recent_admissions(subject_id, 3)
-        diagnoses = self.get_diagnoses(subject_id, 8)
-        procedures = self.get_procedures(subject_id, 5)
-        labs = self.get_recent_labs(subject_id, 12)
-        medications = self.get_medications(subject_id, 10)
-        med_admin = self.get_medication_administrations(subject_id, 8)
-        orders = self.get_provider_orders(subject_id, 5)
-        icu_stays = self.get_icu_stays(subject_id)
-        vitals = self.get_icu_vitals(subject_id, 15)
-        icu_inputs = self.get_icu_inputs(subject_id, 8)
+        data = self.fetch_sections(subject_id, concurrent=concurrent, scope=scope)
+        return self.render_patient_context(subject_id, data, scope)
+    
+    def fetch_sections(self, subject_id: int, sections: Optional[List[str]] = None,
+                       concurrent: Optional[bool] = None,
+                       scope: Optional[ContextScope] = None) -> Dict[str, object]:
+        """Run the section queries and return their rows keyed by section name (render order)"""
+        wanted = [s for s in CONTEXT_SECTIONS if sections is None or s[0] in sections]
+        if concurrent is None:
+            concurrent = Config.CONCURRENT_CONTEXT_FETCH
+        self.deadline = time.monotonic() + Config.CONTEXT_BUDGET_MS / 1000 if Config.CONTEXT_BUDGET_MS else None
+        
+        if concurrent and len(wanted) > 1:
+            return self._fetch_sections_concurrently(subject_id, wanted, scope)
         
+        try:
+            return {
+                name: self._call_section(self, method, limit, subject_id, scope)
+                for name, method, limit in wanted
+            }
+        finally:
+            # End the read transaction so the SET LOCAL statement timeouts go with it
+            if not self.read_conn.closed:
+                self.read_conn.rollback()
+    
+    @staticmethod
+    def _call_section(retriever: 'PatientDataRetriever', method: str, limit: Optional[int], subject_id: int,
+                      scope: Optional[ContextScope] = None):
+        """Rows of one section, or its SectionTimeout if an optional section ran out of time"""
+        fn = getattr(retriever, method)
+        try:
+            return fn(subject_id, scope=scope) if limit is None else fn(subject_id, limit, scope=scope)
+        except SectionTimeout as e:
+            if e.section not in OPTIONAL_SECTIONS:
+                raise
+            logger.debug(f"Dropping section: {e}")
+            return e
+    
+    def _fetch_sections_concurrently(self, subject_id: int, wanted: List[tuple],
+                                     scope: Optional[ContextScope] = None) -> Dict[str, object]:
+        """Issue every section query at once, one pooled connection per section"""
+        pool = get_connection_pool()
+        
+        def fetch(section):
+            name, method, limit = section
+            try:
+                # With replicas each worker reads from its own replica connection
+                conn = None if Config.DB_READ_HOSTS else pool.getconn()
+            except pg_pool.PoolError:
+                return name, None, False  # pool exhausted, fetched serially below
+            try:
+                worker = PatientDataRetriever(conn=conn, stats=self.stats)
+                worker.deadline = self.deadline
+                try:
+                    return name, self._call_section(worker, method, limit, subject_id, scope), True
+                except pg_pool.PoolError:
+                    return name, None, False  # no replica left and the primary pool is exhausted
+                finally:
+                    worker.close()
+            finally:
+                if conn is not None:
+                    pool.putconn(conn)
+        
+        futures = [get_fetch_executor().submit(fetch, section) for section in wanted]
+        data = {}
+        fallback = False
+        try:
+            for (name, method, limit), future in zip(wanted, futures):
+                _, rows, fetched = future.result()
+                if not fetched:
+                    fallback = True
+                    rows = self._call_section(self, method, limit, subject_id, scope)
+                data[name] = rows
+        finally:
+            # Sections fetched serially on this connection: end their SET LOCAL timeouts as fetch_sections does
+            if fallback and not self.read_conn.closed:
+                self.read_conn.rollback()
+        return data
+    
+    def render_patient_context(self, subject_id: int, data: Dict[str, object],
+                               scope: Optional[ContextScope] = None) -> str:
+        """Render fetched sections (see fetch_sections) into the patient context text"""
+        return self.compose_context(subject_id, self.render_section_blocks(data), scope)
+    
+    def render_section_blocks(self, data: Dict[str, object]) -> Dict[str, str]:
+        """Render each fetched section to its text block ('' when there is nothing to show)"""
+        blocks = {}
+        for name, _, _ in CONTEXT_SECTIONS:
+            if name not in data:
+                continue
+            rows = data[name]
+            if isinstance(rows, SectionTimeout):
+                blocks[name] = rows.note()
+            elif not rows or (name in ICU_SUBSECTIONS and 'icu_stays' in data and not data['icu_stays']):
+                blocks[name] = ""
+            else:
+                blocks[name] = self.render_section(name, rows)
+        return blocks
+    
+    def compose_context(self, subject_id: int, blocks: Dict[str, str],
+                        scope: Optional[ContextScope] = None) -> str:
+        """Assemble rendered section blocks into the patient context, in section order"""
+        scope_line = f"SCOPE: {scope.describe()} (other admissions/stays omitted)\n" if scope else ""
         context = f"""
-═══════════════════════════════════════════════════════════════════════════════
-PATIENT CLINICAL RECORD (Subject ID: {subject_id})
-═══════════════════════════════════════════════════════════════════════════════
-
-DEMOGRAPHICS & SUMMARY:
-├─ Gender: {profile['gender']}
-├─ Age: {profile['anchor_age']} years
-├─ Year Group: {profile['anchor_year_group']}
-├─ Status: {profile['status']}
-├─ Total Hospital Admissions: {profile['total_admissions']}
-├─ ICU Stays: {profile['icu_stays']}
-├─ Unique Diagnoses: {profile['unique_diagnoses']}
-└─ Unique Medications: {profile['unique_medications']}
+{CONTEXT_RULE}PATIENT CLINICAL RECORD (Subject ID: {subject_id})
+{scope_line}{CONTEXT_RULE}
+"""
+        for name, _, _ in CONTEXT_SECTIONS:
+            if name in ICU_SUBSECTIONS and not blocks.get('icu_stays'):
+                continue
+            context += blocks.get(name, "")
+        context += CONTEXT_RULE
+        return context
+    
+    def render_section(self, name: str, rows) -> str:
+        """Render one non-empty section block"""
+        return getattr(self, f"_render_{name}")(rows)
+    
+    def _render_profile(self, profile: SectionRow) -> str:
+        return f"""DEMOGRAPHICS & SUMMARY:
+├─ Gender: {profile.gender}
+├─ Age: {profile.anchor_age} years
+├─ Year Group: {profile.anchor_year_group}
+├─ Status: {profile.status}
+├─ Total Hospital Admissions: {profile.total_admissions}
+├─ ICU Stays: {profile.icu_stays}
+├─ Unique Diagnoses: {profile.unique_diagnoses}
+└─ Unique Medications: {profile.unique_medications}
 
 """
-        
+    
+    def _render_admissions(self, admissions: List[SectionRow]) -> str:
         # Recent Admissions with DRG codes
-        if admissions:
-            context += "RECENT HOSPITAL ADMISSIONS:\n"
-            for i, adm in enumerate(admissions, 1):
-                los = f"{adm['los_days']:.1f} days" if adm['los_days'] else "Ongoing"
-                drg_info = ""
-                if adm['drg_code']:
-                    drg_info = f"\n   DRG: {adm['drg_code']} - {adm['drg_description']}"
-                    if adm['drg_severity']:
-                        drg_info += f" (Severity: {adm['drg_severity']}, Mortality Risk: {adm['drg_mortality']})"
-                
-                context += f"{i}. {adm['admission_type']} admission on {adm['admittime'].strftime('%Y-%m-%d')}\n"
-                context += f"   Location: {adm['admission_location']} → {adm['discharge_location']}\n"
-                context += f"   LOS: {los}, Insurance: {adm['insurance']}{drg_info}\n"
-            context += "\n"
-        
-        # Diagnoses
-        if diagnoses:
-            context += "DIAGNOSES (ICD-10 Codes with Descriptions):\n"
-            for i, diag in enumerate(diagnoses, 1):
-                title = diag['long_title'][:70] + '...' if diag['long_title'] and len(diag['long_title']) > 70 else diag['long_title']
-                priority = f"[Seq {diag['seq_num']}]" if diag['seq_num'] else ""
-                context += f"{i}. {diag['icd_code']} {priority} - {title or 'N/A'} ({diag['occurrence_count']}x)\n"
-            context += "\n"
-        
-        # Procedures
-        if procedures:
-            context += "PROCEDURES PERFORMED:\n"
-            for i, proc in enumerate(procedures, 1):
-                title = proc['long_title'][:70] + '...' if proc['long_title'] and len(proc['long_title']) > 70 else proc['long_title']
-                date = proc['chartdate'].strftime('%Y-%m-%d') if proc['chartdate'] else 'Unknown'
-                context += f"{i}. {proc['icd_code']} - {title or 'N/A'} (Date: {date})\n"
-            context += "\n"
-        
-        # Lab Results
-        if labs:
-            context += "RECENT LABORATORY RESULTS:\n"
-            for i, lab in enumerate(labs, 1):
-                label = lab['label'] or "Lab Test"
-                category = f"[{lab['category']}]" if lab['category'] else ""
-                value = lab['value'] or (f"{lab['valuenum']}" if lab['valuenum'] else "N/A")
-                unit = lab['valueuom'] or ''
-                
-                # Abnormal flag with reference ranges
-                flag_info = ""
-                if lab['flag'] and lab['flag'].lower() == 'abnormal':
-                    flag_info = "  ABNORMAL"
-                    if lab['ref_range_lower'] or lab['ref_range_upper']:
-                        flag_info += f" (Ref: {lab['ref_range_lower'] or '?'}-{lab['ref_range_upper'] or '?'})"
-                
-                date = lab['charttime'].strftime('%Y-%m-%d %H:%M') if lab['charttime'] else 'Unknown'
-                context += f"{i}. {label} {category}: {value} {unit}{flag_info} ({date})\n"
-            context += "\n"
-        
-        # Medications
-        if medications:
-            context += "PRESCRIBED MEDICATIONS:\n"
-            for i, med in enumerate(medications, 1):
-                dose = f"{med['dose_val_rx']} {med['dose_unit_rx']}" if med['dose_val_rx'] else ""
-                route = f"via {med['route']}" if med['route'] else ""
-                drug_type = f"[{med['drug_type']}]" if med['drug_type'] else ""
-                start = med['starttime'].strftime('%Y-%m-%d') if med['starttime'] else 'Unknown'
-                context += f"{i}. {med['drug']} {dose} {route} {drug_type} (Started: {start})\n"
-            context += "\n"
-        
-        # Medication Administration
-        if med_admin:
-            context += "MEDICATION ADMINISTRATION RECORDS (eMAR):\n"
-            for i, admin in enumerate(med_admin, 1):
-                status = admin['event_txt'] or 'Administered'
-                time = admin['charttime'].strftime('%Y-%m-%d %H:%M') if admin['charttime'] else 'Unknown'
-                context += f"{i}. {admin['medication']} - {status} ({time})\n"
-            context += "\n"
-        
-        # Provider Orders
-        if orders:
-            context += "PROVIDER ORDERS (POE):\n"
-            for i, order in enumerate(orders, 1):
-                order_time = order['ordertime'].strftime('%Y-%m-%d %H:%M') if order['ordertime'] else 'Unknown'
-                order_type = order['order_type'] or 'Order'
-                if order['order_subtype']:
-                    order_type += f" - {order['order_subtype']}"
-                status = order['order_status'] or 'Unknown'
-                provider = f" by {order['order_provider_id']}" if order['order_provider_id'] else ""
-                context += f"{i}. {order_type} [{status}]{provider} ({order_time})\n"
-            context += "\n"
-        
-        # ICU Stays
-        if icu_stays:
-            context += "INTENSIVE CARE UNIT STAYS:\n"
-            for i, stay in enumerate(icu_stays, 1):
-                los = f"{stay['los_days']:.1f} days" if stay['los_days'] else "Ongoing"
-                intime = stay['intime'].strftime('%Y-%m-%d %H:%M') if stay['intime'] else 'Unknown'
-                context += f"{i}. ICU Stay ID {stay['stay_id']}: {stay['first_careunit']} → {stay['last_careunit']}\n"
-                context += f"   Admitted: {intime}, LOS: {los}\n"
-            context += "\n"
+        context = "RECENT HOSPITAL ADMISSIONS:\n"
+        for i, adm in enumerate(admissions, 1):
+            los = f"{adm.los_days:.1f} days" if adm.los_days else "Ongoing"
+            drg_info = ""
+            if adm.drg_code:
+                drg_info = f"\n   DRG: {adm.drg_code} - {adm.drg_description}"
+                if adm.drg_severity:
+                    drg_info += f" (Severity: {adm.drg_severity}, Mortality Risk: {adm.drg_mortality})"
+            
+            context += f"{i}. {adm.admission_type} admission on {adm.admittime.strftime('%Y-%m-%d')}\n"
+            context += f"   Location: {adm.admission_location} → {adm.discharge_location}\n"
+            context += f"   LOS: {los}, Insurance: {adm.insurance}{drg_info}\n"
+        return context + "\n"
+    
+    def _render_diagnoses(self, diagnoses: List[SectionRow]) -> str:
+        context = "DIAGNOSES (ICD-10 Codes with Descriptions):\n"
+        for i, diag in enumerate(diagnoses, 1):
+            title = diag.long_title[:70] + '...' if diag.long_title and len(diag.long_title) > 70 else diag.long_title
+            priority = f"[Seq {diag.seq_num}]" if diag.seq_num else ""
+            context += f"{i}. {diag.icd_code} {priority} - {title or 'N/A'} ({diag.occurrence_count}x)\n"
+        return context + "\n"
+    
+    def _render_procedures(self, procedures: List[SectionRow]) -> str:
+        context = "PROCEDURES PERFORMED:\n"
+        for i, proc in enumerate(procedures, 1):
+            title = proc.long_title[:70] + '...' if proc.long_title and len(proc.long_title) > 70 else proc.long_title
+            date = proc.chartdate.strftime('%Y-%m-%d') if proc.chartdate else 'Unknown'
+            context += f"{i}. {proc.icd_code} - {title or 'N/A'} (Date: {date})\n"
+        return context + "\n"
+    
+    def _render_labs(self, labs: List[SectionRow]) -> str:
+        context = "RECENT LABORATORY RESULTS:\n"
+        for i, lab in enumerate(labs, 1):
+            label = lab.label or "Lab Test"
+            category = f"[{lab.category}]" if lab.category else ""
+            value = lab.value or (f"{lab.valuenum}" if lab.valuenum else "N/A")
+            unit = lab.valueuom or ''
             
-            # ICU Vitals
-            if vitals:
-                context += "   Recent ICU Vital Signs:\n"
-                for v in vitals[:10]:
-                    time = v['charttime'].strftime('%Y-%m-%d %H:%M') if v['charttime'] else 'Unknown'
-                    value = v['value'] or (f"{v['valuenum']}" if v['valuenum'] else "N/A")
-                    unit = v['valueuom'] or ''
-                    status = f" [{v['status']}]" if v['status'] == 'Warning' else ""
-                    context += f"   • {v['label']}: {value} {unit}{status} ({time})\n"
-                context += "\n"
+            # Abnormal flag with reference ranges
+            flag_info = ""
+            if lab.flag and lab.flag.lower() == 'abnormal':
+                flag_info = "  ABNORMAL"
+                if lab.ref_range_lower or lab.ref_range_upper:
+                    flag_info += f" (Ref: {lab.ref_range_lower or '?'}-{lab.ref_range_upper or '?'})"
             
-            # ICU Inputs
-            if icu_inputs:
-                context += "   ICU Fluid/Medication Inputs:\n"
-                for inp in icu_inputs[:8]:
-                    start = inp['starttime'].strftime('%Y-%m-%d %H:%M') if inp['starttime'] else 'Unknown'
-                    amount = f"{inp['amount']} {inp['amountuom']}" if inp['amount'] else ""
-                    rate = f"@ {inp['rate']} {inp['rateuom']}" if inp['rate'] else ""
-                    category = inp['ordercategoryname'] or 'Unknown'
-                    context += f"   • {inp['label']} ({category}): {amount} {rate} (Started: {start})\n"
-                context += "\n"
-        
-        context += "═══════════════════════════════════════════════════════════════════════════════\n"
-        
-        return context
+            date = lab.charttime.strftime('%Y-%m-%d %H:%M') if lab.charttime else 'Unknown'
+            context += f"{i}. {label} {category}: {value} {unit}{flag_info} ({date})\n"
+        return context + "\n"
     
-    def close(self):
-        self.cursor.close()
-        self.conn.close()
+    def _render_lab_trends(self, trends: List[Dict]) -> str:
+        context = "LABORATORY TRENDS (all numeric results, per test):\n"
+        for trend in trends:
+            context += f"• {trend_summary.format_summary(trend)}\n"
+        return context + "\n"
+    
+    def _render_medications(self, medications: List[SectionRow]) -> str:
+        context = "PRESCRIBED MEDICATIONS:\n"
+        for i, med in enumerate(medications, 1):
+            dose = f"{med.dose_val_rx} {med.dose_unit_rx}" if med.dose_val_rx else ""
+            route = f"via {med.route}" if med.route else ""
+            drug_type = f"[{med.drug_type}]" if med.drug_type else ""
+            start = med.starttime.strftime('%Y-%m-%d') if med.starttime else 'Unknown'
+            context += f"{i}. {med.drug} {dose} {route} {drug_type} (Started: {start})\n"
+        return context + "\n"
+    
+    def _render_med_admin(self, med_admin: List[SectionRow]) -> str:
+        context = "MEDICATION ADMINISTRATION RECORDS (eMAR):\n"
+        for i, admin in enumerate(med_admin, 1):
+            status = admin.event_txt or 'Administered'
+            time = admin.charttime.strftime('%Y-%m-%d %H:%M') if admin.charttime else 'Unknown'
+            context += f"{i}. {admin.medication} - {status} ({time})\n"
+        return context + "\n"
+    
+    def _render_orders(self, orders: List[SectionRow]) -> str:
+        context = "PROVIDER ORDERS (POE):\n"
+        for i, order in enumerate(orders, 1):
+            order_time = order.ordertime.strftime('%Y-%m-%d %H:%M') if order.ordertime else 'Unknown'
+            order_type = order.order_type or 'Order'
+            if order.order_subtype:
+                order_type += f" - {order.order_subtype}"
+            status = order.order_status or 'Unknown'
+            provider = f" by {order.order_provider_id}" if order.order_provider_id else ""
+            context += f"{i}. {order_type} [{status}]{provider} ({order_time})\n"
+        return context + "\n"
+    
+    def _render_icu_stays(self, icu_stays: List[SectionRow]) -> str:
+        context = "INTENSIVE CARE UNIT STAYS:\n"
+        for i, stay in enumerate(icu_stays, 1):
+            los = f"{stay.los_days:.1f} days" if stay.los_days else "Ongoing"
+            intime = stay.intime.strftime('%Y-%m-%d %H:%M') if stay.intime else 'Unknown'
+            context += f"{i}. ICU Stay ID {stay.stay_id}: {stay.first_careunit} → {stay.last_careunit}\n"
+            context += f"   Admitted: {intime}, LOS: {los}\n"
+        return context + "\n"
+    
+    def _render_vitals(self, vitals: List[SectionRow]) -> str:
+        context = "   Recent ICU Vital Signs:\n"
+        for v in vitals[:10]:
+            time = v.charttime.strftime('%Y-%m-%d %H:%M') if v.charttime else 'Unknown'
+            value = v.value or (f"{v.valuenum}" if v.valuenum else "N/A")
+            unit = v.valueuom or ''
+            status = f" [{v.status}]" if v.status == 'Warning' else ""
+            context += f"   • {v.label}: {value} {unit}{status} ({time})\n"
+        return context + "\n"
+    
+    def _render_vital_trends(self, trends: List[Dict]) -> str:
+        context = "   ICU Vital Sign Trends (all charted values, per item):\n"
+        for trend in trends:
+            context += f"   • {trend_summary.format_summary(trend)}\n"
+        return context + "\n"
+    
+    def _render_icu_inputs(self, icu_inputs: List[SectionRow]) -> str:
+        context = "   ICU Fluid/Medication Inputs:\n"
+        for inp in icu_inputs[:8]:
+            start = inp.starttime.strftime('%Y-%m-%d %H:%M') if inp.starttime else 'Unknown'
+            amount = f"{inp.amount} {inp.amountuom}" if inp.amount else ""
+            rate = f"@ {inp.rate} {inp.rateuom}" if inp.rate else ""
+            category = inp.ordercategoryname or 'Unknown'
+            context += f"   • {inp.label} ({category}): {amount} {rate} (Started: {start})\n"
+        return context + "\n"
     
     def close(self):
-        self.cursor.close()
-        self.conn.close()
+        if self._replica is not None:
+            if self._read_cursor is not None:
+                self._read_cursor.close()
+            self._drop_replica("closed")
+        if self._cursor is not None:
+            self._cursor.close()
+        if self._pool is not None and self._conn is not None:
+            self._pool.putconn(self._conn)
 
 
 class HealthcareAssistant:
     """RAG assistant with hybrid query routing (direct vs KB)"""
     
-    def __init__(self, subject_id: int, session_id: Optional[str] = None):
+    def __init__(self, subject_id: int, session_id: Optional[str] = None,
+                 scope: Optional[ContextScope] = None, deadline: Optional[float] = None):
         self.subject_id = subject_id
-        self.bedrock_client = boto3.client(
-            'bedrock-agent-runtime',
-            region_name=Config.AWS_REGION
-        )
+        self.deadline = deadline  # time.monotonic() by which Bedrock calls must have started (None = no limit)
+        self.bedrock_client = get_bedrock_client('bedrock-agent-runtime')
         self.patient_retriever = PatientDataRetriever()
+        # Admission/stay/time window the context is limited to (None = whole history)
+        self.scope = self.patient_retriever.resolve_scope(subject_id, scope) or None
         self.conversation_history = []
         self.session_id = session_id  # Accept existing session_id
-        self.patient_context = self.patient_retriever.build_patient_context(subject_id)
+        self.context_sections = []  # Sections sent with the latest question
+        self.context_source = None  # 'cache' (patient_context_cache) or 'live'
+        self._section_blocks = {}  # Rendered section blocks, reused by later questions
+        self.context_packing = None  # ContextPacker report for the latest prompt
+        self.section_timeouts = []  # Optional sections dropped from the latest context for time
+        self.last_result = None  # Result of the latest query_stream()
+        self.context_fingerprint = None  # Hash of the patient context (and KB passages) in the latest prompt
+        self._full_context = None
+        if not Config.LAZY_CONTEXT:
+            self._full_context = self._compose_sections([name for name, _, _ in CONTEXT_SECTIONS])
+    
+    @property
+    def patient_context(self) -> str:
+        """Full patient context with every section (built on first access)"""
+        if self._full_context is None:
+            self._full_context = self._compose_sections([name for name, _, _ in CONTEXT_SECTIONS])
+        return self._full_context
     
     def query(self, user_question: str) -> Dict:
         """Route query to appropriate backend (direct or KB)"""
         start_time = datetime.now()
+        if self._route(user_question):
+            return self._query_direct(user_question, start_time)
+        else:
+            return self._query_with_kb(user_question, start_time)
+    
+    def query_stream(self, user_question: str) -> Iterator[str]:
+        """
+        Like query(), but yields the answer text as the model generates it
+        
+        When the generator is exhausted, the result dict query() would have
+        returned is in self.last_result (and is the generator's return value),
+        with the time to the first token in 'first_token_ms'. On errors nothing
+        is yielded and last_result holds the error.
+        """
+        start_time = datetime.now()
+        try:
+            if self._route(user_question):
+                query_type, citations = 'direct', []
+                prompt = self._build_full_context_prompt(user_question)
+            else:
+                query_type, passages = 'kb', self._retrieve_passages(user_question)
+                prompt, citations = self._kb_prompt(user_question, passages), self._kb_citations(passages)
+            result = yield from self._stream_answer(user_question, prompt, citations, query_type, start_time)
+        except Exception as e:
+            result = self._exception_result(user_question, e, start_time)
+        self.last_result = result
+        return result
+    
+    def query_many(self, questions: List[str], pack: bool = False) -> Dict:
+        """
+        Answer several independent questions about the patient at once
+        
+        The sections every question needs are fetched in one context build,
+        each question gets its own prompt (all see the conversation as it was
+        before the batch), and the KB retrievals and model calls run
+        concurrently under the Bedrock limiter. With pack, all questions go to
+        the model in one prompt asking for numbered answers, which are split
+        back out (packed batches bypass the response cache).
+        
+        Returns {'results': [query() result per question], 'timings': {...}}.
+        Answers are recorded (audit trail, memory) in question order; each
+        result's response_time_ms counts from the start of the batch and
+        'model_ms' is the time of the Bedrock call that answered it.
+        """
+        start_time = datetime.now()
+        if not questions:
+            return {'results': [], 'timings': {'questions': 0, 'packed': pack, 'model_calls': 0, 'total_ms': 0}}
+        self.section_timeouts = []
+        routes = [self._is_patient_specific_question(question) for question in questions]
+        sections = [self._sections_for_question(q, direct) for q, direct in zip(questions, routes)]
+        all_sections = [name for name, _, _ in CONTEXT_SECTIONS]
+        union = [name for name in all_sections if any(name in wanted for wanted in sections)]
+        timings = {'questions': len(questions), 'packed': pack, 'model_calls': 0}
+        
+        # One context build for the whole batch; the prompts below only render it
+        if union:
+            self._context_for_sections(union)
+        timings['context_ms'] = int((datetime.now() - start_time).total_seconds() * 1000)
+        
+        executor = get_batch_executor()
+        kb_questions = [i for i, direct in enumerate(routes) if not direct]
+        retrieved = dict(zip(kb_questions, executor.map(
+            lambda i: _settled(self._retrieve_passages, questions[i]), kb_questions
+        )))
+        timings['retrieval_ms'] = int((datetime.now() - start_time).total_seconds() * 1000) - timings['context_ms']
+        
+        if pack:
+            outcomes = self._generate_packed(questions, union, retrieved)
+            timings['model_calls'] = int(any('model_ms' in outcome for outcome in outcomes))
+        else:
+            outcomes = self._generate_each(questions, routes, sections, retrieved, executor)
+            timings['model_calls'] = sum(1 for outcome in outcomes if 'model_ms' in outcome)
+        
+        results = []
+        for question, direct, outcome in zip(questions, routes, outcomes):
+            self.context_sections = outcome.get('sections', [])
+            self.context_packing = outcome.get('packing')
+            query_type = 'direct' if direct else 'kb'
+            session_id = 'direct-query' if direct else self.session_id
+            if outcome.get('error') is not None:
+                result = self._exception_result(question, outcome['error'], start_time)
+            elif outcome.get('cached'):
+                result = self._cache_hit_result(question, outcome['cached'], session_id, query_type, start_time)
+            else:
+                result = self._answer_result(question, outcome['answer'], outcome['citations'], session_id,
+                                             query_type, start_time, cache_key=outcome.get('cache_key'))
+            result['model_ms'] = outcome.get('model_ms')
+            result['packed'] = pack
+            results.append(result)
+        
+        timings['total_ms'] = int((datetime.now() - start_time).total_seconds() * 1000)
+        timings['generation_ms'] = timings['total_ms'] - timings['context_ms'] - timings['retrieval_ms']
+        logger.debug(f"Answered {len(questions)} questions in {timings['total_ms']}ms "
+                     f"({timings['model_calls']} model calls)")
+        return {'results': results, 'timings': timings}
+    
+    def _generate_each(self, questions: List[str], routes: List[bool], sections: List[List[str]],
+                       retrieved: Dict[int, tuple], executor: ThreadPoolExecutor) -> List[Dict]:
+        """query_many() outcomes with one prompt and (uncached) model call per question, run concurrently"""
+        outcomes, pending = [], {}
+        for i, (question, direct) in enumerate(zip(questions, routes)):
+            # Prompts are built one at a time: they share the assistant's context state
+            self.context_sections = sections[i]
+            outcome = {'sections': sections[i]}
+            outcomes.append(outcome)
+            passages, error, _ = retrieved.get(i, ([], None, 0))
+            try:
+                if error is not None:
+                    raise error
+                prompt = self._build_full_context_prompt(question) if direct else self._kb_prompt(question, passages)
+            except Exception as e:
+                outcome['error'] = e
+                continue
+            outcome['packing'] = self.context_packing
+            outcome['citations'] = [] if direct else self._kb_citations(passages)
+            outcome['cache_key'] = self._cache_key(question, 'direct' if direct else 'kb')
+            cached = get_response_cache().get(outcome['cache_key']) if outcome['cache_key'] else None
+            if cached is not None:
+                outcome['cached'] = cached
+            else:
+                pending[i] = executor.submit(_settled, self._generate, prompt)
+        
+        for i, future in pending.items():
+            outcomes[i]['answer'], outcomes[i]['error'], outcomes[i]['model_ms'] = future.result()
+        return outcomes
+    
+    def _generate_packed(self, questions: List[str], sections: List[str], retrieved: Dict[int, tuple]) -> List[Dict]:
+        """query_many() outcomes from a single model call answering every question"""
+        self.context_sections = sections
+        passages, seen = [], set()
+        for i in sorted(retrieved):
+            for passage in retrieved[i][0] or []:
+                key = (passage.get('location', {}).get('s3Location', {}).get('uri'),
+                       passage.get('content', {}).get('text'))
+                if key not in seen:
+                    seen.add(key)
+                    passages.append(passage)
+        
+        question = pack_questions(questions)
+        try:
+            prompt = self._kb_prompt(question, passages) if retrieved else self._build_full_context_prompt(question)
+        except Exception as e:
+            return [{'sections': sections, 'error': e} for _ in questions]
+        text, error, model_ms = _settled(self._generate, prompt)
+        logger.debug(f"Packed {len(questions)} questions into one prompt")
+        answers = split_packed_answers(text or '', len(questions))
+        
+        outcomes = []
+        for i, answer in enumerate(answers):
+            outcome = {'sections': sections, 'packing': self.context_packing, 'model_ms': model_ms}
+            if i in retrieved and retrieved[i][1] is not None:
+                outcome['error'] = retrieved[i][1]
+            elif error is not None:
+                outcome['error'] = error
+            elif answer is None:
+                outcome['error'] = ValueError(f"The packed response has no answer to question {i + 1}")
+            else:
+                outcome['answer'] = answer
+                outcome['citations'] = self._kb_citations(passages) if i in retrieved else []
+            outcomes.append(outcome)
+        return outcomes
+    
+    def _route(self, user_question: str) -> bool:
+        """Pick the backend and context sections for a question; True for the direct (patient data) path"""
+        self.section_timeouts = []
         
         # Determine query type
         is_patient_specific = self._is_patient_specific_question(user_question)
+        self.context_sections = self._sections_for_question(user_question, is_patient_specific)
         
         query_type = "Patient-specific (direct)" if is_patient_specific else "General medical (KB)"
-        print(f"[DEBUG] Query type: {query_type}")
-        
-        if is_patient_specific:
-            return self._query_direct(user_question, start_time)
-        else:
-            return self._query_with_kb(user_question, start_time)
+        logger.debug(f"Query type: {query_type}")
+        return is_patient_specific
     
     def _is_patient_specific_question(self, user_question: str) -> bool:
         """Determine if question is about patient data vs general medical knowledge"""
@@ -506,277 +2662,441 @@ class HealthcareAssistant:
         
         # Default to patient-specific for ambiguous cases
         return True
+    
+    def _sections_for_question(self, user_question: str, is_patient_specific: bool = True) -> List[str]:
+        """Map a question to the context sections it needs (render order)"""
+        all_sections = [name for name, _, _ in CONTEXT_SECTIONS]
+        if not Config.LAZY_CONTEXT:
+            return all_sections
+        
+        q_lower = user_question.lower()
+        if FULL_CONTEXT_PATTERN.search(q_lower):
+            return all_sections
+        
+        wanted = {name for name, pattern in SECTION_PATTERNS.items() if pattern.search(q_lower)}
+        
+        # Follow-ups ("what about that?") keep the previous question's sections
+        if self.conversation_history and self.context_sections:
+            wanted.update(self.context_sections)
+        
+        if not wanted:
+            # Ambiguous patient question: send everything; general knowledge: demographics only
+            return all_sections if is_patient_specific else ['profile']
+        
+        for name in list(wanted):
+            wanted.update(SECTION_DEPENDENCIES.get(name, ()))
+        wanted.add('profile')
+        return [name for name in all_sections if name in wanted]
+    
+    def _compose_sections(self, sections: List[str]) -> str:
+        """Patient context text with the given sections"""
+        return self.patient_retriever.compose_context(self.subject_id, self._context_for_sections(sections), self.scope)
+    
+    def _context_for_sections(self, sections: List[str]) -> Dict[str, str]:
+        """
+        Rendered blocks of the given sections, fetching only those not yet
+        loaded; a section that timed out has its timeout note as its block
+        """
+        retriever = self.patient_retriever
+        missing = [name for name in sections if name not in self._section_blocks]
+        
+        if missing and self.context_source is None:
+            # First load: a precomputed context is a single-row lookup (whole history only)
+            cached = None if self.scope else retriever.get_cached_context(self.subject_id)
+            self.context_source = 'cache' if cached else 'live'
+            if cached:
+                self._section_blocks.update(cached)
+                missing = [name for name in sections if name not in self._section_blocks]
+        
+        rendered = {}
+        if missing:
+            data = retriever.fetch_sections(self.subject_id, missing, scope=self.scope)
+            rendered = retriever.render_section_blocks(data)
+            timed_out = [rows for rows in data.values() if isinstance(rows, SectionTimeout)]
+            self.section_timeouts += [{'section': e.section, 'timeout_ms': e.timeout_ms} for e in timed_out]
+            # Keep only complete sections; the timed-out ones are retried by the next question
+            self._section_blocks.update(
+                (name, block) for name, block in rendered.items()
+                if name not in {e.section for e in timed_out}
+            )
+        
+        return {name: self._section_blocks.get(name, rendered.get(name, "")) for name in sections}
 
     
     def _query_direct(self, user_question: str, start_time: datetime) -> Dict:
         """Direct DeepSeek query for patient-specific questions"""
         try:
-            bedrock_runtime = boto3.client('bedrock-runtime', region_name=Config.AWS_REGION)
-            
             prompt = self._build_full_context_prompt(user_question)
+            cache_key = self._cache_key(user_question, 'direct')
+            cached = self._cached_result(user_question, cache_key, 'direct-query', 'direct', start_time)
+            if cached:
+                return cached
             
             # Call DeepSeek R1 directly (no KB)
-            request_body = {
-                "messages": [{
-                    "role": "user",
-                    "content": prompt
-                }],
-                "max_tokens": 3000,
-                "temperature": 0.7
-            }
-            
-            response = bedrock_runtime.invoke_model(
-                modelId=Config.MODEL_ARN,
-                body=json.dumps(request_body)
-            )
-            
-            response_body = json.loads(response['body'].read())
-            
-            # Parse DeepSeek response (try multiple formats)
-            if 'content' in response_body:
-                if isinstance(response_body['content'], list):
-                    answer = response_body['content'][0].get('text', str(response_body['content'][0]))
-                else:
-                    answer = response_body['content']
-            elif 'choices' in response_body:
-                answer = response_body['choices'][0]['message']['content']
-            elif 'completion' in response_body:
-                answer = response_body['completion']
-            else:
-                print(f"[DEBUG] Unexpected DeepSeek response format: {list(response_body.keys())}")
-                answer = str(response_body)
-            
-            response_time_ms = int((datetime.now() - start_time).total_seconds() * 1000)
-            
-            self._update_memory(user_question, answer)
-            
-            self._save_to_database(
-                question=user_question,
-                answer=answer,
-                citations=[],
-                response_time_ms=response_time_ms,
-                success=True,
-                error_message=None
-            )
-            
-            return {
-                'success': True,
-                'answer': answer,
-                'citations': [],
-                'session_id': 'direct-query',
-                'response_time_ms': response_time_ms,
-                'query_type': 'direct'
-            }
+            answer = self._generate(prompt)
+            return self._answer_result(user_question, answer, [], 'direct-query', 'direct', start_time,
+                                       cache_key=cache_key)
             
         except ClientError as e:
-            error_code = e.response['Error']['Code']
-            error_message = e.response['Error']['Message']
-            response_time_ms = int((datetime.now() - start_time).total_seconds() * 1000)
-            
-            self._save_to_database(
-                question=user_question,
-                answer=None,
-                citations=[],
-                response_time_ms=response_time_ms,
-                success=False,
-                error_message=f"{error_code}: {error_message}"
-            )
-            
-            return {
-                'success': False,
-                'error': f"{error_code}: {error_message}",
-                'response_time_ms': response_time_ms
-            }
+            return self._client_error_result(user_question, e, start_time)
             
         except Exception as e:
-            response_time_ms = int((datetime.now() - start_time).total_seconds() * 1000)
-            
-            self._save_to_database(
-                question=user_question,
-                answer=None,
-                citations=[],
-                response_time_ms=response_time_ms,
-                success=False,
-                error_message=str(e)
-            )
-            
-            return {
-                'success': False,
-                'error': f"Error: {str(e)}",
-                'response_time_ms': response_time_ms
-            }
+            return self._error_result(user_question, str(e), f"Error: {str(e)}", start_time,
+                                      throttled=isinstance(e, BedrockDeadlineExceeded))
+    
+    def _stream_answer(self, user_question: str, prompt: str, citations: list, query_type: str,
+                       start_time: datetime):
+        """
+        Answer a built prompt over invoke_model_with_response_stream, yielding
+        text deltas, and return the result dict (cache hits yield the whole answer)
+        """
+        session_id = 'direct-query' if query_type == 'direct' else self.session_id
+        cache_key = self._cache_key(user_question, query_type)
+        cached = self._cached_result(user_question, cache_key, session_id, query_type, start_time)
+        if cached:
+            yield cached['answer']
+            return cached
+        
+        response = call_bedrock(
+            with_first_event(get_bedrock_client('bedrock-runtime').invoke_model_with_response_stream),
+            Config.MODEL_ARN, self.deadline, hedge=Config.BEDROCK_HEDGING,
+            modelId=Config.MODEL_ARN,
+            body=json.dumps(self._direct_request(prompt))
+        )
+        
+        parts, first_token_ms = [], None
+        for event in response['body']:
+            if 'chunk' not in event:
+                continue
+            delta = self._parse_delta(json.loads(event['chunk']['bytes']))
+            if delta:
+                if first_token_ms is None:
+                    first_token_ms = int((datetime.now() - start_time).total_seconds() * 1000)
+                parts.append(delta)
+                yield delta
+        
+        return self._answer_result(user_question, ''.join(parts), citations, session_id, query_type,
+                                   start_time, first_token_ms, cache_key)
+    
+    def _generate(self, prompt: str) -> str:
+        """Answer text for a built prompt (one invoke_model call)"""
+        response = call_bedrock(
+            get_bedrock_client('bedrock-runtime').invoke_model, Config.MODEL_ARN, self.deadline,
+            hedge=Config.BEDROCK_HEDGING,
+            modelId=Config.MODEL_ARN,
+            body=json.dumps(self._direct_request(prompt))
+        )
+        return self._parse_answer(json.loads(response['body'].read()))
+    
+    @staticmethod
+    def _direct_request(prompt: str) -> Dict:
+        return {
+            "messages": [{
+                "role": "user",
+                "content": prompt
+            }],
+            **GENERATION_PARAMS
+        }
+    
+    @staticmethod
+    def _parse_answer(response_body: Dict) -> str:
+        """Answer text of an invoke_model response body (DeepSeek and compatible formats)"""
+        if 'content' in response_body:
+            if isinstance(response_body['content'], list):
+                return response_body['content'][0].get('text', str(response_body['content'][0]))
+            return response_body['content']
+        elif 'choices' in response_body:
+            return response_body['choices'][0]['message']['content']
+        elif 'completion' in response_body:
+            return response_body['completion']
+        logger.debug(f"Unexpected DeepSeek response format: {list(response_body.keys())}")
+        return str(response_body)
+    
+    @staticmethod
+    def _parse_delta(chunk: Dict) -> str:
+        """Text of one invoke_model_with_response_stream chunk ('' for reasoning / metadata chunks)"""
+        if 'choices' in chunk:
+            choice = chunk['choices'][0] if chunk['choices'] else {}
+            if 'delta' in choice:
+                return choice['delta'].get('content') or ''
+            return choice.get('text') or ''
+        if chunk.get('type') == 'content_block_delta':
+            return chunk['delta'].get('text', '')
+        return chunk.get('completion') or chunk.get('outputText') or chunk.get('generation') or ''
     
     def _query_with_kb(self, user_question: str, start_time: datetime) -> Dict:
         """KB-based query for general medical knowledge questions"""
         try:
-            augmented_question = self._build_full_context_prompt(user_question)
-            
-            config = {
-                'input': {'text': augmented_question},
-                'retrieveAndGenerateConfiguration': {
-                    'type': 'KNOWLEDGE_BASE',
-                    'knowledgeBaseConfiguration': {
-                        'knowledgeBaseId': Config.KNOWLEDGE_BASE_ID,
-                        'modelArn': Config.MODEL_ARN
-                    }
-                }
-            }
-            
-            if self.session_id and self.session_id != 'direct-query':
-                config['sessionId'] = self.session_id
-            
-            response = self.bedrock_client.retrieve_and_generate(**config)
-            response_time_ms = int((datetime.now() - start_time).total_seconds() * 1000)
-            
-            self.session_id = response.get('sessionId')
-            answer = response['output']['text']
-            citations = response.get('citations', [])
-            
-            self._update_memory(user_question, answer)
-            
-            self._save_to_database(
-                question=user_question,
-                answer=answer,
-                citations=citations,
-                response_time_ms=response_time_ms,
-                success=True,
-                error_message=None
-            )
+            passages = self._retrieve_passages(user_question)
+            prompt = self._kb_prompt(user_question, passages)
+            cache_key = self._cache_key(user_question, 'kb')
+            cached = self._cached_result(user_question, cache_key, self.session_id, 'kb', start_time)
+            if cached:
+                return cached
             
-            return {
-                'success': True,
-                'answer': answer,
-                'citations': citations,
-                'session_id': self.session_id,
-                'response_time_ms': response_time_ms,
-                'query_type': 'kb'
-            }
+            answer = self._generate(prompt)
+            return self._answer_result(user_question, answer, self._kb_citations(passages), self.session_id,
+                                       'kb', start_time, cache_key=cache_key)
             
         except ClientError as e:
-            error_code = e.response['Error']['Code']
-            error_message = e.response['Error']['Message']
-            response_time_ms = int((datetime.now() - start_time).total_seconds() * 1000)
-            
-            self._save_to_database(
-                question=user_question,
-                answer=None,
-                citations=[],
-                response_time_ms=response_time_ms,
-                success=False,
-                error_message=f"{error_code}: {error_message}"
-            )
-            
-            return {
-                'success': False,
-                'error': f"{error_code}: {error_message}",
-                'response_time_ms': response_time_ms
-            }
+            return self._client_error_result(user_question, e, start_time)
             
         except Exception as e:
-            response_time_ms = int((datetime.now() - start_time).total_seconds() * 1000)
-            
-            self._save_to_database(
-                question=user_question,
-                answer=None,
-                citations=[],
-                response_time_ms=response_time_ms,
-                success=False,
-                error_message=str(e)
+            return self._error_result(user_question, str(e), f"Unexpected error: {str(e)}", start_time,
+                                      throttled=isinstance(e, BedrockDeadlineExceeded))
+    
+    def _retrieve_passages(self, user_question: str) -> List[Dict]:
+        """
+        Knowledge base passages for the question alone (no patient data), so
+        retrieval is not diluted by the record and is cached across patients
+        """
+        if Config.KB_RETRIEVAL == 'dense' and vector_index.available():
+            return get_vector_index().search(user_question, Config.KB_NUMBER_OF_RESULTS)
+        if Config.KB_RETRIEVAL in ('local', 'dense'):  # dense without NumPy falls back to BM25
+            return get_kb_index().search(user_question, Config.KB_NUMBER_OF_RESULTS)
+        
+        cache = get_retrieval_cache()
+        key = json.dumps([Config.KNOWLEDGE_BASE_ID, Config.KB_NUMBER_OF_RESULTS, normalize_question(user_question)])
+        passages = cache.get(key) if cache else None
+        if passages is None:
+            response = call_bedrock(
+                self.bedrock_client.retrieve, f"kb/{Config.KNOWLEDGE_BASE_ID}", self.deadline,
+                knowledgeBaseId=Config.KNOWLEDGE_BASE_ID,
+                retrievalQuery={'text': user_question},
+                retrievalConfiguration={
+                    'vectorSearchConfiguration': {'numberOfResults': Config.KB_NUMBER_OF_RESULTS}
+                }
             )
-            
-            return {
-                'success': False,
-                'error': f"Unexpected error: {str(e)}",
-                'response_time_ms': response_time_ms
-            }
+            passages = response.get('retrievalResults', [])
+            if cache:
+                cache.put(key, passages)
+        else:
+            logger.debug("KB retrieval cache hit")
+        return passages
+    
+    def _kb_prompt(self, user_question: str, passages: List[Dict]) -> str:
+        """Retrieved passages followed by the usual history / patient sections / question prompt"""
+        block = CONTEXT_RULE + " MEDICAL KNOWLEDGE BASE PASSAGES\n" + CONTEXT_RULE + "\n"
+        for i, passage in enumerate(passages, 1):
+            uri = passage.get('location', {}).get('s3Location', {}).get('uri', '')
+            block += f"[{i}] {uri.split('/')[-1] or 'Knowledge base'}\n"
+            block += passage.get('content', {}).get('text', '').strip() + "\n\n"
+        if not passages:
+            block += "No relevant passages were found in the knowledge base.\n\n"
+        block += ("Answer general medical questions from these passages, citing them as [n], and use the "
+                  "patient record below only to relate the answer to this patient.\n\n")
+        
+        prompt = self._build_full_context_prompt(user_question, preamble=block)
+        # The answer depends on the passages as much as on the patient context
+        self.context_fingerprint = hashlib.sha256((self.context_fingerprint + block).encode()).hexdigest()
+        return prompt
+    
+    @staticmethod
+    def _kb_citations(passages: List[Dict]) -> list:
+        """Passages as retrieve_and_generate citations (what the audit trail and CLIs read)"""
+        return [{'retrievedReferences': passages}] if passages else []
+    
+    def _cache_key(self, user_question: str, query_type: str) -> Optional[str]:
+        """
+        Response cache key for a question whose prompt was just built: the
+        normalized question, the patient context (and KB passages) sent with
+        it, the model and generation settings, and the previous exchange
+        """
+        if get_response_cache() is None:
+            return None
+        previous = self.conversation_history[-1] if self.conversation_history else {}
+        return hashlib.sha256(json.dumps([
+            normalize_question(user_question),
+            self.context_fingerprint,
+            Config.MODEL_ARN,
+            query_type,
+            GENERATION_PARAMS,
+            Config.KNOWLEDGE_BASE_ID if query_type == 'kb' else None,
+            previous.get('question'),
+            previous.get('answer'),
+        ]).encode()).hexdigest()
+    
+    def _cached_result(self, user_question: str, cache_key: Optional[str], session_id: Optional[str],
+                       query_type: str, start_time: datetime) -> Optional[Dict]:
+        """Result for a cached answer (recorded like a fresh one, flagged cache_hit), or None"""
+        cached = get_response_cache().get(cache_key) if cache_key else None
+        if cached is None:
+            return None
+        return self._cache_hit_result(user_question, cached, session_id, query_type, start_time)
+    
+    def _cache_hit_result(self, user_question: str, cached: tuple, session_id: Optional[str],
+                          query_type: str, start_time: datetime) -> Dict:
+        logger.debug("Response cache hit")
+        answer, citations = cached
+        result = self._answer_result(user_question, answer, citations, session_id, query_type, start_time,
+                                     cache_hit=True)
+        result['first_token_ms'] = result['response_time_ms']
+        return result
+    
+    def _answer_result(self, user_question: str, answer: str, citations: list, session_id: Optional[str],
+                       query_type: str, start_time: datetime, first_token_ms: Optional[int] = None,
+                       cache_key: Optional[str] = None, cache_hit: bool = False) -> Dict:
+        """Record a successful answer (memory, audit trail, response cache) and build the query result"""
+        response_time_ms = int((datetime.now() - start_time).total_seconds() * 1000)
+        
+        if cache_key and answer:
+            get_response_cache().put(cache_key, (answer, citations))
+        
+        self._update_memory(user_question, answer)
+        
+        self._save_to_database(
+            question=user_question,
+            answer=answer,
+            citations=citations,
+            response_time_ms=response_time_ms,
+            success=True,
+            error_message=None,
+            cache_hit=cache_hit
+        )
+        
+        cache = get_response_cache()
+        return {
+            'success': True,
+            'answer': answer,
+            'citations': citations,
+            'session_id': session_id,
+            'response_time_ms': response_time_ms,
+            'first_token_ms': first_token_ms,
+            'query_type': query_type,
+            'cache_hit': cache_hit,
+            'response_cache': cache.stats() if cache else None,
+            'context_sections': self.context_sections,
+            'context_source': self.context_source,
+            'context_packing': self.context_packing,
+            'section_timeouts': self.section_timeouts,
+            'query_stats': self.patient_retriever.stats.take() if self.patient_retriever.stats else None,
+            'bedrock_metrics': bedrock_metrics()
+        }
+    
+    def _exception_result(self, user_question: str, e: Exception, start_time: datetime) -> Dict:
+        if isinstance(e, ClientError):
+            return self._client_error_result(user_question, e, start_time)
+        return self._error_result(user_question, str(e), f"Error: {str(e)}", start_time,
+                                  throttled=isinstance(e, BedrockDeadlineExceeded))
+    
+    def _client_error_result(self, user_question: str, e: ClientError, start_time: datetime) -> Dict:
+        error_code = e.response['Error']['Code']
+        error_message = e.response['Error']['Message']
+        error = f"{error_code}: {error_message}"
+        return self._error_result(user_question, error, error, start_time, throttled=error_code in THROTTLING_ERRORS)
+    
+    def _error_result(self, user_question: str, error_message: str, error: str, start_time: datetime,
+                      throttled: bool = False) -> Dict:
+        """Record a failed question in the audit trail and build the error result"""
+        response_time_ms = int((datetime.now() - start_time).total_seconds() * 1000)
+        
+        self._save_to_database(
+            question=user_question,
+            answer=None,
+            citations=[],
+            response_time_ms=response_time_ms,
+            success=False,
+            error_message=error_message
+        )
+        
+        return {
+            'success': False,
+            'error': error,
+            'throttled': throttled,  # Bedrock throttled or out of capacity until the deadline; worth retrying later
+            'response_time_ms': response_time_ms
+        }
     
     def _save_to_database(self, question: str, answer: str, citations: list, 
-                        response_time_ms: int, success: bool, error_message: str):
+                        response_time_ms: int, success: bool, error_message: str,
+                        cache_hit: bool = False):
         """Save query to PostgreSQL for audit trail and analytics"""
         try:
             if not self.subject_id:
-                print(f"\n  Warning: No subject_id set, skipping database save")
-                return
-            
-            self.patient_retriever.cursor.execute("""
-                INSERT INTO kb_queries 
-                (subject_id, query_text, response_text, session_id, 
-                response_time_ms, citation_count, success, error_message, 
-                model_arn, created_at)
-                VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-                RETURNING query_id
-            """, (
-                self.subject_id,
-                question,
-                answer,
-                self.session_id,
-                response_time_ms,
-                len(citations) if citations else 0,
-                success,
-                error_message,
-                Config.MODEL_ARN,
-                datetime.now()
-            ))
-            
-            result = self.patient_retriever.cursor.fetchone()
-            
-            if not result or 'query_id' not in result:
-                print(f"\n  Warning: Failed to get query_id from database")
-                self.patient_retriever.conn.rollback()
-                return
-            
-            query_id = result['query_id']
-            
-            if not query_id:
-                print(f"\n  Warning: Invalid query_id: {query_id}")
-                self.patient_retriever.conn.rollback()
+                logger.warning("No subject_id set, skipping database save")
                 return
             
-            # Insert citation records
-            if citations and success:
-                for citation in citations:
-                    refs = citation.get('retrievedReferences', [])
-                    for ref in refs:
-                        source_uri = ref.get('location', {}).get('s3Location', {}).get('uri', '')
-                        source_document = source_uri.split('/')[-1] if source_uri else 'Unknown'
-                        excerpt = ref.get('content', {}).get('text', '')
-                        
-                        metadata = {
-                            's3_uri': source_uri,
-                            'reference_type': ref.get('location', {}).get('type', 'S3')
-                        }
-                        
-                        self.patient_retriever.cursor.execute("""
-                            INSERT INTO kb_citations 
-                            (query_id, source_document, excerpt_text, metadata, created_at)
-                            VALUES (%s, %s, %s, %s, %s)
-                        """, (
-                            query_id,
-                            source_document,
-                            excerpt[:1000] if excerpt else None,
-                            json.dumps(metadata),
-                            datetime.now()
-                        ))
-            
-            self.patient_retriever.conn.commit()
+            try:
+                self._insert_query_records(question, answer, citations, response_time_ms, success, error_message,
+                                           cache_hit)
+            except PreparedStatementFallback:
+                # Transaction was rolled back while switching to plain SQL; replay it
+                self._insert_query_records(question, answer, citations, response_time_ms, success, error_message,
+                                           cache_hit)
             
         except psycopg2.Error as e:
-            print(f"\n  Warning: PostgreSQL error - {e}")
+            logger.warning(f"PostgreSQL error - {e}")
             try:
                 self.patient_retriever.conn.rollback()
             except:
                 pass
                 
         except Exception as e:
-            print(f"\n  Warning: Failed to save query to database: {e}")
+            logger.warning(f"Failed to save query to database: {e}")
             try:
                 self.patient_retriever.conn.rollback()
             except:
                 pass
     
-    def _build_full_context_prompt(self, user_question: str) -> str:
-        """Build comprehensive prompt with patient data + conversation history"""
-        prompt = ""
+    def _insert_query_records(self, question: str, answer: str, citations: list,
+                              response_time_ms: int, success: bool, error_message: str,
+                              cache_hit: bool = False):
+        """Insert the kb_queries row plus its kb_citations in one transaction"""
+        retriever = self.patient_retriever
+        retriever.execute_named('insert_kb_query', (
+            self.subject_id,
+            question,
+            answer,
+            self.session_id,
+            response_time_ms,
+            len(citations) if citations else 0,
+            success,
+            error_message,
+            Config.MODEL_ARN,
+            cache_hit,
+            datetime.now()
+        ), replay=False)
+        
+        result = retriever.cursor.fetchone()
+        
+        if not result or 'query_id' not in result:
+            logger.warning("Failed to get query_id from database")
+            retriever.conn.rollback()
+            return
+        
+        query_id = result['query_id']
+        
+        if not query_id:
+            logger.warning(f"Invalid query_id: {query_id}")
+            retriever.conn.rollback()
+            return
+        
+        # Insert citation records
+        if citations and success:
+            for citation in citations:
+                refs = citation.get('retrievedReferences', [])
+                for ref in refs:
+                    source_uri = ref.get('location', {}).get('s3Location', {}).get('uri', '')
+                    source_document = source_uri.split('/')[-1] if source_uri else 'Unknown'
+                    excerpt = ref.get('content', {}).get('text', '')
+                    
+                    metadata = {
+                        's3_uri': source_uri,
+                        'reference_type': ref.get('location', {}).get('type', 'S3')
+                    }
+                    
+                    retriever.execute_named('insert_kb_citation', (
+                        query_id,
+                        source_document,
+                        excerpt[:1000] if excerpt else None,
+                        json.dumps(metadata),
+                        datetime.now()
+                    ), replay=False)
+        
+        retriever.conn.commit()
+    
+    def _build_full_context_prompt(self, user_question: str, preamble: str = "") -> str:
+        """Build comprehensive prompt with patient data + conversation history (after an optional preamble)"""
+        prompt = preamble
         
         # Add conversation history if exists
         if self.conversation_history:
@@ -799,23 +3119,47 @@ class HealthcareAssistant:
                 prompt += f"The current question likely refers to events on or around these dates.\n"
                 prompt += f"CHECK THE PATIENT'S MEDICATION DATA BELOW FOR THESE DATES.\n\n"
         
-        # Add full patient context
-        prompt += self.patient_context
-        
         # Current question
-        prompt += f"\n═══════════════════════════════════════════════════════════════════════════════\n"
-        prompt += f"CURRENT QUESTION: {user_question}\n"
-        prompt += f"═══════════════════════════════════════════════════════════════════════════════\n\n"
+        question = f"\n═══════════════════════════════════════════════════════════════════════════════\n"
+        question += f"CURRENT QUESTION: {user_question}\n"
+        question += f"═══════════════════════════════════════════════════════════════════════════════\n\n"
         
         if self.conversation_history:
-            prompt += "  CRITICAL INSTRUCTIONS:\n"
-            prompt += "- This is a FOLLOW-UP question referring to the previous conversation\n"
-            prompt += "- Words like 'this', 'that', 'said procedure' refer to information from the previous answer\n"
-            prompt += "- USE THE PATIENT'S ACTUAL MEDICATION DATA shown in the clinical record above\n"
-            prompt += "- DO NOT say 'no information available' if medications are listed in the patient record\n"
-            prompt += "- Look at PRESCRIBED MEDICATIONS and MEDICATION ADMINISTRATION RECORDS sections\n"
+            question += "  CRITICAL INSTRUCTIONS:\n"
+            question += "- This is a FOLLOW-UP question referring to the previous conversation\n"
+            question += "- Words like 'this', 'that', 'said procedure' refer to information from the previous answer\n"
+            question += "- USE THE PATIENT'S ACTUAL MEDICATION DATA shown in the clinical record above\n"
+            question += "- DO NOT say 'no information available' if medications are listed in the patient record\n"
+            question += "- Look at PRESCRIBED MEDICATIONS and MEDICATION ADMINISTRATION RECORDS sections\n"
         
-        return prompt
+        # Add patient context (only the sections this question needs, within the token budget)
+        context = self._packed_context(user_question, reserved_tokens=estimate_tokens(prompt + question))
+        self.context_fingerprint = hashlib.sha256(context.encode()).hexdigest()
+        return prompt + context + question
+    
+    def _packed_context(self, user_question: str, reserved_tokens: int = 0) -> str:
+        """Patient context for the current sections, trimmed to Config.PROMPT_TOKEN_BUDGET"""
+        sections = self.context_sections or [name for name, _, _ in CONTEXT_SECTIONS]
+        if not Config.PROMPT_TOKEN_BUDGET:
+            self.context_packing = None
+            if len(sections) == len(CONTEXT_SECTIONS):
+                return self.patient_context
+            return self._compose_sections(sections)
+        
+        blocks = self._context_for_sections(sections)
+        retriever = self.patient_retriever
+        frame = retriever.compose_context(self.subject_id, {}, self.scope)
+        
+        q_lower = user_question.lower()
+        relevant = {name for name, pattern in SECTION_PATTERNS.items() if pattern.search(q_lower)}
+        packed, report = ContextPacker(Config.PROMPT_TOKEN_BUDGET).pack(
+            blocks, relevant, reserved_tokens + estimate_tokens(frame)
+        )
+        if report['dropped'] or report['truncated']:
+            logger.debug(f"Context packed to {report['context_tokens']} tokens; "
+                         f"truncated: {report['truncated']}, dropped: {report['dropped']}")
+        self.context_packing = report
+        return retriever.compose_context(self.subject_id, packed, self.scope)
     
     def _update_memory(self, question: str, answer: str):
         self.conversation_history.append({
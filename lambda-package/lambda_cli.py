@@ -91,18 +91,29 @@ def main():
             
             # Query Assistant
             print("\n Analyzing patient data and retrieving relevant medical knowledge...")
-            result = assistant.query(question)
+            header_printed = False
+            for delta in assistant.query_stream(question):
+                if not header_printed:
+                    print("\n" + "─"*80)
+                    print(" CLINICAL ANSWER:")
+                    print("─"*80)
+                    header_printed = True
+                print(delta, end='', flush=True)
+            result = assistant.last_result
             
             if result['success']:
-                print("\n" + "─"*80)
-                print(" CLINICAL ANSWER:")
-                print("─"*80)
-                print(result['answer'])
+                if not header_printed:
+                    print("\n" + "─"*80)
+                    print(" CLINICAL ANSWER:")
+                    print("─"*80)
+                print()
                 
                 # Show query type and response time
                 query_type_text = "Knowledge Base" if result.get('query_type') == 'kb' else "Patient Data"
                 print(f"\n Query type: {query_type_text}")
                 print(f"  Response time: {result['response_time_ms']}ms")
+                if result.get('first_token_ms') is not None:
+                    print(f"  First token: {result['first_token_ms']}ms")
                 
                 if result['citations']:
                     print("\n KNOWLEDGE SOURCES:")
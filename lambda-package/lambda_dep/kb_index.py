@@ -0,0 +1,185 @@
+"""
+Local Knowledge Base Index
+BM25 retrieval over the knowledge base markdown documents (the files uploaded
+to the Bedrock KB bucket), chunked by heading. Passages come back in the shape
+of Bedrock Retrieve results / retrievedReferences, so they are a drop-in,
+network-free replacement for the KB retrieval call
+"""
+
+import heapq
+import logging
+import math
+import os
+import pickle
+import re
+from collections import Counter
+from operator import itemgetter
+from typing import Dict, List, Optional
+
+import cache_files
+
+logger = logging.getLogger(__name__)
+
+_MODULE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Documents shipped in the Lambda package (build-lambda.sh), else the repository copy
+DEFAULT_DOCUMENT_DIR = next(
+    (path for path in (os.path.join(_MODULE_DIR, 'knowledge_base'),
+                       os.path.join(_MODULE_DIR, '..', 's3 bucket files'))
+     if os.path.isdir(path)),
+    os.path.join(_MODULE_DIR, 'knowledge_base')
+)
+
+HEADING_PATTERN = re.compile(r'^(#{1,6})\s+(.*?)\s*#*\s*$')
+TOKEN_PATTERN = re.compile(r'[a-z0-9]+')
+
+STOPWORDS = frozenset("""
+    a an and are as at be by can do does for from has have how if in into is it its of on or
+    such that the their them there these they this to was were what when where which who why
+    will with
+""".split())
+
+
+def tokenize(text: str) -> List[str]:
+    """Lowercase word tokens without stopwords, with plural 's' folded ("rules" -> "rule")"""
+    tokens = []
+    for token in TOKEN_PATTERN.findall(text.lower()):
+        if token in STOPWORDS:
+            continue
+        if len(token) > 3 and token.endswith('s') and not token.endswith('ss'):
+            token = token[:-1]
+        tokens.append(token)
+    return tokens
+
+
+def chunk_markdown(text: str, source: str, max_chars: int = 2000) -> List[tuple]:
+    """
+    (source, heading path, text) chunks: one per heading section, with sections
+    longer than max_chars split at paragraph boundaries
+    """
+    chunks, headings, body = [], [], []
+
+    def flush():
+        paragraphs = [p.strip() for p in '\n'.join(body).split('\n\n') if p.strip() and p.strip() != '---']
+        body.clear()
+        heading = ' > '.join(title for _, title in headings)
+        piece = ''
+        for paragraph in paragraphs:
+            if piece and len(piece) + len(paragraph) > max_chars:
+                chunks.append((source, heading, piece))
+                piece = ''
+            piece = f"{piece}\n\n{paragraph}" if piece else paragraph
+        if piece:
+            chunks.append((source, heading, piece))
+
+    for line in text.splitlines():
+        match = HEADING_PATTERN.match(line)
+        if match:
+            flush()
+            level = len(match.group(1))
+            while headings and headings[-1][0] >= level:
+                headings.pop()
+            headings.append((level, match.group(2).strip('*')))
+        else:
+            body.append(line)
+    flush()
+    return chunks
+
+
+class BM25Index:
+    """Inverted index over (source, heading, text) chunks with Okapi BM25 scoring"""
+
+    def __init__(self, chunks: List[tuple], uri_prefix: str = 's3://knowledge-base/',
+                 k1: float = 1.2, b: float = 0.75):
+        self.chunks = chunks
+        self.uri_prefix = uri_prefix
+        counts = [Counter(tokenize(f"{heading}\n{text}")) for _, heading, text in chunks]
+        lengths = [sum(c.values()) for c in counts]
+        avg_length = sum(lengths) / len(lengths) if lengths else 0.0
+
+        # term -> [(chunk index, BM25 term-frequency weight)]; the idf factor is applied at query time
+        self.postings = {}
+        for doc_id, (c, length) in enumerate(zip(counts, lengths)):
+            norm = k1 * (1 - b + b * length / avg_length) if avg_length else k1
+            for term, tf in c.items():
+                self.postings.setdefault(term, []).append((doc_id, tf * (k1 + 1) / (tf + norm)))
+        n = len(chunks)
+        self.idf = {
+            term: math.log(1 + (n - len(postings) + 0.5) / (len(postings) + 0.5))
+            for term, postings in self.postings.items()
+        }
+
+    def search(self, query: str, k: int = 5) -> List[Dict]:
+        """Top-k passages as Bedrock retrievalResults (content / location / metadata / score)"""
+        scores = {}
+        for term in set(tokenize(query)):
+            idf = self.idf.get(term)
+            if idf is None:
+                continue
+            for doc_id, weight in self.postings[term]:
+                scores[doc_id] = scores.get(doc_id, 0.0) + idf * weight
+        top = heapq.nlargest(k, scores.items(), key=itemgetter(1))
+        return [self.reference(doc_id, score) for doc_id, score in top]
+
+    def reference(self, doc_id: int, score: float) -> Dict:
+        return passage_reference(self.chunks[doc_id], score, self.uri_prefix)
+
+
+def passage_reference(chunk: tuple, score: float, uri_prefix: str) -> Dict:
+    """A (source, heading, text) chunk as a Bedrock retrievalResult"""
+    source, heading, text = chunk
+    uri = uri_prefix + source
+    return {
+        'content': {'text': text, 'type': 'TEXT'},
+        'location': {'type': 'S3', 's3Location': {'uri': uri}},
+        'metadata': {'x-amz-bedrock-kb-source-uri': uri, 'heading': heading},
+        'score': round(float(score), 4),
+    }
+
+
+def document_fingerprint(directory: str) -> tuple:
+    """(name, size, mtime) of every markdown document, to detect a stale saved index"""
+    return tuple(sorted(
+        (entry.name, entry.stat().st_size, entry.stat().st_mtime_ns)
+        for entry in os.scandir(directory) if entry.name.endswith('.md')
+    ))
+
+
+def load_chunks(directory: str) -> List[tuple]:
+    """Heading chunks of every markdown document in directory"""
+    chunks = []
+    for name in sorted(os.listdir(directory)):
+        if name.endswith('.md'):
+            with open(os.path.join(directory, name), encoding='utf-8') as f:
+                chunks += chunk_markdown(f.read(), name)
+    return chunks
+
+
+def build_index(directory: str, uri_prefix: str = 's3://knowledge-base/') -> BM25Index:
+    return BM25Index(load_chunks(directory), uri_prefix)
+
+
+def load_index(directory: str, cache_path: Optional[str] = None,
+               uri_prefix: str = 's3://knowledge-base/') -> BM25Index:
+    """
+    BM25 index of the documents in directory, reusing the pickle at cache_path
+    when it was built from the same files and URI prefix (and is a private
+    file, see cache_files)
+    """
+    fingerprint = (document_fingerprint(directory), uri_prefix)
+    if cache_path and os.path.exists(cache_path):
+        try:
+            cached = cache_files.load_pickle(cache_path)
+            if cached['fingerprint'] == fingerprint:
+                return cached['index']
+        except (OSError, pickle.UnpicklingError, EOFError, KeyError, AttributeError) as e:
+            logger.debug(f"Ignoring unreadable KB index {cache_path}: {e}")
+
+    index = build_index(directory, uri_prefix)
+
+    if cache_path:
+        try:
+            cache_files.dump_pickle({'fingerprint': fingerprint, 'index': index}, cache_path)
+        except OSError as e:
+            logger.debug(f"Could not write KB index {cache_path}: {e}")
+    return index
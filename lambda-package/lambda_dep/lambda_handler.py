@@ -5,6 +5,7 @@ Provides API endpoint for patient-specific clinical queries
 
 import json
 import os
+import time
 from datetime import datetime
 from typing import Dict
 import boto3
@@ -19,7 +20,12 @@ except ImportError:
     pass  # In Lambda, dotenv won't be installed (and isn't needed)
 
 # Import core classes
-from healthcare_assistant import Config, PatientDataRetriever, HealthcareAssistant
+from healthcare_assistant import (Config, ContextScope, PatientDataRetriever, HealthcareAssistant, THROTTLING_ERRORS,
+                                  get_bedrock_client)
+
+# Create the Bedrock clients during the init phase; warm invocations reuse them
+get_bedrock_client('bedrock-runtime')
+get_bedrock_client('bedrock-agent-runtime')
 
 
 def lambda_handler(event, context):
@@ -41,6 +47,13 @@ def lambda_handler(event, context):
         "question": "What medications is this patient on?",
         "session_id": "optional-session-id"
     }
+    
+    Optional "hadm_id" and/or "stay_id" limit the patient context to one
+    admission / ICU stay.
+    
+    "questions": [...] instead of "question" answers several independent
+    questions in one call (HealthcareAssistant.query_many), with "pack": true
+    to send them to the model as a single prompt.
     """
     
     try:
@@ -53,13 +66,20 @@ def lambda_handler(event, context):
         # Extract parameters
         subject_id = body.get('subject_id')
         question = body.get('question')
+        questions = body.get('questions')
         session_id = body.get('session_id')
+        scope = ContextScope(hadm_id=body.get('hadm_id'), stay_id=body.get('stay_id')) or None
         
         # Validate required inputs
         if not subject_id:
             return error_response(400, "Missing required field: subject_id")
         
-        if not question:
+        if questions is not None:
+            if not isinstance(questions, list) or not questions or not all(isinstance(q, str) and q for q in questions):
+                return error_response(400, "questions must be a non-empty list of strings")
+            if len(questions) > Config.QUERY_BATCH_MAX_QUESTIONS:
+                return error_response(400, f"At most {Config.QUERY_BATCH_MAX_QUESTIONS} questions per request")
+        elif not question:
             return error_response(400, "Missing required field: question")
         
         # Validate subject_id exists
@@ -67,10 +87,25 @@ def lambda_handler(event, context):
         if not retriever.validate_subject_id(subject_id):
             retriever.close()
             return error_response(404, f"Subject ID {subject_id} not found in database")
-        retriever.close()
+        try:
+            scope = retriever.resolve_scope(subject_id, scope)
+        except ValueError as e:
+            return error_response(404, str(e))
+        finally:
+            retriever.close()
+        
+        # Bedrock retries and queueing stop in time to return a response before the Lambda times out
+        deadline = None
+        if context is not None and hasattr(context, 'get_remaining_time_in_millis'):
+            deadline = time.monotonic() + (context.get_remaining_time_in_millis() - Config.LAMBDA_DEADLINE_MARGIN_MS) / 1000
         
         # Initialize assistant
-        assistant = HealthcareAssistant(subject_id=subject_id, session_id=session_id)
+        assistant = HealthcareAssistant(subject_id=subject_id, session_id=session_id, scope=scope, deadline=deadline)
+        
+        if questions is not None:
+            batch = assistant.query_many(questions, pack=bool(body.get('pack')))
+            assistant.close()
+            return batch_response(subject_id, questions, batch, scope)
         
         # Query with patient context
         result = assistant.query(question)
@@ -88,8 +123,23 @@ def lambda_handler(event, context):
                 'session_id': result.get('session_id'),
                 'response_time_ms': result.get('response_time_ms'),
                 'query_type': result.get('query_type', 'unknown'),
+                'cache_hit': result.get('cache_hit', False),
+                'response_cache': result.get('response_cache'),
+                'context_sections': result.get('context_sections', []),
+                'context_packing': result.get('context_packing'),
+                'section_timeouts': result.get('section_timeouts', []),
+                'query_stats': result.get('query_stats'),
+                'bedrock_metrics': result.get('bedrock_metrics'),
+                'hadm_id': scope.hadm_id if scope else None,
+                'stay_id': scope.stay_id if scope else None,
                 'timestamp': datetime.now().isoformat()
             })
+        elif result.get('throttled'):
+            # Bedrock is over its quota for now: the client should back off and retry
+            return error_response(429, result.get('error', 'Too many requests'), {
+                'response_time_ms': result.get('response_time_ms'),
+                'retryable': True
+            })
         else:
             return error_response(500, result.get('error', 'Query failed'), {
                 'response_time_ms': result.get('response_time_ms')
@@ -104,7 +154,8 @@ def lambda_handler(event, context):
     except ClientError as e:
         error_code = e.response['Error']['Code']
         error_message = e.response['Error']['Message']
-        return error_response(502, f"AWS Bedrock error: {error_code} - {error_message}")
+        status_code = 429 if error_code in THROTTLING_ERRORS else 502
+        return error_response(status_code, f"AWS Bedrock error: {error_code} - {error_message}")
     
     except Exception as e:
         import traceback
@@ -113,6 +164,53 @@ def lambda_handler(event, context):
         return error_response(500, f"Internal server error: {str(e)}")
 
 
+def batch_response(subject_id, questions: list, batch: Dict, scope) -> Dict:
+    """Per-question answers / errors of a query_many() batch (200 unless every question failed)"""
+    answers = []
+    for question, result in zip(questions, batch['results']):
+        if result['success']:
+            answers.append({
+                'question': question,
+                'success': True,
+                'answer': result['answer'],
+                'citations': result.get('citations', []),
+                'query_type': result.get('query_type', 'unknown'),
+                'cache_hit': result.get('cache_hit', False),
+                'response_time_ms': result.get('response_time_ms'),
+                'model_ms': result.get('model_ms'),
+                'context_sections': result.get('context_sections', []),
+            })
+        else:
+            answers.append({
+                'question': question,
+                'success': False,
+                'error': result.get('error'),
+                'throttled': result.get('throttled', False),
+                'response_time_ms': result.get('response_time_ms'),
+            })
+    
+    if not any(answer['success'] for answer in answers):
+        status_code = 429 if all(answer['throttled'] for answer in answers) else 500
+        return error_response(status_code, answers[0]['error'] or 'Query failed', {
+            'answers': answers,
+            'timings': batch['timings'],
+            'retryable': status_code == 429
+        })
+    
+    last = next(result for result in reversed(batch['results']) if result['success'])
+    return success_response({
+        'subject_id': subject_id,
+        'answers': answers,
+        'timings': batch['timings'],
+        'session_id': last.get('session_id'),
+        'section_timeouts': last.get('section_timeouts', []),
+        'bedrock_metrics': last.get('bedrock_metrics'),
+        'hadm_id': scope.hadm_id if scope else None,
+        'stay_id': scope.stay_id if scope else None,
+        'timestamp': datetime.now().isoformat()
+    })
+
+
 def success_response( Dict, status_code: int = 200) -> Dict:
     """Format successful API response"""
     return {
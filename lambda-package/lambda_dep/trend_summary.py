@@ -0,0 +1,88 @@
+"""
+Trend Summaries
+Vectorized per-item statistics over a patient's full numeric lab / vital series,
+so the prompt covers the whole history at a fixed cost of one line per item
+"""
+
+from typing import Dict, List, Optional
+
+try:
+    import numpy as np
+except ImportError:  # Optional: trend sections are left empty without NumPy
+    np = None
+
+# Row layout summarize_series expects, sorted by (itemid, charttime)
+SERIES_COLUMNS = ('itemid', 'label', 'unit', 'charttime', 'valuenum', 'low', 'high')
+
+
+def available() -> bool:
+    return np is not None
+
+
+def summarize_series(rows: List[tuple], limit: Optional[int] = None) -> List[Dict]:
+    """
+    One summary per itemid: count, min/max/mean/last value, least-squares slope
+    per day, number of values outside the item's normal range and first/last
+    timestamps. Items with the most out-of-range values come first.
+    """
+    if np is None or not rows:
+        return []
+
+    itemids, labels, units, times, values, lows, highs = zip(*rows)
+    itemid = np.array(itemids, dtype=np.int64)
+    days = np.array(times, dtype='datetime64[s]').astype(np.int64) / 86400.0
+    value = np.array(values, dtype=float)
+    low = np.array(lows, dtype=float)  # None -> nan, which never compares out of range
+    high = np.array(highs, dtype=float)
+
+    # Segment boundaries: rows are grouped by itemid
+    starts = np.flatnonzero(np.r_[True, itemid[1:] != itemid[:-1]])
+    ends = np.r_[starts[1:], len(itemid)]
+    counts = ends - starts
+
+    mean = np.add.reduceat(value, starts) / counts
+    minimum = np.minimum.reduceat(value, starts)
+    maximum = np.maximum.reduceat(value, starts)
+    out_of_range = np.add.reduceat(((value < low) | (value > high)).astype(np.int64), starts)
+
+    # slope = sum(dt * dv) / sum(dt^2) around each item's mean time and value
+    dt = days - np.repeat(np.add.reduceat(days, starts) / counts, counts)
+    dv = value - np.repeat(mean, counts)
+    sxx = np.add.reduceat(dt * dt, starts)
+    sxy = np.add.reduceat(dt * dv, starts)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        slope = np.where(sxx > 0, sxy / sxx, np.nan)
+
+    order = np.lexsort((-counts, -out_of_range))[:limit]
+    summaries = []
+    for i in order:
+        first, last = starts[i], ends[i] - 1
+        summaries.append({
+            'itemid': int(itemid[first]),
+            'label': labels[first],
+            'unit': units[first],
+            'count': int(counts[i]),
+            'min': float(minimum[i]),
+            'max': float(maximum[i]),
+            'mean': float(mean[i]),
+            'last': float(value[last]),
+            'slope_per_day': None if np.isnan(slope[i]) else float(slope[i]),
+            'out_of_range': int(out_of_range[i]),
+            'first_time': times[first],
+            'last_time': times[last],
+        })
+    return summaries
+
+
+def format_summary(summary: Dict) -> str:
+    """One context line for a summarize_series item"""
+    unit = f" {summary['unit']}" if summary['unit'] else ""
+    line = (f"{summary['label'] or summary['itemid']}: n={summary['count']}, last {summary['last']:g}{unit}"
+            f" | min {summary['min']:g}, max {summary['max']:g}, mean {summary['mean']:.4g}")
+    if summary['slope_per_day'] is not None:
+        line += f" | slope {summary['slope_per_day']:+.3g}/day"
+    if summary['out_of_range']:
+        line += f" | {summary['out_of_range']} out of range"
+    first = summary['first_time'].strftime('%Y-%m-%d %H:%M')
+    last = summary['last_time'].strftime('%Y-%m-%d %H:%M')
+    return line + f" ({first} to {last})"
@@ -0,0 +1,100 @@
+"""
+Precompute Patient Contexts
+Builds the context of every subject ahead of time into patient_context_cache,
+so HealthcareAssistant can answer the first question with a single-row lookup.
+
+    python precompute_contexts.py                 # subjects in demo_subject_id.csv
+    python precompute_contexts.py --all --workers 8
+"""
+
+import argparse
+import multiprocessing
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import List
+
+from healthcare_assistant import PatientDataRetriever
+from benchmark_indexes import DEMO_SUBJECTS_CSV, load_subject_ids
+
+
+def chunked(items: List[int], size: int) -> List[List[int]]:
+    return [items[i:i + size] for i in range(0, len(items), size)]
+
+
+def build_chunk(subject_ids: List[int], data_version: str) -> int:
+    """Worker: build and store the contexts of one chunk of subjects, one query per section"""
+    retriever = PatientDataRetriever()
+    try:
+        start = time.perf_counter()
+        cohort = retriever.fetch_cohort_sections(subject_ids)
+        blocks = {subject_id: retriever.render_section_blocks(data) for subject_id, data in cohort.items()}
+        # The chunk is fetched as a whole, so record each subject's share of it
+        build_ms = int((time.perf_counter() - start) * 1000 / max(len(blocks), 1))
+        entries = [(subject_id, subject_blocks, build_ms) for subject_id, subject_blocks in blocks.items()]
+        retriever.store_cached_contexts(entries, data_version)
+        return len(entries)
+    finally:
+        retriever.close()
+
+
+def select_subjects(retriever: PatientDataRetriever, args) -> List[int]:
+    if args.subject_ids:
+        subject_ids = args.subject_ids
+    elif args.all:
+        retriever.cursor.execute("SELECT subject_id FROM patients ORDER BY subject_id")
+        subject_ids = [row['subject_id'] for row in retriever.cursor.fetchall()]
+    else:
+        subject_ids = load_subject_ids(count=None)
+
+    if args.stale_only:
+        retriever.cursor.execute(
+            "SELECT subject_id FROM patient_context_cache WHERE data_version = %s",
+            (retriever.get_data_version(),)
+        )
+        current = {row['subject_id'] for row in retriever.cursor.fetchall()}
+        subject_ids = [s for s in subject_ids if s not in current]
+
+    retriever.conn.rollback()
+    return subject_ids
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Precompute patient contexts into patient_context_cache")
+    parser.add_argument('--all', action='store_true', help="Every subject in the patients table")
+    parser.add_argument('--subject-id', type=int, action='append', dest='subject_ids')
+    parser.add_argument('--workers', type=int, default=multiprocessing.cpu_count(), help="Worker processes")
+    parser.add_argument('--chunk-size', type=int, default=500, help="Subjects per worker task (one cohort query per section)")
+    parser.add_argument('--stale-only', action='store_true', help="Skip subjects already built from the current data")
+    args = parser.parse_args()
+
+    retriever = PatientDataRetriever()
+    try:
+        data_version = retriever.get_data_version()
+        subject_ids = select_subjects(retriever, args)
+    finally:
+        retriever.close()
+
+    source = 'patients table' if args.all else (DEMO_SUBJECTS_CSV.name if not args.subject_ids else 'command line')
+    print("\n" + "="*80)
+    print(" PRECOMPUTING PATIENT CONTEXTS")
+    print("="*80)
+    print(f"Subjects: {len(subject_ids)} ({source})")
+    print(f"Data version: {data_version}")
+    print(f"Workers: {args.workers}, chunk size: {args.chunk_size}")
+    print("="*80 + "\n")
+
+    start = time.perf_counter()
+    built = 0
+    # spawn: each worker opens its own connection pool instead of inheriting sockets
+    with ProcessPoolExecutor(max_workers=args.workers, mp_context=multiprocessing.get_context('spawn')) as executor:
+        futures = [executor.submit(build_chunk, chunk, data_version) for chunk in chunked(subject_ids, args.chunk_size)]
+        for future in as_completed(futures):
+            built += future.result()
+            print(f"   {built}/{len(subject_ids)} contexts stored")
+
+    elapsed = time.perf_counter() - start
+    print(f"\n Done: {built} contexts in {elapsed:.1f}s ({built / max(elapsed, 1e-9):.1f}/s)\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,64 @@
+"""
+Knowledge Base Search
+Queries the local BM25 index of the knowledge base documents (kb_index.py) and,
+with --bedrock, the Bedrock knowledge base for the same question, to compare
+passages and latency of the two retrieval paths
+
+    python search_kb.py "What is the HIPAA minimum necessary standard?"
+    python search_kb.py "How are readmission rates measured?" -k 3 --bedrock
+"""
+
+import argparse
+import time
+
+import kb_index
+from healthcare_assistant import Config, get_bedrock_client
+
+
+def print_passages(title: str, passages: list, elapsed_ms: float):
+    print("\n" + "="*80)
+    print(f" {title} ({len(passages)} passages, {elapsed_ms:.2f}ms)")
+    print("="*80)
+    for i, passage in enumerate(passages, 1):
+        source = passage['location']['s3Location']['uri'].split('/')[-1]
+        heading = passage.get('metadata', {}).get('heading', '')
+        print(f"[{i}] {source}  score={passage.get('score')}")
+        if heading:
+            print(f"    {heading}")
+        print(f"    {' '.join(passage['content']['text'].split())[:200]}...")
+    print("="*80)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Search the knowledge base documents")
+    parser.add_argument('query')
+    parser.add_argument('-k', type=int, default=Config.KB_NUMBER_OF_RESULTS, help="Passages to return")
+    parser.add_argument('--docs', default=Config.LOCAL_KB_DIR, help="Directory of the markdown documents")
+    parser.add_argument('--rebuild', action='store_true', help="Ignore the saved index and rebuild it")
+    parser.add_argument('--bedrock', action='store_true', help="Also query the Bedrock knowledge base")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    index = kb_index.load_index(args.docs, None if args.rebuild else Config.LOCAL_KB_INDEX_PATH or None,
+                                Config.LOCAL_KB_URI_PREFIX)
+    load_ms = (time.perf_counter() - start) * 1000
+    print(f" Loaded {len(index.chunks)} chunks, {len(index.postings)} terms in {load_ms:.1f}ms")
+
+    start = time.perf_counter()
+    passages = index.search(args.query, args.k)
+    print_passages("LOCAL BM25", passages, (time.perf_counter() - start) * 1000)
+
+    if args.bedrock:
+        start = time.perf_counter()
+        response = get_bedrock_client('bedrock-agent-runtime').retrieve(
+            knowledgeBaseId=Config.KNOWLEDGE_BASE_ID,
+            retrievalQuery={'text': args.query},
+            retrievalConfiguration={'vectorSearchConfiguration': {'numberOfResults': args.k}}
+        )
+        print_passages("BEDROCK KNOWLEDGE BASE", response.get('retrievalResults', []),
+                       (time.perf_counter() - start) * 1000)
+    print()
+
+
+if __name__ == "__main__":
+    main()
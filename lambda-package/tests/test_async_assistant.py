@@ -0,0 +1,154 @@
+"""AsyncHealthcareAssistant: query, response cache hits and deferred audit writes"""
+
+import asyncio
+import threading
+from types import SimpleNamespace
+
+import pytest
+
+import async_assistant
+import healthcare_assistant
+from async_assistant import AsyncHealthcareAssistant, _DeferredAuditAssistant
+from healthcare_assistant import Config, HealthcareAssistant
+
+PASSAGE = {
+    'content': {'text': "Sepsis is a life-threatening organ dysfunction."},
+    'location': {'type': 'S3', 's3Location': {'uri': 's3://knowledge-base/sepsis.md'}},
+}
+
+
+class FakeRetriever:
+    """Stands in for the PatientDataRetriever each context build or audit write borrows"""
+
+    opened = []
+
+    def __init__(self, stats=None):
+        self.stats = stats
+        self.closed = False
+        FakeRetriever.opened.append(self)
+
+    def close(self):
+        self.closed = True
+
+
+@pytest.fixture
+def assistant(monkeypatch):
+    monkeypatch.setattr(Config, 'RESPONSE_CACHE', True)
+    monkeypatch.setattr(healthcare_assistant, '_response_cache', None)
+    monkeypatch.setattr(async_assistant, 'PatientDataRetriever', FakeRetriever)
+    monkeypatch.setattr(async_assistant, 'asyncpg', None)
+    FakeRetriever.opened = []
+
+    a = _DeferredAuditAssistant.__new__(_DeferredAuditAssistant)
+    a.pending_audit = []
+    a.subject_id = 1
+    a.session_id = None
+    a.deadline = None
+    a.patient_retriever = SimpleNamespace(stats=None)
+    a.conversation_history = []
+    a.context_sections = []
+    a.context_source = 'live'
+    a.context_packing = None
+    a.section_timeouts = []
+    a.context_fingerprint = ''
+    a.generated = []
+    a.written = []
+    a._route = lambda question: 'patient' in question
+    a._retrieve_passages = lambda question: [PASSAGE]
+
+    def build_prompt(question, preamble=""):
+        a.context_fingerprint = 'patient-context'
+        return f"{preamble}PATIENT\n{question}"
+    a._build_full_context_prompt = build_prompt
+
+    def generate(prompt):
+        # Nothing is written while the model generates
+        assert a.written == []
+        a.generated.append((prompt, threading.current_thread().name))
+        return f"answer {len(a.generated)}"
+    a._generate = generate
+
+    def insert(self, question, answer, citations, response_time_ms, success, error_message, cache_hit=False):
+        self.written.append({'question': question, 'success': success, 'cache_hit': cache_hit,
+                             'retriever': self.patient_retriever,
+                             'thread': threading.current_thread().name})
+    monkeypatch.setattr(HealthcareAssistant, '_insert_query_records', insert)
+    return AsyncHealthcareAssistant(a)
+
+
+def test_query_answers_off_the_event_loop_and_writes_the_audit_afterwards(assistant):
+    a = assistant.assistant
+
+    result = asyncio.run(assistant.query("What did the patient receive?"))
+
+    assert (result['success'], result['answer'], result['query_type']) == (True, "answer 1", 'direct')
+    assert a.generated[0][1].startswith('async-bedrock')
+    assert [(r['question'], r['success']) for r in a.written] == [("What did the patient receive?", True)]
+    assert a.written[0]['thread'].startswith('async-db')
+    assert a.pending_audit == []
+    # The context build and the audit write each borrowed a retriever and gave it back
+    assert len(FakeRetriever.opened) == 2
+    assert a.written[0]['retriever'] is FakeRetriever.opened[1]
+    assert all(retriever.closed for retriever in FakeRetriever.opened)
+
+
+def test_kb_query_cites_its_passages(assistant):
+    result = asyncio.run(assistant.query("What is sepsis?"))
+
+    assert result['query_type'] == 'kb'
+    assert result['citations'] == [{'retrievedReferences': [PASSAGE]}]
+    assert "[1] sepsis.md" in assistant.assistant.generated[0][0]
+
+
+def test_repeated_question_is_answered_from_the_response_cache(assistant):
+    a = assistant.assistant
+
+    async def ask_twice():
+        first = await assistant.query("What is sepsis?")
+        a.conversation_history.clear()  # same conversation state as the first question
+        return first, await assistant.query("what is sepsis")
+
+    first, second = asyncio.run(ask_twice())
+
+    assert len(a.generated) == 1
+    assert (second['answer'], second['cache_hit']) == (first['answer'], True)
+    assert second['citations'] == first['citations']
+    assert [r['cache_hit'] for r in a.written] == [False, True]
+
+
+def test_failed_query_is_recorded(assistant):
+    a = assistant.assistant
+
+    def fail(prompt):
+        raise RuntimeError("model unavailable")
+    a._generate = fail
+
+    result = asyncio.run(assistant.query("What did the patient receive?"))
+
+    assert result['success'] is False
+    assert result['error'] == "Error: model unavailable"
+    assert [r['success'] for r in a.written] == [False]
+
+
+def test_close_writes_records_still_queued(assistant):
+    a = assistant.assistant
+    a.pending_audit.append({'question': "q", 'answer': "a", 'citations': [], 'response_time_ms': 5,
+                            'success': True, 'error_message': None})
+
+    asyncio.run(assistant.close())
+
+    assert [r['question'] for r in a.written] == ["q"]
+    assert a.pending_audit == []
+
+
+def test_limits_follow_the_bedrock_limiter_and_db_pool(monkeypatch):
+    monkeypatch.setattr(Config, 'BEDROCK_CONCURRENCY_MAX', 40)
+    monkeypatch.setattr(Config, 'ASYNC_BEDROCK_WORKERS', 80)
+    monkeypatch.setattr(Config, 'ASYNC_DB_WORKERS', 32)
+    monkeypatch.setattr(Config, 'DB_POOL_MAX', 12)
+
+    assert async_assistant.concurrency_limits() == {
+        'bedrock_calls_per_model': 40,
+        'bedrock_threads': 80,
+        'context_builds': 12,
+    }
@@ -0,0 +1,135 @@
+"""call_bedrock: hedging and the per-model AIMD limiter"""
+
+import threading
+import time
+
+import pytest
+
+import healthcare_assistant
+from healthcare_assistant import (AIMDLimiter, BedrockDeadlineExceeded, EndpointConnectionError, ReadTimeoutError,
+                                  call_bedrock, with_first_event)
+
+
+class FakeEventStream:
+    def __init__(self, events):
+        self.events = events
+        self.closed = False
+
+    def __iter__(self):
+        return iter(self.events)
+
+    def close(self):
+        self.closed = True
+
+
+def test_prefetched_stream_keeps_events_and_closes_the_stream():
+    stream = FakeEventStream([{'chunk': 1}, {'chunk': 2}])
+    response = with_first_event(lambda **kwargs: {'body': stream})()
+
+    assert list(response['body']) == [{'chunk': 1}, {'chunk': 2}]
+    response['body'].close()
+    assert stream.closed
+
+
+def test_losing_hedged_stream_is_closed(monkeypatch):
+    monkeypatch.setattr(healthcare_assistant.Config, 'BEDROCK_HEDGE_BUDGET', 1.0)
+    monkeypatch.setattr(healthcare_assistant.Config, 'BEDROCK_HEDGE_MIN_SAMPLES', 1)
+    monkeypatch.setattr(healthcare_assistant.Config, 'BEDROCK_HEDGE_MIN_DELAY_MS', 10)
+    limiter = AIMDLimiter(4, 4)
+    limiter.record_latency(10)
+    monkeypatch.setattr(healthcare_assistant, '_bedrock_limiters', {'model': limiter})
+
+    streams, release_primary = [], threading.Event()
+
+    def invoke(**kwargs):
+        stream = FakeEventStream([{'chunk': len(streams)}])
+        streams.append(stream)
+        if len(streams) == 1:
+            release_primary.wait(5)  # the primary stalls until the hedge has won
+        return {'body': stream}
+
+    response = call_bedrock(with_first_event(invoke), 'model', hedge=True)
+    release_primary.set()
+
+    assert list(response['body']) == [{'chunk': 1}]
+    deadline = time.monotonic() + 5
+    while not streams[0].closed and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert streams[0].closed and not streams[1].closed
+    assert limiter.stats()['hedges'] == 1 and limiter.stats()['hedge_wins'] == 1
+
+
+def test_limiter_halves_on_throttle_and_grows_by_one_per_limit_of_successes():
+    limiter = AIMDLimiter(8, 16)
+
+    limiter.acquire('model')
+    limiter.release('ThrottlingException')
+    assert limiter.limit == 4
+    limiter.acquire('model')
+    limiter.release('ServiceUnavailableException')  # other errors leave the limit alone
+    assert limiter.limit == 4
+
+    for _ in range(4):
+        limiter.acquire('model')
+        limiter.release()
+    assert 4.9 < limiter.limit < 5
+    stats = limiter.stats()
+    assert (stats['calls'], stats['throttles'], stats['errors'], stats['in_flight']) == (6, 1, 1, 0)
+
+
+def test_limiter_stays_within_its_bounds():
+    limiter = AIMDLimiter(1, 2)
+    limiter.acquire('model')
+    limiter.release('TooManyRequestsException')
+    assert limiter.limit == 1
+
+    for _ in range(20):
+        limiter.acquire('model')
+        limiter.release()
+    assert limiter.limit == 2
+
+
+def test_limiter_gives_up_waiting_at_the_deadline():
+    limiter = AIMDLimiter(1, 1)
+    limiter.acquire('model')
+
+    with pytest.raises(BedrockDeadlineExceeded):
+        limiter.acquire('model', deadline=time.monotonic() + 0.05)
+    assert limiter.stats()['deadline_exceeded'] == 1
+    limiter.release()
+    limiter.acquire('model', deadline=time.monotonic() + 0.05)
+    assert limiter.stats()['in_flight'] == 1
+
+
+def test_connection_and_timeout_errors_are_retried(monkeypatch):
+    monkeypatch.setattr(healthcare_assistant.Config, 'BEDROCK_RETRY_BASE_MS', 1)
+    monkeypatch.setattr(healthcare_assistant.Config, 'BEDROCK_RETRY_MAX_MS', 2)
+    limiter = AIMDLimiter(4, 4)
+    monkeypatch.setattr(healthcare_assistant, '_bedrock_limiters', {'model': limiter})
+    errors = [EndpointConnectionError(endpoint_url='https://bedrock-runtime'),
+              ReadTimeoutError(endpoint_url='https://bedrock-runtime')]
+
+    def invoke(**kwargs):
+        if errors:
+            raise errors.pop(0)
+        return {'body': 'answer'}
+
+    assert call_bedrock(invoke, 'model') == {'body': 'answer'}
+    stats = limiter.stats()
+    assert (stats['calls'], stats['retries'], stats['errors'], stats['throttles']) == (3, 2, 2, 0)
+
+
+def test_network_errors_stop_at_the_last_attempt(monkeypatch):
+    monkeypatch.setattr(healthcare_assistant.Config, 'BEDROCK_MAX_ATTEMPTS', 2)
+    monkeypatch.setattr(healthcare_assistant.Config, 'BEDROCK_RETRY_BASE_MS', 1)
+    monkeypatch.setattr(healthcare_assistant.Config, 'BEDROCK_RETRY_MAX_MS', 2)
+    monkeypatch.setattr(healthcare_assistant, '_bedrock_limiters', {'model': AIMDLimiter(4, 4)})
+    calls = []
+
+    def invoke(**kwargs):
+        calls.append(kwargs)
+        raise EndpointConnectionError(endpoint_url='https://bedrock-runtime')
+
+    with pytest.raises(EndpointConnectionError):
+        call_bedrock(invoke, 'model', modelId='model')
+    assert len(calls) == 2
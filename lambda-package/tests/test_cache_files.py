@@ -0,0 +1,67 @@
+"""Private on-disk caches: pickles are only read from files nobody else can write"""
+
+import os
+
+from clinical_dictionaries import load_dictionaries
+
+ROWS = {
+    'dictionary_fingerprint': [('1:0:0:0',)],
+    'dictionary_lab_items': [(50912, 'Creatinine', 'Blood', 'Chemistry')],
+    'dictionary_items': [],
+    'dictionary_icd_diagnoses': [],
+    'dictionary_icd_procedures': [],
+}
+
+
+def counting_fetch(calls):
+    def fetch(name):
+        calls.append(name)
+        return ROWS[name]
+    return fetch
+
+
+def test_dictionary_cache_is_private_and_reused(tmp_path):
+    cache_path = str(tmp_path / 'cache' / 'dictionaries.pickle')
+    load_dictionaries(counting_fetch([]), cache_path)
+
+    assert os.stat(os.path.dirname(cache_path)).st_mode & 0o777 == 0o700
+    assert os.stat(cache_path).st_mode & 0o777 == 0o600
+    calls = []
+    assert load_dictionaries(counting_fetch(calls), cache_path).lab_items[50912][0] == 'Creatinine'
+    assert calls == ['dictionary_fingerprint']
+
+
+def test_writable_cache_file_is_not_unpickled(tmp_path):
+    cache_path = str(tmp_path / 'cache' / 'dictionaries.pickle')
+    load_dictionaries(counting_fetch([]), cache_path)
+    os.chmod(cache_path, 0o666)
+
+    calls = []
+    load_dictionaries(counting_fetch(calls), cache_path)
+    assert 'dictionary_lab_items' in calls  # rebuilt, not loaded
+
+
+def test_cache_in_shared_directory_is_not_written_or_read(tmp_path):
+    shared = tmp_path / 'shared'
+    shared.mkdir()
+    os.chmod(shared, 0o777)
+    cache_path = str(shared / 'dictionaries.pickle')
+
+    load_dictionaries(counting_fetch([]), cache_path)
+    assert not os.path.exists(cache_path)
+
+
+def test_planted_kb_index_is_ignored(tmp_path):
+    import kb_index
+
+    docs = tmp_path / 'docs'
+    docs.mkdir()
+    (docs / 'sepsis.md').write_text("# Sepsis\n\nSepsis is a life-threatening response to infection.\n")
+    cache_path = str(tmp_path / 'cache' / 'kb.pickle')
+    kb_index.load_index(str(docs), cache_path)
+    assert kb_index.load_index(str(docs), cache_path).search("sepsis infection", 1)
+
+    os.chmod(cache_path, 0o646)
+    index = kb_index.load_index(str(docs), cache_path)  # rebuilt and rewritten privately
+    assert index.search("sepsis infection", 1)
+    assert os.stat(cache_path).st_mode & 0o777 == 0o600
@@ -0,0 +1,76 @@
+"""Cohort context builds: one query per section for a chunk of subjects, rows split per subject"""
+
+from types import SimpleNamespace
+
+import pytest
+
+import healthcare_assistant
+from healthcare_assistant import PatientDataRetriever
+
+
+class FakeDictionaries:
+    def diagnosis_title(self, icd_code, icd_version):
+        return f"title of {icd_code}"
+
+
+def row(subject_id, **columns):
+    return SimpleNamespace(subject_id=subject_id, **columns)
+
+
+@pytest.fixture
+def retriever(monkeypatch):
+    monkeypatch.setattr(healthcare_assistant, '_dictionaries', FakeDictionaries())
+    retriever = PatientDataRetriever.__new__(PatientDataRetriever)
+    retriever.queries = []
+    retriever.rows = {
+        'cohort_get_patient_profile': [row(1, gender='F'), row(3, gender='M')],
+        'cohort_get_recent_admissions': [row(1, hadm_id=10), row(1, hadm_id=11), row(3, hadm_id=30)],
+        'cohort_get_diagnoses': [row(3, icd_code='I10', icd_version=10)],
+    }
+
+    def fetch_rows(method, name, params, tuples=False, extra_columns=()):
+        retriever.queries.append((name, params))
+        return retriever.rows.get(name, [])
+    retriever._fetch_rows = fetch_rows
+    return retriever
+
+
+def test_each_section_is_one_query_for_the_whole_cohort(retriever):
+    cohort = retriever.fetch_cohort_sections([3, 1, 2, 3], sections=['profile', 'admissions', 'diagnoses'])
+
+    assert [name for name, _ in retriever.queries] == [
+        'cohort_get_patient_profile', 'cohort_get_recent_admissions', 'cohort_get_diagnoses'
+    ]
+    assert all(params[0] == [1, 2, 3] for _, params in retriever.queries)
+    assert retriever.queries[1][1] == ([1, 2, 3], 3)  # the per-subject limit of the admissions section
+
+    assert list(cohort) == [1, 2, 3]
+    assert cohort[1]['profile'].gender == 'F'
+    assert [r.hadm_id for r in cohort[1]['admissions']] == [10, 11]
+    assert [r.hadm_id for r in cohort[3]['admissions']] == [30]
+    assert cohort[3]['diagnoses'][0].long_title == "title of I10"
+    # Subjects without rows still get every section
+    assert cohort[2] == {'profile': None, 'admissions': [], 'diagnoses': []}
+    assert cohort[1]['diagnoses'] == []
+
+
+def test_only_the_requested_sections_are_queried(retriever):
+    cohort = retriever.fetch_cohort_sections([1, 3], sections=['admissions'])
+
+    assert [name for name, _ in retriever.queries] == ['cohort_get_recent_admissions']
+    assert list(cohort[1]) == ['admissions']
+
+
+def test_contexts_are_built_in_chunks_of_sorted_unique_subjects(retriever):
+    chunks = []
+
+    def fetch(subject_ids, sections=None):
+        chunks.append(subject_ids)
+        return {subject_id: {'profile': subject_id} for subject_id in subject_ids}
+    retriever.fetch_cohort_sections = fetch
+    retriever.render_patient_context = lambda subject_id, data: f"context of {data['profile']}"
+
+    contexts = retriever.build_patient_contexts([5, 3, 1, 3, 4, 2], chunk_size=2)
+
+    assert chunks == [[1, 2], [3, 4], [5]]
+    assert contexts == {subject_id: f"context of {subject_id}" for subject_id in [1, 2, 3, 4, 5]}
@@ -0,0 +1,62 @@
+"""Precomputed patient contexts and the clinical data version"""
+
+import pytest
+
+import healthcare_assistant
+from healthcare_assistant import CONTEXT_FORMAT_VERSION, RETRIEVER_QUERIES, PatientDataRetriever, pg_errors
+
+
+class FakeCursor:
+    def __init__(self, row):
+        self.row = row
+
+    def fetchone(self):
+        return self.row
+
+
+class FakeConn:
+    closed = False
+
+    def __init__(self):
+        self.rollbacks = 0
+
+    def rollback(self):
+        self.rollbacks += 1
+
+
+@pytest.fixture
+def retriever(monkeypatch):
+    monkeypatch.setattr(healthcare_assistant.Config, 'CONTEXT_CACHE', True)
+    monkeypatch.setattr(healthcare_assistant, '_context_cache_available', True)
+    retriever = PatientDataRetriever.__new__(PatientDataRetriever)
+    retriever._replica = ('replica', FakeConn())
+    retriever.reads = []
+    retriever.rows = [{'sections': {'profile': "PROFILE:\n"}}]
+
+    def execute_read(name, params, tuples=False, timeout_ms=None):
+        retriever.reads.append((name, params))
+        row = retriever.rows.pop(0)
+        if isinstance(row, Exception):
+            raise row
+        return FakeCursor(row)
+
+    retriever.execute_read = execute_read
+    return retriever
+
+
+def test_every_cache_read_checks_the_current_data_version(retriever):
+    retriever.rows.append(None)  # a write bumped the version in between
+
+    assert retriever.get_cached_context(1) == {'profile': "PROFILE:\n"}
+    assert retriever.get_cached_context(1) is None
+    assert retriever.reads == [('get_cached_context', (str(CONTEXT_FORMAT_VERSION), 1))] * 2
+    assert "JOIN clinical_data_version" in RETRIEVER_QUERIES['get_cached_context']
+
+
+def test_missing_tables_turn_the_context_cache_off(retriever):
+    retriever.rows = [pg_errors.UndefinedTable('relation "clinical_data_version" does not exist')]
+
+    assert retriever.get_cached_context(1) is None
+    assert retriever.get_cached_context(1) is None
+    assert len(retriever.reads) == 1
+    assert retriever.read_conn.rollbacks == 1
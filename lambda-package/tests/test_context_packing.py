@@ -0,0 +1,207 @@
+"""Section selection, packing and time budgets of the patient context"""
+
+import time
+
+import pytest
+
+import healthcare_assistant
+from healthcare_assistant import (ContextPacker, HealthcareAssistant, PatientDataRetriever, SectionTimeout,
+                                  estimate_tokens, pg_errors)
+
+
+class FakeRetriever:
+    """Section fetches without a database: each section renders to one dated item"""
+
+    stats = None
+
+    def __init__(self, timeouts=()):
+        self.timeouts = set(timeouts)
+        self.fetched = []
+
+    def get_cached_context(self, subject_id):
+        return None
+
+    def fetch_sections(self, subject_id, sections, scope=None):
+        self.fetched.append(list(sections))
+        return {name: SectionTimeout(name, 1500) if name in self.timeouts else [name] for name in sections}
+
+    def render_section_blocks(self, data):
+        return {
+            name: rows.note() if isinstance(rows, SectionTimeout) else f"{name.upper()}:\n   • 2180-01-01 {name}\n\n"
+            for name, rows in data.items()
+        }
+
+    compose_context = PatientDataRetriever.compose_context
+
+
+class FakeConn:
+    closed = False
+
+    def __init__(self):
+        self.rollbacks = 0
+
+    def rollback(self):
+        self.rollbacks += 1
+
+
+def make_block(title, dates):
+    return f"{title}:\n" + "".join(f"   • {date} {title.lower()} item\n" for date in dates) + "\n"
+
+
+def make_retriever(execute_read):
+    retriever = PatientDataRetriever.__new__(PatientDataRetriever)
+    retriever._replica = ('replica', FakeConn())
+    retriever.stats = None
+    retriever.deadline = None
+    retriever.execute_read = execute_read
+    return retriever
+
+
+def make_assistant(retriever):
+    assistant = HealthcareAssistant.__new__(HealthcareAssistant)
+    assistant.subject_id = 1
+    assistant.scope = None
+    assistant.patient_retriever = retriever
+    assistant.conversation_history = []
+    assistant.context_sections = []
+    assistant.context_source = None
+    assistant.context_packing = None
+    assistant.section_timeouts = []
+    assistant._section_blocks = {}
+    assistant._full_context = None
+    return assistant
+
+
+def test_timed_out_section_is_dropped_under_a_token_budget(monkeypatch):
+    monkeypatch.setattr(healthcare_assistant.Config, 'PROMPT_TOKEN_BUDGET', 6000)
+    retriever = FakeRetriever(timeouts={'vitals'})
+    assistant = make_assistant(retriever)
+    assistant.context_sections = ['profile', 'icu_stays', 'vitals']
+
+    context = assistant._packed_context("What were the vital signs?")
+
+    assert "ICU_STAYS:" in context
+    assert "Recent ICU Vital Signs: omitted" in context
+    assert assistant.section_timeouts == [{'section': 'vitals', 'timeout_ms': 1500}]
+    # The timed-out section is not kept, so the next question fetches it again
+    assistant._packed_context("And the vital signs now?")
+    assert retriever.fetched == [['profile', 'icu_stays', 'vitals'], ['vitals']]
+
+
+def test_packer_ranks_profile_then_question_sections_then_newest():
+    blocks = {
+        'profile': make_block("PROFILE", ["2150-01-01"]),
+        'admissions': make_block("ADMISSIONS", ["2170-01-01"]),
+        'labs': make_block("LABS", ["2180-01-01"]),
+        'medications': make_block("MEDICATIONS", ["2160-01-01"]),
+        'icu_stays': make_block("ICU_STAYS", ["2100-01-01"]),
+        'vitals': make_block("VITALS", ["2190-01-01"]),
+        'orders': "",
+    }
+
+    ranked = ContextPacker(1000).rank(blocks, relevant={'medications'})
+
+    # The ICU stays block moves up to just before its (newer) subsection; empty blocks are skipped
+    assert ranked == ['profile', 'medications', 'icu_stays', 'vitals', 'labs', 'admissions']
+
+
+def test_packer_truncates_the_lowest_ranked_section_then_drops(monkeypatch):
+    monkeypatch.setattr(healthcare_assistant.Config, 'CHARS_PER_TOKEN', 1)
+    blocks = {
+        'profile': make_block("PROFILE", ["2180-01-01"]),
+        'labs': make_block("LABS", [f"2180-0{month}-01" for month in range(6, 0, -1)]),
+        'medications': make_block("MEDICATIONS", ["2170-01-01"]),
+        'icu_stays': make_block("ICU_STAYS", ["2160-01-01"]),
+        'vitals': make_block("VITALS", ["2160-01-01"]),
+    }
+    one_lab = "LABS:\n   • 2180-06-01 labs item\n" + ContextPacker.TRUNCATION_NOTE.format(5) + "\n"
+    budget = estimate_tokens(blocks['profile']) + estimate_tokens(one_lab)
+
+    packed, report = ContextPacker(budget).pack(blocks, relevant={'labs'})
+
+    # The newest lab survives; everything ranked after it no longer fits, and vitals go with their stays
+    assert packed['profile'] == blocks['profile']
+    assert packed['labs'] == one_lab
+    assert report['truncated'] == {'labs': 5}
+    assert report['dropped'] == ['medications', 'icu_stays', 'vitals']
+    assert report['context_tokens'] == budget
+    assert packed['medications'] == packed['icu_stays'] == packed['vitals'] == ""
+
+
+def test_packer_reserves_tokens_for_the_rest_of_the_prompt(monkeypatch):
+    monkeypatch.setattr(healthcare_assistant.Config, 'CHARS_PER_TOKEN', 1)
+    blocks = {'profile': make_block("PROFILE", ["2180-01-01"])}
+    budget = estimate_tokens(blocks['profile'])
+
+    packed, report = ContextPacker(budget).pack(blocks, relevant=set(), reserved_tokens=budget)
+
+    assert packed['profile'] == ""
+    assert report == {'budget_tokens': budget, 'context_tokens': 0, 'truncated': {}, 'dropped': ['profile']}
+
+
+def test_over_budget_block_without_items_is_dropped(monkeypatch):
+    monkeypatch.setattr(healthcare_assistant.Config, 'CHARS_PER_TOKEN', 1)
+    blocks = {
+        'profile': make_block("PROFILE", ["2180-01-01"]),
+        'orders': SectionTimeout('orders', 1500).note(),
+        'labs': make_block("LABS", ["2170-01-01"]),
+    }
+    budget = estimate_tokens(blocks['profile']) + estimate_tokens(blocks['labs'])
+
+    packed, report = ContextPacker(budget).pack(blocks, relevant={'orders'})
+
+    # The note ranks before the labs but does not fit; it must not eat the labs' budget
+    assert packed['orders'] == ""
+    assert packed['labs'] == blocks['labs']
+    assert report['dropped'] == ['orders']
+    assert report['truncated'] == {}
+    assert report['context_tokens'] == budget
+
+
+def test_optional_section_timeout_is_capped_by_the_build_budget(monkeypatch):
+    monkeypatch.setattr(healthcare_assistant.Config, 'SECTION_TIMEOUT_MS', 5000)
+    monkeypatch.setattr(healthcare_assistant.Config, 'OPTIONAL_SECTION_TIMEOUT_MS', 1500)
+    retriever = make_retriever(execute_read=None)
+
+    assert retriever._statement_timeout_ms('get_provider_orders') == 1500
+    retriever.deadline = time.monotonic() + 0.5
+    assert 0 < retriever._statement_timeout_ms('get_provider_orders') <= 500
+    assert retriever._statement_timeout_ms('get_recent_admissions') == 5000
+
+    retriever.deadline = time.monotonic() - 0.001
+    with pytest.raises(SectionTimeout):
+        retriever._statement_timeout_ms('get_provider_orders')
+    assert retriever._statement_timeout_ms('get_recent_admissions') == 5000
+
+
+def test_cancelled_section_query_drops_only_optional_sections(monkeypatch):
+    monkeypatch.setattr(healthcare_assistant.Config, 'SECTION_TIMEOUT_MS', 5000)
+    monkeypatch.setattr(healthcare_assistant.Config, 'OPTIONAL_SECTION_TIMEOUT_MS', 1500)
+    timeouts = []
+
+    def execute_read(name, params, tuples=False, timeout_ms=None):
+        timeouts.append(timeout_ms)
+        raise pg_errors.QueryCanceled("canceling statement due to statement timeout")
+
+    retriever = make_retriever(execute_read)
+
+    result = PatientDataRetriever._call_section(retriever, 'get_provider_orders', 5, 1)
+    assert isinstance(result, SectionTimeout)
+    assert (result.section, result.timeout_ms) == ('orders', 1500)
+    assert result.note().startswith("PROVIDER ORDERS (POE): omitted")
+
+    with pytest.raises(SectionTimeout):
+        PatientDataRetriever._call_section(retriever, 'get_recent_admissions', 3, 1)
+    assert timeouts == [1500, 5000]
+    assert retriever.read_conn.rollbacks == 2
+
+
+def test_cancelled_cohort_query_is_not_a_section_timeout():
+    def execute_read(name, params, tuples=False, timeout_ms=None):
+        raise pg_errors.QueryCanceled("canceling statement due to user request")
+
+    retriever = make_retriever(execute_read)
+
+    with pytest.raises(pg_errors.QueryCanceled):
+        retriever._fetch_rows('cohort_get_provider_orders', 'cohort_get_provider_orders', ([1, 2], 5), tuples=True)
+    assert retriever.read_conn.rollbacks == 1
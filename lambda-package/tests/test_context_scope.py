@@ -0,0 +1,58 @@
+"""ContextScope filters spliced into the section queries"""
+
+from datetime import datetime
+from types import SimpleNamespace
+
+import pytest
+
+import healthcare_assistant
+from healthcare_assistant import RETRIEVER_QUERIES, ContextScope, PatientDataRetriever, _scoped_statement
+
+
+@pytest.fixture(autouse=True)
+def vital_itemids(monkeypatch):
+    monkeypatch.setattr(healthcare_assistant, '_dictionaries', SimpleNamespace(vital_itemids=[220045, 220050]))
+
+
+def make_retriever():
+    return PatientDataRetriever.__new__(PatientDataRetriever)
+
+
+def test_unscoped_and_profile_queries_are_unchanged():
+    assert _scoped_statement('get_recent_labs', None) == ('get_recent_labs', ())
+    assert _scoped_statement('get_recent_labs', ContextScope()) == ('get_recent_labs', ())
+    assert _scoped_statement('get_patient_profile', ContextScope(hadm_id=7)) == ('get_patient_profile', ())
+
+
+def test_time_window_follows_the_subject_predicate():
+    start, end = datetime(2180, 1, 1), datetime(2180, 2, 1)
+
+    name, params = make_retriever().section_statement('get_medications', 1, 10, ContextScope(start=start, end=end))
+
+    assert name == 'get_medications__from_to'
+    assert "WHERE subject_id = %s AND starttime >= %s AND starttime < %s" in RETRIEVER_QUERIES[name]
+    assert params == (1, start, end, 10)
+    assert RETRIEVER_QUERIES[name].count('%s') == len(params)
+
+
+def test_admission_reaches_icu_events_through_its_stays():
+    name, params = make_retriever().section_statement('get_icu_vitals', 1, 15, ContextScope(hadm_id=7))
+
+    sql = RETRIEVER_QUERIES[name]
+    assert name == 'get_icu_vitals__hadm'
+    assert ("WHERE ce.subject_id = %s AND ce.stay_id IN (SELECT stay_id FROM icustays WHERE hadm_id = %s)"
+            in sql)
+    # Scope values come before the vital itemids and the row limit, in placeholder order
+    assert sql.index('hadm_id = %s') < sql.index('ANY(%s)')
+    assert params == (1, 7, [220045, 220050], 15)
+    assert sql.count('%s') == len(params)
+
+
+def test_stay_replaces_the_admission_filter():
+    scope = ContextScope(hadm_id=7, stay_id=5)
+
+    assert [key for key, _, _ in scope.filters('get_icu_stays')] == ['stay']
+    assert [key for key, _, _ in scope.filters('get_recent_labs')] == ['hadm']
+    name, params = make_retriever().section_statement('get_icu_stays', 1, scope=scope)
+    assert name == 'get_icu_stays__stay'
+    assert params == (1, 5)
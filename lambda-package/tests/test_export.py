@@ -0,0 +1,126 @@
+"""Patient export: per-table server-side cursors merged into one time-ordered event stream"""
+
+import io
+import json
+from datetime import datetime
+from decimal import Decimal
+from types import SimpleNamespace
+
+import pytest
+
+import healthcare_assistant
+from healthcare_assistant import Config, EXPORT_QUERIES, PatientDataRetriever
+
+COLUMNS = {
+    'admission': ['event_time', 'hadm_id', 'admission_type'],
+    'diagnosis': ['event_time', 'hadm_id', 'icd_code', 'icd_version'],
+    'lab': ['event_time', 'hadm_id', 'itemid', 'valuenum'],
+}
+ROWS = {
+    'admission': [(datetime(2180, 5, 6, 22), 1, 'EMERGENCY'), (datetime(2180, 6, 26, 18), 2, 'ELECTIVE')],
+    'diagnosis': [(datetime(2180, 5, 7, 17), 1, 'I10', 10)],
+    'lab': [(datetime(2180, 5, 6, 23), 1, 50912, Decimal('1.1')), (datetime(2180, 6, 27, 6), 2, 50912, None)],
+}
+
+
+class FakeDictionaries:
+    def lab_item(self, itemid):
+        return ('Creatinine', 'Blood', 'Chemistry')
+
+    def diagnosis_title(self, icd_code, icd_version):
+        return "Essential (primary) hypertension"
+
+
+class NamedCursor:
+    """Server-side cursor yielding its table's rows one at a time"""
+
+    def __init__(self, conn, name):
+        self.conn = conn
+        self.name = name
+        self.itersize = None
+        self.fetched = 0
+        self.closed = False
+
+    def execute(self, query, params):
+        self.event_type = next(t for t, sql in EXPORT_QUERIES.items() if sql == query)
+        self.params = params
+        self.description = [SimpleNamespace(name=column) for column in COLUMNS[self.event_type]]
+
+    def __iter__(self):
+        for row in ROWS[self.event_type]:
+            self.fetched += 1
+            yield row
+
+    def close(self):
+        self.closed = True
+
+
+class FakeConn:
+    closed = False
+
+    def __init__(self):
+        self.autocommit = True
+        self.cursors = []
+        self.rollbacks = 0
+
+    def cursor(self, name=None, cursor_factory=None):
+        assert not self.autocommit, "named cursors need a transaction"
+        cursor = NamedCursor(self, name)
+        self.cursors.append(cursor)
+        return cursor
+
+    def rollback(self):
+        self.rollbacks += 1
+
+
+@pytest.fixture
+def retriever(monkeypatch):
+    monkeypatch.setattr(healthcare_assistant, '_dictionaries', FakeDictionaries())
+    monkeypatch.setattr(Config, 'EXPORT_ITERSIZE', 100)
+    retriever = PatientDataRetriever.__new__(PatientDataRetriever)
+    retriever._replica = ('replica', FakeConn())
+    return retriever
+
+
+def test_events_of_every_table_are_merged_in_time_order(retriever):
+    events = list(retriever.iter_events(1, ['admission', 'diagnosis', 'lab']))
+
+    assert [(e['type'], e['hadm_id']) for e in events] == [
+        ('admission', 1), ('lab', 1), ('diagnosis', 1), ('admission', 2), ('lab', 2)
+    ]
+    assert events[1]['label'] == 'Creatinine' and events[1]['fluid'] == 'Blood'
+    assert events[2]['long_title'] == "Essential (primary) hypertension"
+    assert 'event_time' not in events[0] and events[0]['time'] == datetime(2180, 5, 6, 22)
+
+
+def test_cursors_share_one_transaction_and_are_closed(retriever):
+    conn = retriever.read_conn
+
+    list(retriever.iter_events(7, ['admission', 'lab']))
+
+    assert [c.name for c in conn.cursors] == ['export_admission', 'export_lab']
+    assert all(c.itersize == 100 and c.params == (7,) and c.closed for c in conn.cursors)
+    assert conn.rollbacks == 1
+    assert conn.autocommit is True
+
+
+def test_rows_are_read_only_as_far_as_the_merge_needs(retriever):
+    conn = retriever.read_conn
+    events = retriever.iter_events(1, ['admission', 'diagnosis', 'lab'])
+
+    assert next(events)['type'] == 'admission'
+    assert [c.fetched for c in conn.cursors] == [1, 1, 1]
+    events.close()
+    assert all(c.closed for c in conn.cursors)
+
+
+def test_export_writes_one_json_line_per_event(retriever):
+    out = io.StringIO()
+
+    count = retriever.export_events(1, out, ['lab'])
+
+    lines = [json.loads(line) for line in out.getvalue().splitlines()]
+    assert count == len(lines) == 2
+    assert lines[0] == {'time': '2180-05-06T23:00:00', 'type': 'lab', 'hadm_id': 1, 'itemid': 50912,
+                        'valuenum': 1.1, 'label': 'Creatinine', 'fluid': 'Blood'}
+    assert lines[1]['valuenum'] is None
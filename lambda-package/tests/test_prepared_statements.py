@@ -0,0 +1,102 @@
+"""Prepared retriever statements and the plain-SQL fallback for transaction-mode poolers"""
+
+from types import SimpleNamespace
+
+import pytest
+from psycopg2 import errors as pg_errors
+
+import healthcare_assistant
+from healthcare_assistant import (Config, HealthcareAssistant, PatientDataRetriever, PreparedStatementFallback,
+                                  RETRIEVER_QUERIES, RetrieverConnection)
+
+
+class PoolerConn(RetrieverConnection):
+    """Connection whose server session can lose its prepared statements between transactions"""
+
+    def rollback(self):
+        self.rollbacks += 1
+
+
+def make_conn():
+    conn = PoolerConn.__new__(PoolerConn)
+    conn.prepared = set()
+    conn.rollbacks = 0
+    return conn
+
+
+class FakeCursor:
+    def __init__(self, conn, fail_on=None, error=None):
+        self.connection = conn
+        self.executed = []
+        self.fail_on = fail_on
+        self.error = error
+
+    def execute(self, sql, params=None):
+        self.executed.append(sql)
+        if self.fail_on and sql.startswith(self.fail_on):
+            self.fail_on = None
+            raise self.error("prepared statement does not exist")
+
+
+@pytest.fixture
+def retriever(monkeypatch):
+    monkeypatch.setattr(Config, 'DB_PREPARED_STATEMENTS', True)
+    monkeypatch.setattr(healthcare_assistant, '_prepared_statements_supported', True)
+    return PatientDataRetriever.__new__(PatientDataRetriever)
+
+
+def test_statement_is_prepared_once_then_executed(retriever):
+    cursor = FakeCursor(make_conn())
+
+    retriever.execute_named('validate_subject_id', (1,), cursor=cursor)
+    retriever.execute_named('validate_subject_id', (2,), cursor=cursor, timeout_ms=500)
+
+    assert cursor.executed[0].startswith("PREPARE hc_validate_subject_id AS ")
+    assert cursor.executed[1:] == [
+        "EXECUTE hc_validate_subject_id (%s)",
+        "SET LOCAL statement_timeout = 500; EXECUTE hc_validate_subject_id (%s)",
+    ]
+
+
+@pytest.mark.parametrize('fail_on, error', [
+    ('EXECUTE', pg_errors.InvalidSqlStatementName),   # the pooler moved us to another server session
+    ('PREPARE', pg_errors.DuplicatePreparedStatement),  # the session already has it from another client
+])
+def test_lost_statement_is_replayed_as_plain_sql_and_preparing_stops(retriever, fail_on, error):
+    conn = make_conn()
+    cursor = FakeCursor(conn, fail_on, error)
+
+    retriever.execute_named('validate_subject_id', (1,), cursor=cursor)
+    retriever.execute_named('validate_subject_id', (2,), cursor=cursor)
+
+    sql = RETRIEVER_QUERIES['validate_subject_id']
+    assert cursor.executed[-2:] == [sql, sql]
+    assert conn.rollbacks == 1
+    assert healthcare_assistant._prepared_statements_supported is False
+
+
+def test_writes_are_not_replayed_mid_transaction(retriever):
+    cursor = FakeCursor(make_conn(), 'EXECUTE', pg_errors.InvalidSqlStatementName)
+
+    with pytest.raises(PreparedStatementFallback):
+        retriever.execute_named('insert_kb_query', (1,) * 11, cursor=cursor, replay=False)
+
+    assert not any(sql == RETRIEVER_QUERIES['insert_kb_query'] for sql in cursor.executed)
+
+
+def test_audit_transaction_is_redone_after_the_fallback():
+    attempts = []
+    assistant = HealthcareAssistant.__new__(HealthcareAssistant)
+    assistant.subject_id = 1
+    assistant.patient_retriever = SimpleNamespace(conn=None)
+
+    def insert(*record):
+        attempts.append(record)
+        if len(attempts) == 1:
+            raise PreparedStatementFallback('hc_insert_kb_query')
+    assistant._insert_query_records = insert
+
+    assistant._save_to_database(question="q", answer="a", citations=[], response_time_ms=5, success=True,
+                                error_message=None)
+
+    assert len(attempts) == 2 and attempts[0] == attempts[1]
@@ -0,0 +1,124 @@
+"""query_many(): one context build for several questions, answered one by one or packed"""
+
+import threading
+from types import SimpleNamespace
+
+import pytest
+
+import healthcare_assistant
+from healthcare_assistant import Config, HealthcareAssistant, pack_questions, split_packed_answers
+
+PASSAGE = {
+    'content': {'text': "Sepsis is a life-threatening organ dysfunction."},
+    'location': {'type': 'S3', 's3Location': {'uri': 's3://knowledge-base/sepsis.md'}},
+}
+QUESTIONS = ["What are my diagnoses?", "What is sepsis?", "What are my medications?"]
+
+
+@pytest.fixture
+def assistant(monkeypatch):
+    monkeypatch.setattr(Config, 'RESPONSE_CACHE', False)
+    monkeypatch.setattr(healthcare_assistant, '_batch_executor', None)
+    a = HealthcareAssistant.__new__(HealthcareAssistant)
+    a.subject_id = 1
+    a.session_id = 'kb-session'
+    a.deadline = None
+    a.patient_retriever = SimpleNamespace(stats=None)
+    a.conversation_history = []
+    a.context_sections = []
+    a.context_source = 'live'
+    a.context_packing = None
+    a.section_timeouts = []
+    a.context_fingerprint = ''
+    a.builds, a.prompts, a.saved = [], [], []
+    a.replies = {}
+    a._is_patient_specific_question = lambda question: 'my ' in question
+    a._sections_for_question = lambda question, direct: ['diagnoses'] if 'diagnoses' in question else ['profile']
+    a._context_for_sections = lambda sections: a.builds.append(sections)
+    a._retrieve_passages = lambda question: [PASSAGE]
+    a._build_full_context_prompt = lambda question, preamble="": f"{preamble}PATIENT\n{question}"
+    a._save_to_database = lambda **record: a.saved.append(record)
+
+    def generate(prompt):
+        a.prompts.append((prompt, threading.current_thread().name))
+        for question, reply in a.replies.items():
+            if prompt.endswith(question):
+                if isinstance(reply, Exception):
+                    raise reply
+                return reply
+        return "packed"
+    a._generate = generate
+    return a
+
+
+def test_each_question_gets_its_own_model_call_after_one_context_build(assistant):
+    assistant.replies = {question: f"answer to {question}" for question in QUESTIONS}
+
+    batch = assistant.query_many(QUESTIONS)
+
+    assert assistant.builds == [['profile', 'diagnoses']]
+    results = batch['results']
+    assert [r['answer'] for r in results] == [f"answer to {question}" for question in QUESTIONS]
+    assert [r['query_type'] for r in results] == ['direct', 'kb', 'direct']
+    assert [r['session_id'] for r in results] == ['direct-query', 'kb-session', 'direct-query']
+    assert results[1]['citations'] == [{'retrievedReferences': [PASSAGE]}]
+    assert [r['context_sections'] for r in results] == [['diagnoses'], ['profile'], ['profile']]
+    assert all(name.startswith('query-batch') for _, name in assistant.prompts)
+    assert batch['timings']['model_calls'] == 3
+    # Recorded in question order, each seeing the conversation from before the batch
+    assert [record['question'] for record in assistant.saved] == QUESTIONS
+    assert [entry['question'] for entry in assistant.conversation_history] == QUESTIONS
+
+
+def test_a_failed_question_does_not_fail_the_batch(assistant):
+    assistant.replies = {QUESTIONS[0]: "fine", QUESTIONS[1]: RuntimeError("model unavailable"), QUESTIONS[2]: "ok"}
+
+    results = assistant.query_many(QUESTIONS)['results']
+
+    assert [r['success'] for r in results] == [True, False, True]
+    assert results[1]['error'] == "Error: model unavailable"
+    assert [record['success'] for record in assistant.saved] == [True, False, True]
+
+
+def test_packed_questions_share_one_model_call(assistant):
+    assistant.replies = {pack_questions(QUESTIONS): "ANSWER [1]: Hypertension.\n"
+                                                    "**ANSWER [2]:** Organ dysfunction [1].\n"
+                                                    "## Answer [3] Aspirin."}
+
+    batch = assistant.query_many(QUESTIONS, pack=True)
+
+    assert len(assistant.prompts) == 1
+    prompt = assistant.prompts[0][0]
+    assert "[1] sepsis.md" in prompt and "[3] What are my medications?" in prompt
+    results = batch['results']
+    assert [r['answer'] for r in results] == ["Hypertension.", "Organ dysfunction [1].", "Aspirin."]
+    assert [r['citations'] for r in results] == [[], [{'retrievedReferences': [PASSAGE]}], []]
+    assert all(r['packed'] for r in results)
+    assert batch['timings']['model_calls'] == 1
+
+
+def test_packed_question_without_an_answer_is_an_error(assistant):
+    assistant.replies = {pack_questions(QUESTIONS): "ANSWER [1]: Hypertension.\nANSWER [3]: Aspirin."}
+
+    results = assistant.query_many(QUESTIONS, pack=True)['results']
+
+    assert [r['success'] for r in results] == [True, False, True]
+    assert results[1]['error'] == "Error: The packed response has no answer to question 2"
+
+
+def test_empty_batch(assistant):
+    batch = assistant.query_many([])
+
+    assert batch['results'] == []
+    assert assistant.builds == [] and assistant.prompts == []
+
+
+def test_split_packed_answers():
+    text = "Preamble.\nANSWER [2]: Second\nspans lines.\nANSWER [1]: First.\nANSWER [2]: Repeated.\nANSWER [7]: Extra."
+
+    assert split_packed_answers(text, 3) == ["First.", "Second\nspans lines.", None]
+
+
+def test_split_packed_answers_without_markers():
+    assert split_packed_answers("Hypertension and sepsis.", 2) == [None, None]
+    assert split_packed_answers("ANSWER [1]:\nANSWER [2]: Sepsis.", 2) == [None, "Sepsis."]
@@ -0,0 +1,135 @@
+"""Read replicas: round-robin routing and ejection of failing or lagging replicas"""
+
+from types import SimpleNamespace
+
+import psycopg2
+import pytest
+
+import healthcare_assistant
+from healthcare_assistant import Config, ReplicaRouter
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self):
+        return self.now
+
+
+class FakeCursor:
+    def __init__(self, conn):
+        self.conn = conn
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+    def execute(self, query):
+        self.conn.lag_checks += 1
+
+    def fetchone(self):
+        return {'lag_seconds': self.conn.pool.lag}
+
+
+class FakeConn:
+    def __init__(self, pool):
+        self.pool = pool
+        self.closed = 0
+        self.autocommit = False
+        self.lag_checks = 0
+
+    def cursor(self):
+        return FakeCursor(self)
+
+
+class FakePool:
+    def __init__(self, lag=0.0, down=False):
+        self.lag = lag
+        self.down = down
+        self.conn = FakeConn(self)
+        self.returned = []
+
+    def getconn(self):
+        if self.down:
+            raise psycopg2.OperationalError("could not connect to server")
+        return self.conn
+
+    def putconn(self, conn, close=False):
+        self.returned.append(close)
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(healthcare_assistant, 'time', SimpleNamespace(monotonic=clock.monotonic))
+    monkeypatch.setattr(Config, 'DB_REPLICA_MAX_LAG_SECONDS', 30)
+    monkeypatch.setattr(Config, 'DB_REPLICA_LAG_CHECK_SECONDS', 10)
+    monkeypatch.setattr(Config, 'DB_REPLICA_EJECT_SECONDS', 60)
+    return clock
+
+
+def make_router(**pools):
+    router = ReplicaRouter(list(pools))
+    router.pools.update(pools)
+    return router
+
+
+def test_replicas_take_turns(clock):
+    router = make_router(a=FakePool(), b=FakePool())
+
+    hosts = [router.acquire()[0] for _ in range(4)]
+
+    assert hosts == ['a', 'b', 'a', 'b']
+    assert router.pools['a'].conn.autocommit is True
+
+
+def test_lagging_replica_is_ejected_and_the_next_one_used(clock):
+    router = make_router(a=FakePool(lag=45), b=FakePool())
+
+    host, conn = router.acquire()
+
+    assert host == 'b' and conn is router.pools['b'].conn
+    assert router.pools['a'].returned == [False]  # healthy connection, only behind
+    assert router.ejected_until['a'] == clock.now + 60
+    assert [router.acquire()[0] for _ in range(2)] == ['b', 'b']
+
+
+def test_ejected_replica_rejoins_once_caught_up(clock):
+    router = make_router(a=FakePool(lag=45), b=FakePool())
+    router.acquire()
+
+    router.pools['a'].lag = 1
+    clock.now += 30
+    assert {router.acquire()[0] for _ in range(2)} == {'b'}
+    clock.now += 31
+    assert sorted(router.acquire()[0] for _ in range(2)) == ['a', 'b']
+
+
+def test_lag_is_checked_at_most_every_check_interval(clock):
+    router = make_router(a=FakePool())
+    conn = router.pools['a'].conn
+
+    for _ in range(3):
+        router.acquire()
+    assert conn.lag_checks == 1
+
+    clock.now += 10
+    router.acquire()
+    assert conn.lag_checks == 2
+
+
+def test_unreachable_replica_is_ejected(clock):
+    router = make_router(a=FakePool(down=True), b=FakePool())
+
+    assert router.acquire()[0] == 'b'
+    assert router.ejected_until['a'] == clock.now + 60
+
+
+def test_reads_go_to_the_primary_when_every_replica_is_out(clock):
+    router = make_router(a=FakePool(lag=45), b=FakePool(down=True))
+
+    assert router.acquire() is None
+    assert set(router.ejected_until) == {'a', 'b'}
@@ -0,0 +1,36 @@
+"""ResponseCache: LRU eviction, TTL expiry and hit-rate counters"""
+
+import healthcare_assistant
+from healthcare_assistant import ResponseCache
+
+
+def test_least_recently_used_entry_is_evicted():
+    cache = ResponseCache(max_entries=2, ttl_seconds=60)
+    cache.put('a', 1)
+    cache.put('b', 2)
+    assert cache.get('a') == 1  # 'b' is now the least recently used
+
+    cache.put('c', 3)
+
+    assert cache.get('b') is None
+    assert (cache.get('a'), cache.get('c')) == (1, 3)
+    assert cache.stats() == {'entries': 2, 'hits': 3, 'misses': 1, 'hit_rate': 0.75,
+                             'evictions': 1, 'expirations': 0}
+
+
+def test_entries_expire_after_the_ttl(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(healthcare_assistant.time, 'monotonic', lambda: now[0])
+    cache = ResponseCache(max_entries=8, ttl_seconds=60)
+    cache.put('a', 1)
+
+    now[0] += 59
+    assert cache.get('a') == 1
+    now[0] += 1
+    assert cache.get('a') is None
+
+    cache.put('a', 2)  # storing again restarts the TTL
+    now[0] += 59
+    assert cache.get('a') == 2
+    assert cache.stats()['expirations'] == 1
+    assert cache.stats()['entries'] == 1
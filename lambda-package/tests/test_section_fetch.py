@@ -0,0 +1,100 @@
+"""Concurrent section fetching on pooled connections"""
+
+import threading
+
+import pytest
+
+import healthcare_assistant
+from healthcare_assistant import PatientDataRetriever, pg_pool
+
+SECTIONS = ['admissions', 'diagnoses', 'procedures']
+
+
+class FakeConn:
+    closed = False
+
+    def __init__(self, name):
+        self.name = name
+        self.rollbacks = 0
+
+    def rollback(self):
+        self.rollbacks += 1
+
+
+class FakePool:
+    """Lends `size` connections, then raises PoolError like an exhausted ThreadedConnectionPool"""
+
+    closed = False
+
+    def __init__(self, size):
+        self.free = [FakeConn(f"pooled-{i}") for i in range(size)]
+        self.returned = []
+        self._lock = threading.Lock()
+
+    def getconn(self):
+        with self._lock:
+            if not self.free:
+                raise pg_pool.PoolError("connection pool exhausted")
+            return self.free.pop()
+
+    def putconn(self, conn, close=False):
+        with self._lock:
+            self.returned.append(conn)
+
+
+@pytest.fixture
+def pool(monkeypatch):
+    monkeypatch.setattr(healthcare_assistant.Config, 'DB_READ_HOSTS', [])
+    monkeypatch.setattr(healthcare_assistant, '_connection_pool', None)
+
+    def section(method):
+        def fetch(self, subject_id, limit=None, scope=None):
+            return [(method, self.read_conn.name, threading.current_thread().name)]
+        return fetch
+
+    for method in ('get_recent_admissions', 'get_diagnoses', 'get_procedures'):
+        monkeypatch.setattr(PatientDataRetriever, method, section(method))
+
+    def install(size):
+        fake = FakePool(size)
+        monkeypatch.setattr(healthcare_assistant, '_connection_pool', fake)
+        return fake
+    return install
+
+
+def test_sections_are_fetched_concurrently_on_pooled_connections(pool):
+    fake = pool(size=3)
+    caller = FakeConn('caller')
+    retriever = PatientDataRetriever(conn=caller)
+
+    data = retriever.fetch_sections(1, SECTIONS, concurrent=True)
+
+    assert list(data) == SECTIONS
+    assert [rows[0][0] for rows in data.values()] == ['get_recent_admissions', 'get_diagnoses', 'get_procedures']
+    assert all(rows[0][1].startswith('pooled-') for rows in data.values())
+    assert all(rows[0][2].startswith('context-fetch') for rows in data.values())
+    assert len({rows[0][1] for rows in data.values()}) == 3
+    assert sorted(conn.name for conn in fake.returned) == ['pooled-0', 'pooled-1', 'pooled-2']
+
+
+def test_exhausted_pool_falls_back_to_the_callers_connection(pool):
+    fake = pool(size=0)
+    caller = FakeConn('caller')
+    retriever = PatientDataRetriever(conn=caller)
+
+    data = retriever.fetch_sections(1, SECTIONS, concurrent=True)
+
+    assert list(data) == SECTIONS
+    assert [rows[0][1] for rows in data.values()] == ['caller', 'caller', 'caller']
+    assert fake.returned == []
+    # The serial fallback's SET LOCAL timeouts end with its transaction
+    assert caller.rollbacks == 1
+
+
+def test_caller_connection_is_left_alone_when_every_section_is_pooled(pool):
+    pool(size=3)
+    caller = FakeConn('caller')
+
+    PatientDataRetriever(conn=caller).fetch_sections(1, SECTIONS, concurrent=True)
+
+    assert caller.rollbacks == 0
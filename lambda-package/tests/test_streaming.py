@@ -0,0 +1,104 @@
+"""HealthcareAssistant.query_stream: one streaming path for direct and KB questions"""
+
+import json
+from types import SimpleNamespace
+
+import pytest
+
+import healthcare_assistant
+from healthcare_assistant import Config, HealthcareAssistant
+
+PASSAGE = {
+    'content': {'text': "Sepsis is a life-threatening organ dysfunction."},
+    'location': {'type': 'S3', 's3Location': {'uri': 's3://knowledge-base/sepsis.md'}},
+}
+
+
+def chunk(payload):
+    return {'chunk': {'bytes': json.dumps(payload).encode()}}
+
+
+class FakeRuntime:
+    def __init__(self, events=(), error=None):
+        self.events = list(events)
+        self.error = error
+        self.requests = []
+
+    def invoke_model_with_response_stream(self, **kwargs):
+        self.requests.append(kwargs)
+        if self.error:
+            raise self.error
+        return {'body': iter(self.events)}
+
+
+@pytest.fixture
+def assistant(monkeypatch):
+    monkeypatch.setattr(Config, 'RESPONSE_CACHE', False)
+    monkeypatch.setattr(Config, 'BEDROCK_HEDGING', False)
+    monkeypatch.setattr(healthcare_assistant, '_bedrock_limiters', {})
+    assistant = HealthcareAssistant.__new__(HealthcareAssistant)
+    assistant.subject_id = 1
+    assistant.deadline = None
+    assistant.session_id = None
+    assistant.patient_retriever = SimpleNamespace(stats=None)
+    assistant.conversation_history = []
+    assistant.context_sections = []
+    assistant.context_source = 'live'
+    assistant.context_packing = None
+    assistant.section_timeouts = []
+    assistant.context_fingerprint = ''
+    assistant.last_result = None
+    assistant.saved = []
+    assistant._save_to_database = lambda **record: assistant.saved.append(record)
+    assistant._sections_for_question = lambda question, direct: ['profile']
+    assistant._build_full_context_prompt = lambda question, preamble="": f"{preamble}PATIENT\n{question}"
+    assistant._retrieve_passages = lambda question: [PASSAGE]
+    return assistant
+
+
+def use_runtime(monkeypatch, runtime):
+    monkeypatch.setattr(healthcare_assistant, 'get_bedrock_client', lambda service: runtime)
+
+
+def test_direct_question_streams_every_chunk_format(assistant, monkeypatch):
+    runtime = FakeRuntime([
+        {'metadata': {}},
+        chunk({'choices': [{'delta': {'reasoning_content': "thinking"}}]}),
+        chunk({'choices': [{'delta': {'content': "Aspirin "}}]}),
+        chunk({'type': 'content_block_delta', 'index': 0, 'delta': {'type': 'text_delta', 'text': "81 mg"}}),
+        chunk({'type': 'message_stop'}),
+    ])
+    use_runtime(monkeypatch, runtime)
+
+    deltas = list(assistant.query_stream("What medications did I get during my stay?"))
+
+    assert deltas == ["Aspirin ", "81 mg"]
+    result = assistant.last_result
+    assert (result['success'], result['answer'], result['query_type']) == (True, "Aspirin 81 mg", 'direct')
+    assert (result['session_id'], result['citations']) == ('direct-query', [])
+    assert result['first_token_ms'] is not None
+    assert "PATIENT" in json.loads(runtime.requests[0]['body'])['messages'][0]['content']
+    assert [record['success'] for record in assistant.saved] == [True]
+
+
+def test_kb_question_streams_with_its_passages_as_citations(assistant, monkeypatch):
+    runtime = FakeRuntime([chunk({'choices': [{'delta': {'content': "Organ dysfunction [1]."}}]})])
+    use_runtime(monkeypatch, runtime)
+
+    deltas = list(assistant.query_stream("What is sepsis?"))
+
+    assert deltas == ["Organ dysfunction [1]."]
+    result = assistant.last_result
+    assert result['query_type'] == 'kb'
+    assert result['citations'] == [{'retrievedReferences': [PASSAGE]}]
+    prompt = json.loads(runtime.requests[0]['body'])['messages'][0]['content']
+    assert "[1] sepsis.md" in prompt and prompt.endswith("What is sepsis?")
+
+
+def test_failed_stream_yields_nothing_and_records_the_error(assistant, monkeypatch):
+    use_runtime(monkeypatch, FakeRuntime(error=RuntimeError("connection reset")))
+
+    assert list(assistant.query_stream("What is sepsis?")) == []
+    assert assistant.last_result['success'] is False
+    assert assistant.last_result['error'] == "Error: connection reset"
+    assert [record['success'] for record in assistant.saved] == [False]
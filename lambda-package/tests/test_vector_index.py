@@ -0,0 +1,68 @@
+"""Saving and reusing the dense KB index"""
+
+import pytest
+
+np = pytest.importorskip('numpy')
+
+import vector_index
+
+DOCUMENT = """# Hypertension
+
+## Treatment
+
+Lifestyle changes and antihypertensive medication lower blood pressure.
+
+## Diagnosis
+
+Repeated blood pressure readings above 130/80 mmHg.
+"""
+
+
+class BoundEmbedder:
+    """A pluggable embedder holding something that cannot be pickled (like a client)"""
+
+    def __init__(self, config):
+        self.config = config
+        self.client = lambda texts: texts
+        self.calls = 0
+        self.inner = vector_index.HashedNgramEmbedder(dim=64)
+
+    def __call__(self, texts):
+        self.calls += 1
+        return self.inner(self.client(texts))
+
+
+@pytest.fixture
+def document_dir(tmp_path):
+    directory = tmp_path / 'docs'
+    directory.mkdir()
+    (directory / 'hypertension.md').write_text(DOCUMENT)
+    return str(directory)
+
+
+def test_unpicklable_embedder_is_not_saved_and_index_is_reused(document_dir, tmp_path):
+    index_dir = str(tmp_path / 'vectors')
+    built = vector_index.load_vector_index(document_dir, index_dir, embedder=BoundEmbedder(('bound', 1)))
+
+    embedder = BoundEmbedder(('bound', 1))
+    loaded = vector_index.load_vector_index(document_dir, index_dir, embedder=embedder)
+
+    assert embedder.calls == 0  # reused, not re-embedded
+    assert loaded.embedder is embedder
+    assert [p['metadata']['heading'] for p in loaded.search("blood pressure medication", 1)] == \
+        [p['metadata']['heading'] for p in built.search("blood pressure medication", 1)]
+
+
+def test_changed_embedder_config_rebuilds(document_dir, tmp_path):
+    index_dir = str(tmp_path / 'vectors')
+    vector_index.load_vector_index(document_dir, index_dir, embedder=BoundEmbedder(('bound', 1)))
+
+    embedder = BoundEmbedder(('bound', 2))
+    vector_index.load_vector_index(document_dir, index_dir, embedder=embedder)
+    assert embedder.calls == 1
+
+
+def test_embedder_without_config_is_rejected(document_dir, tmp_path):
+    with pytest.raises(ValueError, match='config'):
+        vector_index.load_vector_index(document_dir, str(tmp_path / 'vectors'),
+                                       embedder=lambda texts: np.zeros((len(texts), 8), dtype=np.float32))
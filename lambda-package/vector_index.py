@@ -0,0 +1,285 @@
+"""
+Local Dense Vector Index
+Embedding retrieval over the knowledge base chunks (kb_index.load_chunks). The
+vectors are one contiguous float32 matrix, saved as .npy and memory-mapped on
+load, searched exactly with blocked matrix products or, for corpora too large
+to scan, through an IVF (optionally product-quantized) index. Passages come
+back in the same Bedrock retrievalResult shape as kb_index.BM25Index.search
+"""
+
+import logging
+import os
+import pickle
+import zlib
+from functools import lru_cache
+from typing import Callable, Dict, List, Optional, Sequence
+
+try:
+    import numpy as np
+except ImportError:  # Optional: dense retrieval is unavailable without NumPy
+    np = None
+
+import cache_files
+import kb_index
+
+logger = logging.getLogger(__name__)
+
+# Vectors scored per matrix product in exact search (bounds the score matrix)
+BLOCK_ROWS = 65536
+
+# Training sample for the IVF / PQ k-means (per centroid)
+TRAIN_POINTS_PER_CENTROID = 64
+
+# Search modes: 'exact' (scan every vector), 'ivf' (scan nprobe clusters), 'ivfpq' (clusters scored from PQ codes)
+MODES = ('exact', 'ivf', 'ivfpq')
+
+
+def available() -> bool:
+    return np is not None
+
+
+class HashedNgramEmbedder:
+    """
+    Deterministic, offline embedding: signed feature hashing of word tokens and
+    their character n-grams into `dim` buckets, L2-normalized. Any callable
+    taking a list of texts and returning an (n, dim) float32 array can be used
+    instead (e.g. a Bedrock embedding model), given a `config` attribute that
+    identifies the vectors it produces
+    """
+
+    def __init__(self, dim: int = 512, ngram_range: tuple = (3, 5), seed: int = 0):
+        self.dim = dim
+        self.ngram_range = ngram_range
+        self.seed = seed
+
+    @property
+    def config(self) -> tuple:
+        """Identifies vectors this embedder produces (part of the saved index fingerprint)"""
+        return ('hashed-ngram', self.dim, self.ngram_range, self.seed)
+
+    def __call__(self, texts: Sequence[str]) -> 'np.ndarray':
+        vectors = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for row, text in enumerate(texts):
+            features = [self._token_features(token) for token in kb_index.tokenize(text)]
+            if features:
+                buckets, signs = zip(*features)
+                vectors[row] = np.bincount(np.concatenate(buckets), weights=np.concatenate(signs),
+                                           minlength=self.dim)
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        return vectors / np.maximum(norms, 1e-12)
+
+    @lru_cache(maxsize=65536)
+    def _token_features(self, token: str) -> tuple:
+        """Bucket indexes and signed weights of a token: the word itself plus its boundary-marked n-grams"""
+        features = [f"w:{token}"]
+        padded = f"<{token}>"
+        low, high = self.ngram_range
+        for n in range(low, high + 1):
+            features += [padded[i:i + n] for i in range(len(padded) - n + 1)]
+        hashes = [zlib.crc32(f"{self.seed}:{feature}".encode()) for feature in features]
+        buckets = np.array([h % self.dim for h in hashes], dtype=np.int64)
+        signs = np.array([1.0 if h & 0x80000000 else -1.0 for h in hashes], dtype=np.float32)
+        signs[0] *= 2.0  # the whole word counts more than any one of its n-grams
+        return buckets, signs
+
+
+def embedder_config(embedder: Callable):
+    """The embedder's `config` (model, dimensions, ...), which tells a saved index's vectors apart"""
+    config = getattr(embedder, 'config', None)
+    if config is None:
+        raise ValueError(f"Embedder {embedder!r} has no `config` identifying its vectors; "
+                         "set one so saved indexes built with another embedder are not reused")
+    return config
+
+
+def kmeans(x: 'np.ndarray', k: int, iterations: int = 10, seed: int = 0, spherical: bool = False) -> 'np.ndarray':
+    """
+    Lloyd's k-means centroids of the rows of x (spherical: unit-length
+    centroids, cosine assignment), trained on a sample of at most
+    TRAIN_POINTS_PER_CENTROID rows per centroid
+    """
+    rng = np.random.default_rng(seed)
+    k = min(k, len(x))
+    if len(x) > k * TRAIN_POINTS_PER_CENTROID:
+        x = x[np.sort(rng.choice(len(x), k * TRAIN_POINTS_PER_CENTROID, replace=False))]
+    x = np.asarray(x, dtype=np.float32)
+    centroids = x[rng.choice(len(x), k, replace=False)]
+    for _ in range(iterations):
+        assignment = assign(x, centroids, spherical)
+        counts = np.bincount(assignment, minlength=k)
+        # Per-centroid sums of the sorted rows, one reduceat instead of a scatter-add
+        order = np.argsort(assignment, kind='stable')
+        starts = np.searchsorted(assignment[order], np.arange(k))
+        empty = counts == 0
+        sums = np.zeros_like(centroids)
+        sums[~empty] = np.add.reduceat(x[order], starts[~empty], axis=0)
+        centroids = np.where(empty[:, None], x[rng.choice(len(x), k)], sums / np.maximum(counts, 1)[:, None])
+        if spherical:
+            centroids /= np.maximum(np.linalg.norm(centroids, axis=1, keepdims=True), 1e-12)
+    return centroids.astype(np.float32)
+
+
+def assign(x: 'np.ndarray', centroids: 'np.ndarray', spherical: bool = False) -> 'np.ndarray':
+    """Closest centroid of each row: largest inner product, or smallest distance"""
+    if spherical:
+        return np.argmax(x @ centroids.T, axis=1)
+    # argmin |x - c|^2 == argmax 2 x.c - |c|^2
+    return np.argmax(2 * (x @ centroids.T) - (centroids ** 2).sum(axis=1), axis=1)
+
+
+def top_k(scores: 'np.ndarray', k: int) -> 'np.ndarray':
+    """Indexes of the k highest scores, best first"""
+    if len(scores) > k:
+        candidates = np.argpartition(-scores, k - 1)[:k]
+    else:
+        candidates = np.arange(len(scores))
+    return candidates[np.argsort(-scores[candidates], kind='stable')]
+
+
+class VectorIndex:
+    """Inner-product (cosine, vectors are unit length) search over embedded (source, heading, text) chunks"""
+
+    def __init__(self, vectors: 'np.ndarray', chunks: List[tuple], embedder: Callable,
+                 uri_prefix: str = 's3://knowledge-base/', mode: str = 'exact', nprobe: int = 8,
+                 refine: int = 8):
+        self.vectors = vectors  # (n, dim) float32, possibly a read-only memory map
+        self.chunks = chunks
+        self.embedder = embedder
+        self.uri_prefix = uri_prefix
+        self.mode = mode
+        self.nprobe = nprobe
+        self.refine = refine  # 'ivfpq': exact re-rank of the refine * k best PQ candidates
+        # IVF: centroids, and the vector ids of each cluster as one array split at list_offsets
+        self.centroids = None
+        self.list_ids = None
+        self.list_offsets = None
+        # PQ: per-subspace codebooks (m, ksub, dsub) and uint8 codes (n, m)
+        self.codebooks = None
+        self.codes = None
+        self.fingerprint = None  # What the index was built from (load_vector_index)
+
+    @classmethod
+    def build(cls, chunks: List[tuple], embedder: Optional[Callable] = None,
+              uri_prefix: str = 's3://knowledge-base/', mode: str = 'exact',
+              nlist: Optional[int] = None, pq_subspaces: Optional[int] = None, nprobe: int = 8) -> 'VectorIndex':
+        if mode not in MODES:
+            raise ValueError(f"Unknown vector index mode {mode!r} (expected one of {', '.join(MODES)})")
+        embedder = embedder or HashedNgramEmbedder()
+        texts = [f"{heading}\n{text}" for _, heading, text in chunks]
+        index = cls(np.ascontiguousarray(embedder(texts), dtype=np.float32), chunks, embedder,
+                    uri_prefix, mode, nprobe)
+        if mode != 'exact':
+            index.train_ivf(nlist or max(1, int(np.sqrt(len(chunks)))))
+        if mode == 'ivfpq':
+            index.train_pq(pq_subspaces or max(1, index.vectors.shape[1] // 8))
+        return index
+
+    def train_ivf(self, nlist: int):
+        self.centroids = kmeans(self.vectors, nlist, spherical=True)
+        assignment = assign(self.vectors, self.centroids, spherical=True)
+        self.list_ids = np.argsort(assignment, kind='stable').astype(np.int64)
+        self.list_offsets = np.searchsorted(assignment[self.list_ids], np.arange(len(self.centroids) + 1))
+
+    def train_pq(self, subspaces: int):
+        dim = self.vectors.shape[1]
+        if dim % subspaces:
+            raise ValueError(f"PQ subspaces ({subspaces}) must divide the vector dimension ({dim})")
+        parts = np.asarray(self.vectors).reshape(len(self.vectors), subspaces, dim // subspaces)
+        ksub = min(256, len(self.vectors))
+        self.codebooks = np.stack([kmeans(parts[:, j], ksub, seed=j) for j in range(subspaces)])
+        self.codes = np.stack([assign(parts[:, j], self.codebooks[j]) for j in range(subspaces)],
+                              axis=1).astype(np.uint8)
+
+    def search(self, query: str, k: int = 5) -> List[Dict]:
+        """Top-k passages as Bedrock retrievalResults"""
+        return self.search_batch([query], k)[0]
+
+    def search_batch(self, queries: Sequence[str], k: int = 5) -> List[List[Dict]]:
+        """Top-k passages for each query, embedding and scoring the queries together"""
+        q = np.asarray(self.embedder(list(queries)), dtype=np.float32)
+        if self.mode == 'exact' or self.centroids is None:
+            hits = self._exact(q, k)
+        else:
+            hits = [self._probe(row, k) for row in q]
+        return [[kb_index.passage_reference(self.chunks[i], s, self.uri_prefix) for i, s in row] for row in hits]
+
+    def _exact(self, q: 'np.ndarray', k: int) -> List[List[tuple]]:
+        """Blocked Q @ V.T over every vector, keeping a running top-k per query"""
+        best_ids = np.empty((len(q), 0), dtype=np.int64)
+        best_scores = np.empty((len(q), 0), dtype=np.float32)
+        for start in range(0, len(self.vectors), BLOCK_ROWS):
+            scores = q @ self.vectors[start:start + BLOCK_ROWS].T
+            ids = np.broadcast_to(np.arange(start, start + scores.shape[1]), scores.shape)
+            scores = np.concatenate([best_scores, scores], axis=1)
+            ids = np.concatenate([best_ids, ids], axis=1)
+            keep = np.stack([top_k(row, k) for row in scores])
+            best_scores = np.take_along_axis(scores, keep, axis=1)
+            best_ids = np.take_along_axis(ids, keep, axis=1)
+        return [list(zip(ids.tolist(), scores.tolist())) for ids, scores in zip(best_ids, best_scores)]
+
+    def _probe(self, q: 'np.ndarray', k: int) -> List[tuple]:
+        """Score the vectors of the nprobe closest clusters (from PQ codes in 'ivfpq' mode)"""
+        lists = top_k(self.centroids @ q, self.nprobe)
+        candidates = np.concatenate([self.list_ids[self.list_offsets[c]:self.list_offsets[c + 1]] for c in lists])
+        if self.codes is not None:
+            # Asymmetric distance: inner products of the query with every codeword, summed over subspaces
+            m, _, dsub = self.codebooks.shape
+            table = np.einsum('jd,jkd->jk', q.reshape(m, dsub), self.codebooks)
+            scores = table[np.arange(m), self.codes[candidates]].sum(axis=1)
+            # Re-rank a shortlist with the exact vectors
+            shortlist = candidates[top_k(scores, self.refine * k)]
+            candidates, scores = shortlist, self.vectors[shortlist] @ q
+        else:
+            scores = self.vectors[candidates] @ q
+        order = top_k(scores, k)
+        return list(zip(candidates[order].tolist(), scores[order].tolist()))
+
+    def save(self, directory: str, fingerprint=None):
+        """
+        vectors.npy (memory-mappable) plus index.pickle with everything else
+        but the embedder, which load() is given again, in a private directory
+        (see cache_files)
+        """
+        cache_files.ensure_private_dir(directory)
+        np.save(os.path.join(directory, 'vectors.npy'), np.asarray(self.vectors))
+        state = dict(self.__dict__, vectors=None, embedder=None, fingerprint=fingerprint)
+        cache_files.dump_pickle(state, os.path.join(directory, 'index.pickle'))
+
+    @classmethod
+    def load(cls, directory: str, embedder: Callable) -> 'VectorIndex':
+        state = cache_files.load_pickle(os.path.join(directory, 'index.pickle'))
+        if not cache_files.trusted_file(os.path.join(directory, 'vectors.npy')):
+            raise OSError(f"{directory}/vectors.npy is not a private cache file (owner or permissions)")
+        index = cls.__new__(cls)
+        index.__dict__.update(state)
+        index.embedder = embedder
+        index.vectors = np.load(os.path.join(directory, 'vectors.npy'), mmap_mode='r')
+        return index
+
+
+def load_vector_index(document_dir: str, index_dir: Optional[str] = None, uri_prefix: str = 's3://knowledge-base/',
+                      mode: str = 'exact', embedder: Optional[Callable] = None, **options) -> VectorIndex:
+    """
+    Vector index of the documents in document_dir, reusing the one saved in
+    index_dir when it was built from the same files, embedder and mode
+    """
+    embedder = embedder or HashedNgramEmbedder()
+    fingerprint = (kb_index.document_fingerprint(document_dir), uri_prefix, embedder_config(embedder), mode,
+                   tuple(sorted(options.items())))
+    if index_dir and os.path.exists(os.path.join(index_dir, 'index.pickle')):
+        try:
+            index = VectorIndex.load(index_dir, embedder)
+            if index.fingerprint == fingerprint:
+                return index
+        except (OSError, ValueError, pickle.UnpicklingError, EOFError, KeyError, AttributeError) as e:
+            logger.debug(f"Ignoring unreadable vector index {index_dir}: {e}")
+
+    index = VectorIndex.build(kb_index.load_chunks(document_dir), embedder, uri_prefix, mode, **options)
+
+    if index_dir:
+        try:
+            index.save(index_dir, fingerprint)
+        except OSError as e:
+            logger.debug(f"Could not write vector index {index_dir}: {e}")
+    index.fingerprint = fingerprint
+    return index
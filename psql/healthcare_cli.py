@@ -8,10 +8,15 @@ from botocore.exceptions import ClientError
 import psycopg2
 from psycopg2.extras import RealDictCursor
 import json
+import os
 import sys
 import re
 from datetime import datetime
-from typing import Dict, List, Optional
+from typing import Dict, Iterator, List, Optional
+
+# Streamed answers go through the Lambda package's assistant (lambda-package/healthcare_assistant.py)
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'lambda-package'))
+import healthcare_assistant
 
 # Configuration
 class Config:
@@ -26,6 +31,14 @@ class Config:
     DB_PASSWORD = 'iJ9%hSH@3ukD11060D'
 
 
+def shared_assistant(subject_id: int) -> healthcare_assistant.HealthcareAssistant:
+    """The Lambda package's HealthcareAssistant for the patient, on this CLI's database, region and model"""
+    for name in ('AWS_REGION', 'KNOWLEDGE_BASE_ID', 'MODEL_ARN', 'DB_HOST', 'DB_PORT', 'DB_NAME', 'DB_USER',
+                 'DB_PASSWORD'):
+        setattr(healthcare_assistant.Config, name, getattr(Config, name))
+    return healthcare_assistant.HealthcareAssistant(subject_id)
+
+
 class PatientDataRetriever:
     """Retrieve comprehensive patient data from PostgreSQL"""
     
@@ -443,6 +456,8 @@ class HealthcareAssistant:
         self.patient_retriever = PatientDataRetriever()
         self.conversation_history = []
         self.session_id = None
+        self.last_result = None  # Result of the latest query_stream()
+        self.streaming_assistant = None  # healthcare_assistant.HealthcareAssistant behind query_stream()
         self.patient_context = self.patient_retriever.build_patient_context(subject_id)
     
     def query(self, user_question: str) -> Dict:
@@ -680,6 +695,19 @@ class HealthcareAssistant:
                 'response_time_ms': response_time_ms
             }
     
+    def query_stream(self, user_question: str) -> Iterator[str]:
+        """
+        Like query(), but yields the answer text as the model generates it,
+        through the Lambda assistant's streaming path (shared Bedrock clients,
+        retries, KB retrieve + invoke_model, response cache). The result dict
+        (with 'first_token_ms') is left in self.last_result.
+        """
+        if self.streaming_assistant is None:
+            self.streaming_assistant = shared_assistant(self.subject_id)
+        self.last_result = yield from self.streaming_assistant.query_stream(user_question)
+        if self.last_result['success']:
+            self._update_memory(user_question, self.last_result['answer'])
+    
     def _save_to_database(self, question: str, answer: str, citations: list, 
                         response_time_ms: int, success: bool, error_message: str):
         """Save query to PostgreSQL for audit trail and analytics"""
@@ -828,6 +856,8 @@ Duration: {duration} seconds ({duration // 60} minutes)
     
     def close(self):
         self.patient_retriever.close()
+        if self.streaming_assistant is not None:
+            self.streaming_assistant.close()
 
 
 def print_header():
@@ -914,19 +944,30 @@ def main():
             
             # Query Assistant
             print("\n Analyzing patient data and retrieving relevant medical knowledge...")
-            result = assistant.query(question)
+            header_printed = False
+            for delta in assistant.query_stream(question):
+                if not header_printed:
+                    print("\n" + "─"*80)
+                    print(" CLINICAL ANSWER:")
+                    print("─"*80)
+                    header_printed = True
+                print(delta, end='', flush=True)
+            result = assistant.last_result
             
             if result['success']:
-                print("\n" + "─"*80)
-                print(" CLINICAL ANSWER:")
-                print("─"*80)
-                print(result['answer'])
+                if not header_printed:
+                    print("\n" + "─"*80)
+                    print(" CLINICAL ANSWER:")
+                    print("─"*80)
+                print()
                 
                 # Show query type and response time
                 query_type_icon = "🔍" if result.get('query_type') == 'kb' else "📊"
                 query_type_text = "Knowledge Base" if result.get('query_type') == 'kb' else "Patient Data"
                 print(f"\n{query_type_icon} Query type: {query_type_text}")
                 print(f"  Response time: {result['response_time_ms']}ms")
+                if result.get('first_token_ms') is not None:
+                    print(f"  First token: {result['first_token_ms']}ms")
                 
                 if result['citations']:
                     print("\n📚 KNOWLEDGE SOURCES:")
@@ -0,0 +1,39 @@
+-- ================================================================
+-- Composite per-patient time indexes
+-- Every "recent N" retriever query filters on subject_id and orders
+-- by a timestamp. A (subject_id, <time> DESC) index lets Postgres
+-- walk the newest rows of one patient and stop after LIMIT rows
+-- instead of sorting the patient's full history.
+--
+-- Apply to an existing database (schema.sql already includes these):
+--   psql -h your-db-host -U your-user -d your-db-name -f psql/migrations/001_composite_time_indexes.sql
+-- ================================================================
+
+CREATE INDEX IF NOT EXISTS idx_admissions_subject_time ON admissions(subject_id, admittime DESC);
+CREATE INDEX IF NOT EXISTS idx_labevents_subject_time ON labevents(subject_id, charttime DESC);
+CREATE INDEX IF NOT EXISTS idx_prescriptions_subject_time ON prescriptions(subject_id, starttime DESC);
+CREATE INDEX IF NOT EXISTS idx_emar_subject_time ON emar(subject_id, charttime DESC)
+    INCLUDE (medication, event_txt, scheduletime);
+CREATE INDEX IF NOT EXISTS idx_poe_subject_time ON poe(subject_id, ordertime DESC)
+    INCLUDE (poe_id, order_type, order_subtype, transaction_type, order_provider_id, order_status);
+CREATE INDEX IF NOT EXISTS idx_icustays_subject_time ON icustays(subject_id, intime DESC);
+CREATE INDEX IF NOT EXISTS idx_chartevents_subject_time ON chartevents(subject_id, charttime DESC);
+CREATE INDEX IF NOT EXISTS idx_inputevents_subject_time ON inputevents(subject_id, starttime DESC);
+
+-- The composites lead with subject_id, so the single-column indexes are redundant
+DROP INDEX IF EXISTS idx_admissions_subject;
+DROP INDEX IF EXISTS idx_labevents_subject;
+DROP INDEX IF EXISTS idx_prescriptions_subject;
+DROP INDEX IF EXISTS idx_emar_subject;
+DROP INDEX IF EXISTS idx_poe_subject;
+DROP INDEX IF EXISTS idx_icustays_subject;
+DROP INDEX IF EXISTS idx_chartevents_subject;
+
+ANALYZE admissions;
+ANALYZE labevents;
+ANALYZE prescriptions;
+ANALYZE emar;
+ANALYZE poe;
+ANALYZE icustays;
+ANALYZE chartevents;
+ANALYZE inputevents;
@@ -0,0 +1,18 @@
+-- ================================================================
+-- Precomputed patient context store
+-- Filled by lambda-package/precompute_contexts.py and read by
+-- HealthcareAssistant before falling back to a live context build.
+-- ================================================================
+
+CREATE TABLE IF NOT EXISTS patient_context_cache (
+    subject_id INTEGER PRIMARY KEY,
+    data_version VARCHAR(64) NOT NULL,  -- Fingerprint of the clinical data the context was built from
+    sections JSONB NOT NULL,  -- Rendered text block per context section
+    context_text TEXT NOT NULL,  -- Full rendered context
+    build_ms INTEGER,
+    built_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE INDEX IF NOT EXISTS idx_patient_context_cache_version ON patient_context_cache(data_version);
+
+COMMENT ON TABLE patient_context_cache IS 'Contexts built ahead of time; rows whose data_version is stale are ignored and rebuilt live.';
@@ -0,0 +1,32 @@
+-- ================================================================
+-- Admission- and stay-scoped time indexes
+-- Scoped retriever queries (ContextScope) filter on hadm_id or
+-- stay_id and order by a timestamp. A (hadm_id|stay_id, <time> DESC)
+-- index returns the newest rows of one admission or ICU stay without
+-- sorting it, and still serves plain hadm_id / stay_id lookups.
+--
+-- Apply to an existing database (schema.sql already includes these):
+--   psql -h your-db-host -U your-user -d your-db-name -f psql/migrations/003_scoped_time_indexes.sql
+-- ================================================================
+
+CREATE INDEX IF NOT EXISTS idx_labevents_hadm_time ON labevents(hadm_id, charttime DESC);
+CREATE INDEX IF NOT EXISTS idx_prescriptions_hadm_time ON prescriptions(hadm_id, starttime DESC);
+CREATE INDEX IF NOT EXISTS idx_emar_hadm_time ON emar(hadm_id, charttime DESC);
+CREATE INDEX IF NOT EXISTS idx_poe_hadm_time ON poe(hadm_id, ordertime DESC);
+CREATE INDEX IF NOT EXISTS idx_chartevents_stay_time ON chartevents(stay_id, charttime DESC);
+CREATE INDEX IF NOT EXISTS idx_inputevents_stay_time ON inputevents(stay_id, starttime DESC);
+
+-- The composites lead with hadm_id / stay_id, so the single-column indexes are redundant
+DROP INDEX IF EXISTS idx_labevents_hadm;
+DROP INDEX IF EXISTS idx_prescriptions_hadm;
+DROP INDEX IF EXISTS idx_emar_hadm;
+DROP INDEX IF EXISTS idx_poe_hadm;
+DROP INDEX IF EXISTS idx_chartevents_stay;
+DROP INDEX IF EXISTS idx_inputevents_stay;
+
+ANALYZE labevents;
+ANALYZE prescriptions;
+ANALYZE emar;
+ANALYZE poe;
+ANALYZE chartevents;
+ANALYZE inputevents;
@@ -0,0 +1,26 @@
+-- ================================================================
+-- Retriever query plan diagnostics
+-- Written by PatientDataRetriever when EXPLAIN_SAMPLE_RATE > 0: a
+-- sample of section queries slower than EXPLAIN_SLOW_MS is re-run
+-- under EXPLAIN (ANALYZE, BUFFERS) and its plan stored here, so plan
+-- regressions after data loads or schema changes can be traced.
+-- ================================================================
+
+CREATE TABLE IF NOT EXISTS retriever_diagnostics (
+    diagnostic_id SERIAL PRIMARY KEY,
+    method VARCHAR(100) NOT NULL,  -- Retriever method (get_recent_labs, cohort_get_recent_labs, ...)
+    statement VARCHAR(100) NOT NULL,  -- RETRIEVER_QUERIES name, including scope variants
+    endpoint VARCHAR(255),  -- Host the query ran on (primary or read replica)
+    duration_ms NUMERIC(10, 3),  -- Wall time of the original call, including fetch
+    row_count INTEGER,
+    planning_ms NUMERIC(10, 3),
+    execution_ms NUMERIC(10, 3),
+    shared_hit_blocks BIGINT,
+    shared_read_blocks BIGINT,
+    plan JSONB NOT NULL,  -- EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) output
+    captured_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE INDEX IF NOT EXISTS idx_retriever_diagnostics_method ON retriever_diagnostics(method, captured_at DESC);
+
+COMMENT ON TABLE retriever_diagnostics IS 'Sampled query plans of slow retriever section queries.';
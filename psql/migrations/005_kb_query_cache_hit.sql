@@ -0,0 +1,13 @@
+-- ================================================================
+-- Response cache marker on kb_queries
+-- HealthcareAssistant answers repeated questions (same normalized
+-- question, patient context, model and conversation state) from a
+-- process-wide response cache; those answers are still audited and
+-- flagged here so hit rates and LLM usage can be reported.
+-- ================================================================
+
+ALTER TABLE kb_queries ADD COLUMN IF NOT EXISTS cache_hit BOOLEAN DEFAULT false;
+
+CREATE INDEX IF NOT EXISTS idx_kb_queries_cache_hit ON kb_queries(cache_hit, created_at DESC);
+
+COMMENT ON COLUMN kb_queries.cache_hit IS 'Answer served from the response cache instead of the model.';
@@ -0,0 +1,57 @@
+-- ================================================================
+-- Clinical data version
+-- Replaces the row-count / max-id fingerprint behind get_data_version,
+-- which missed updates, deletes and lower-sorting new ids. Writers to
+-- the clinical tables serialize on the single version row (see below).
+-- ================================================================
+
+-- Clinical data version: bumped by a statement-level trigger on every write
+-- (INSERT / UPDATE / DELETE / TRUNCATE, including COPY) to the tables the patient
+-- context is built from, so patient_context_cache rows are never served from
+-- data that has changed since they were built (get_data_version)
+--
+-- Loader serialization: every write statement updates this one row, and the
+-- row lock is held until the writing transaction commits. Concurrent loaders
+-- (e.g. parallel COPY into different tables) therefore run one transaction at
+-- a time past their first statement. For parallel bulk loads, disable the
+-- triggers for the load and bump the version once at the end:
+--   ALTER TABLE labevents DISABLE TRIGGER bump_clinical_data_version;
+--   ... load ...
+--   ALTER TABLE labevents ENABLE TRIGGER bump_clinical_data_version;
+--   UPDATE clinical_data_version SET version = version + 1, changed_at = CURRENT_TIMESTAMP;
+CREATE TABLE IF NOT EXISTS clinical_data_version (
+    id BOOLEAN PRIMARY KEY DEFAULT TRUE CHECK (id),  -- Single row
+    version BIGINT NOT NULL DEFAULT 1,
+    changed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+INSERT INTO clinical_data_version (id) VALUES (TRUE) ON CONFLICT (id) DO NOTHING;
+
+COMMENT ON TABLE clinical_data_version IS 'Counter bumped by every write to the clinical tables; part of patient_context_cache.data_version.';
+
+CREATE OR REPLACE FUNCTION bump_clinical_data_version() RETURNS trigger AS $$
+BEGIN
+    UPDATE clinical_data_version SET version = version + 1, changed_at = CURRENT_TIMESTAMP;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DO $$
+DECLARE
+    table_name TEXT;
+BEGIN
+    FOREACH table_name IN ARRAY ARRAY[
+        'patients', 'admissions', 'diagnoses_icd', 'd_icd_diagnoses', 'procedures_icd', 'd_icd_procedures',
+        'drgcodes', 'labevents', 'd_labitems', 'prescriptions', 'emar', 'poe', 'icustays', 'chartevents',
+        'd_items', 'inputevents'
+    ] LOOP
+        EXECUTE format('DROP TRIGGER IF EXISTS bump_clinical_data_version ON %I', table_name);
+        EXECUTE format(
+            'CREATE TRIGGER bump_clinical_data_version
+             AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON %I
+             FOR EACH STATEMENT EXECUTE FUNCTION bump_clinical_data_version()',
+            table_name
+        );
+    END LOOP;
+END;
+$$;
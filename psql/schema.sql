@@ -19,6 +19,7 @@ CREATE TABLE kb_queries (
     success BOOLEAN DEFAULT true,
     error_message TEXT,
     model_arn VARCHAR(500),
+    cache_hit BOOLEAN DEFAULT false,  -- Answered from the assistant's response cache
     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
     
     CONSTRAINT check_response_time CHECK (response_time_ms >= 0)
@@ -28,6 +29,7 @@ CREATE INDEX idx_kb_queries_subject_id ON kb_queries(subject_id) WHERE subject_i
 CREATE INDEX idx_kb_queries_created_at ON kb_queries(created_at DESC);
 CREATE INDEX idx_kb_queries_session_id ON kb_queries(session_id) WHERE session_id IS NOT NULL;
 CREATE INDEX idx_kb_queries_success ON kb_queries(success, created_at DESC);
+CREATE INDEX idx_kb_queries_cache_hit ON kb_queries(cache_hit, created_at DESC);
 
 CREATE TABLE kb_citations (
     citation_id SERIAL PRIMARY KEY,
@@ -77,6 +79,42 @@ CREATE INDEX idx_knowledge_sources_type ON knowledge_sources(document_type);
 CREATE INDEX idx_knowledge_sources_name ON knowledge_sources(document_name);
 
 
+-- Precomputed patient contexts (lambda-package/precompute_contexts.py)
+CREATE TABLE patient_context_cache (
+    subject_id INTEGER PRIMARY KEY,
+    data_version VARCHAR(64) NOT NULL,  -- Fingerprint of the clinical data the context was built from
+    sections JSONB NOT NULL,  -- Rendered text block per context section
+    context_text TEXT NOT NULL,  -- Full rendered context
+    build_ms INTEGER,
+    built_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE INDEX idx_patient_context_cache_version ON patient_context_cache(data_version);
+
+COMMENT ON TABLE patient_context_cache IS 'Contexts built ahead of time; rows whose data_version is stale are ignored and rebuilt live.';
+
+
+-- Sampled plans of slow retriever queries (EXPLAIN_SAMPLE_RATE in lambda-package/healthcare_assistant.py)
+CREATE TABLE retriever_diagnostics (
+    diagnostic_id SERIAL PRIMARY KEY,
+    method VARCHAR(100) NOT NULL,  -- Retriever method (get_recent_labs, cohort_get_recent_labs, ...)
+    statement VARCHAR(100) NOT NULL,  -- RETRIEVER_QUERIES name, including scope variants
+    endpoint VARCHAR(255),  -- Host the query ran on (primary or read replica)
+    duration_ms NUMERIC(10, 3),  -- Wall time of the original call, including fetch
+    row_count INTEGER,
+    planning_ms NUMERIC(10, 3),
+    execution_ms NUMERIC(10, 3),
+    shared_hit_blocks BIGINT,
+    shared_read_blocks BIGINT,
+    plan JSONB NOT NULL,  -- EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) output
+    captured_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE INDEX idx_retriever_diagnostics_method ON retriever_diagnostics(method, captured_at DESC);
+
+COMMENT ON TABLE retriever_diagnostics IS 'Sampled query plans of slow retriever section queries.';
+
+
 -- ====================
 -- HOSP MODULE (Hospital EHR Data)
 -- ====================
@@ -122,7 +160,7 @@ CREATE TABLE admissions (
     CONSTRAINT check_times CHECK (dischtime IS NULL OR dischtime >= admittime)
 );
 
-CREATE INDEX idx_admissions_subject ON admissions(subject_id);
+CREATE INDEX idx_admissions_subject_time ON admissions(subject_id, admittime DESC);
 CREATE INDEX idx_admissions_time ON admissions(admittime, dischtime);
 CREATE INDEX idx_admissions_admit_provider ON admissions(admit_provider_id);
 
@@ -165,8 +203,9 @@ CREATE TABLE labevents (
     comments TEXT
 );
 
-CREATE INDEX idx_labevents_subject ON labevents(subject_id);
-CREATE INDEX idx_labevents_hadm ON labevents(hadm_id);
+-- Per-patient "most recent N" lookups: equality on subject_id, ordered by time
+CREATE INDEX idx_labevents_subject_time ON labevents(subject_id, charttime DESC);
+CREATE INDEX idx_labevents_hadm_time ON labevents(hadm_id, charttime DESC);
 CREATE INDEX idx_labevents_itemid ON labevents(itemid);
 CREATE INDEX idx_labevents_charttime ON labevents(charttime);
 CREATE INDEX idx_labevents_specimen ON labevents(specimen_id);
@@ -249,8 +288,9 @@ CREATE TABLE emar (
     storetime TIMESTAMP
 );
 
-CREATE INDEX idx_emar_subject ON emar(subject_id);
-CREATE INDEX idx_emar_hadm ON emar(hadm_id);
+CREATE INDEX idx_emar_subject_time ON emar(subject_id, charttime DESC)
+    INCLUDE (medication, event_txt, scheduletime);
+CREATE INDEX idx_emar_hadm_time ON emar(hadm_id, charttime DESC);
 CREATE INDEX idx_emar_charttime ON emar(charttime);
 
 
@@ -316,8 +356,8 @@ CREATE TABLE prescriptions (
     route VARCHAR(50)
 );
 
-CREATE INDEX idx_prescriptions_subject ON prescriptions(subject_id);
-CREATE INDEX idx_prescriptions_hadm ON prescriptions(hadm_id);
+CREATE INDEX idx_prescriptions_subject_time ON prescriptions(subject_id, starttime DESC);
+CREATE INDEX idx_prescriptions_hadm_time ON prescriptions(hadm_id, starttime DESC);
 CREATE INDEX idx_prescriptions_drug ON prescriptions(drug);
 
 
@@ -337,8 +377,9 @@ CREATE TABLE poe (
     order_status VARCHAR(50)
 );
 
-CREATE INDEX idx_poe_subject ON poe(subject_id);
-CREATE INDEX idx_poe_hadm ON poe(hadm_id);
+CREATE INDEX idx_poe_subject_time ON poe(subject_id, ordertime DESC)
+    INCLUDE (poe_id, order_type, order_subtype, transaction_type, order_provider_id, order_status);
+CREATE INDEX idx_poe_hadm_time ON poe(hadm_id, ordertime DESC);
 CREATE INDEX idx_poe_provider ON poe(order_provider_id);
 
 
@@ -426,7 +467,7 @@ CREATE TABLE icustays (
     los NUMERIC  -- Length of stay in days
 );
 
-CREATE INDEX idx_icustays_subject ON icustays(subject_id);
+CREATE INDEX idx_icustays_subject_time ON icustays(subject_id, intime DESC);
 CREATE INDEX idx_icustays_hadm ON icustays(hadm_id);
 CREATE INDEX idx_icustays_time ON icustays(intime, outtime);
 
@@ -461,8 +502,8 @@ CREATE TABLE chartevents (
     warning SMALLINT  -- Data quality warning flag
 );
 
-CREATE INDEX idx_chartevents_subject ON chartevents(subject_id);
-CREATE INDEX idx_chartevents_stay ON chartevents(stay_id);
+CREATE INDEX idx_chartevents_subject_time ON chartevents(subject_id, charttime DESC);
+CREATE INDEX idx_chartevents_stay_time ON chartevents(stay_id, charttime DESC);
 CREATE INDEX idx_chartevents_itemid ON chartevents(itemid);
 CREATE INDEX idx_chartevents_charttime ON chartevents(charttime);
 
@@ -518,7 +559,8 @@ CREATE TABLE inputevents (
     originalrate NUMERIC
 );
 
-CREATE INDEX idx_inputevents_stay ON inputevents(stay_id);
+CREATE INDEX idx_inputevents_subject_time ON inputevents(subject_id, starttime DESC);
+CREATE INDEX idx_inputevents_stay_time ON inputevents(stay_id, starttime DESC);
 CREATE INDEX idx_inputevents_itemid ON inputevents(itemid);
 CREATE INDEX idx_inputevents_time ON inputevents(starttime, endtime);
 
@@ -611,6 +653,58 @@ CREATE TABLE caregiver (
 COMMENT ON TABLE caregiver IS 'Deidentified care provider who documented ICU data in MetaVision.';
 
 
+-- Clinical data version: bumped by a statement-level trigger on every write
+-- (INSERT / UPDATE / DELETE / TRUNCATE, including COPY) to the tables the patient
+-- context is built from, so patient_context_cache rows are never served from
+-- data that has changed since they were built (get_data_version)
+--
+-- Loader serialization: every write statement updates this one row, and the
+-- row lock is held until the writing transaction commits. Concurrent loaders
+-- (e.g. parallel COPY into different tables) therefore run one transaction at
+-- a time past their first statement. For parallel bulk loads, disable the
+-- triggers for the load and bump the version once at the end:
+--   ALTER TABLE labevents DISABLE TRIGGER bump_clinical_data_version;
+--   ... load ...
+--   ALTER TABLE labevents ENABLE TRIGGER bump_clinical_data_version;
+--   UPDATE clinical_data_version SET version = version + 1, changed_at = CURRENT_TIMESTAMP;
+CREATE TABLE IF NOT EXISTS clinical_data_version (
+    id BOOLEAN PRIMARY KEY DEFAULT TRUE CHECK (id),  -- Single row
+    version BIGINT NOT NULL DEFAULT 1,
+    changed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+INSERT INTO clinical_data_version (id) VALUES (TRUE) ON CONFLICT (id) DO NOTHING;
+
+COMMENT ON TABLE clinical_data_version IS 'Counter bumped by every write to the clinical tables; part of patient_context_cache.data_version.';
+
+CREATE OR REPLACE FUNCTION bump_clinical_data_version() RETURNS trigger AS $$
+BEGIN
+    UPDATE clinical_data_version SET version = version + 1, changed_at = CURRENT_TIMESTAMP;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DO $$
+DECLARE
+    table_name TEXT;
+BEGIN
+    FOREACH table_name IN ARRAY ARRAY[
+        'patients', 'admissions', 'diagnoses_icd', 'd_icd_diagnoses', 'procedures_icd', 'd_icd_procedures',
+        'drgcodes', 'labevents', 'd_labitems', 'prescriptions', 'emar', 'poe', 'icustays', 'chartevents',
+        'd_items', 'inputevents'
+    ] LOOP
+        EXECUTE format('DROP TRIGGER IF EXISTS bump_clinical_data_version ON %I', table_name);
+        EXECUTE format(
+            'CREATE TRIGGER bump_clinical_data_version
+             AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON %I
+             FOR EACH STATEMENT EXECUTE FUNCTION bump_clinical_data_version()',
+            table_name
+        );
+    END LOOP;
+END;
+$$;
+
+
 -- ======================
 -- ANALYTICS VIEWS
 -- ======================